@@ -0,0 +1,117 @@
+"""Synthetic stand-ins for the discord.py cache, shaped like the attributes the syncers read."""
+from collections import namedtuple
+import datetime
+import random
+import typing as t
+
+# Stands in for `discord.Colour` and `discord.Permissions`, which the syncers read `value` from
+Value = namedtuple('Value', ('value',))
+
+EPOCH = datetime.datetime(2015, 1, 1)
+
+
+class FakeRole:
+    """A cached role."""
+
+    __slots__ = ('id', 'name', 'color', 'created_at', 'permissions', 'position', 'guild')
+
+    def __init__(self, id_: int, name: str, position: int, guild: 'FakeGuild', rng: random.Random) -> None:
+        self.id = id_
+        self.name = name
+        self.color = Value(rng.getrandbits(24))
+        self.created_at = EPOCH + datetime.timedelta(seconds=rng.randrange(10 ** 8))
+        self.permissions = Value(rng.getrandbits(31))
+        self.position = position
+        self.guild = guild
+
+
+class FakeUser:
+    """A cached user, shared by the user's members."""
+
+    __slots__ = ('id', 'name', 'discriminator', 'created_at', 'avatar_url')
+
+    def __init__(self, id_: int, rng: random.Random) -> None:
+        self.id = id_
+        self.name = f'user-{id_ % 100_000}'
+        self.discriminator = f'{rng.randrange(10000):04}'
+        self.created_at = EPOCH + datetime.timedelta(seconds=rng.randrange(10 ** 8))
+        self.avatar_url = f'https://cdn.discordapp.com/avatars/{id_}/{rng.getrandbits(128):032x}.webp?size=1024'
+
+
+class FakeMember:
+    """A cached member; a user in one guild, with the guild's roles they have."""
+
+    __slots__ = ('_user', 'guild', 'roles')
+
+    def __init__(self, user: FakeUser, guild: 'FakeGuild', roles: t.List[FakeRole]) -> None:
+        self._user = user
+        self.guild = guild
+        self.roles = roles
+
+    def __getattr__(self, name: str) -> t.Any:
+        return getattr(self._user, name)
+
+
+class FakeGuild:
+    """A cached guild."""
+
+    def __init__(self, id_: int, rng: random.Random) -> None:
+        self.id = id_
+        self.name = f'guild-{id_ % 100_000}'
+        self.created_at = EPOCH + datetime.timedelta(seconds=rng.randrange(10 ** 8))
+        self.icon_url = f'https://cdn.discordapp.com/icons/{id_}/{rng.getrandbits(128):032x}.webp?size=1024'
+
+        self.roles: t.List[FakeRole] = list()
+        self._members: t.Dict[int, FakeMember] = dict()
+
+    @property
+    def members(self) -> t.List[FakeMember]:
+        """The members of the guild."""
+        return list(self._members.values())
+
+    @property
+    def member_count(self) -> int:
+        """The number of members in the guild."""
+        return len(self._members)
+
+    @property
+    def default_role(self) -> FakeRole:
+        """The `@everyone` role of the guild."""
+        return self.roles[0]
+
+    def get_member(self, user_id: int) -> t.Optional[FakeMember]:
+        """Return the member with the ID `user_id`, or None if they aren't in the guild."""
+        return self._members.get(user_id)
+
+
+def snowflake(rng: random.Random) -> int:
+    """Return a random ID shaped like a Discord snowflake."""
+    return (rng.randrange(10 ** 11, 10 ** 12) << 22) | rng.getrandbits(22)
+
+
+def make_guilds(
+    guilds: int, users: int, roles_per_guild: int = 20, guilds_per_user: int = 3, seed: int = 0
+) -> t.List[FakeGuild]:
+    """
+    Generate `guilds` guilds shared between `users` users.
+
+    Each user is a member of 1 to `guilds_per_user` random guilds, with up to 3 roles in each.
+    """
+    rng = random.Random(seed)
+    fake_guilds = [FakeGuild(snowflake(rng), rng) for _ in range(guilds)]
+
+    for guild in fake_guilds:
+        # The first role stands in for @everyone, which every member has
+        guild.roles = [
+            FakeRole(guild.id if position == 0 else snowflake(rng), f'role-{position}', position, guild, rng)
+            for position in range(roles_per_guild)
+        ]
+
+    for _ in range(users):
+        user = FakeUser(snowflake(rng), rng)
+
+        for guild in rng.sample(fake_guilds, rng.randint(1, min(guilds_per_user, guilds))):
+            roles = [guild.default_role, *rng.sample(guild.roles[1:], rng.randint(0, min(3, roles_per_guild - 1)))]
+            guild._members[user.id] = FakeMember(user, guild, roles)
+
+    return fake_guilds
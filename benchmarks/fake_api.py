@@ -0,0 +1,357 @@
+"""
+An in-memory stand-in for the Snek API, serving the endpoints used by `snek.exts.syncer`.
+
+Run with `python -m benchmarks.fake_api [--port 8000] [--latency 0.01] [--error-rate 0.01]`,
+then point the bot at it with `SNEK_SITE_URL=http://127.0.0.1:8000`.
+"""
+import argparse
+import asyncio
+from bisect import bisect_left
+from collections import Counter
+import hashlib
+import json
+import random
+import typing as t
+from urllib.parse import urlencode
+
+from aiohttp import web
+
+# The fields each collection requires, and the one that identifies an object
+COLLECTIONS = {
+    'guilds': ('id', ('id', 'name', 'created_at', 'icon_url')),
+    'roles': ('id', ('id', 'name', 'color', 'created_at', 'permissions', 'position', 'guild')),
+    'users': ('id', ('id', 'name', 'discriminator', 'created_at', 'avatar_url', 'roles', 'guilds')),
+    'guild_configs': ('guild', ('guild', 'mod_role', 'admin_role', 'command_prefix'))
+}
+
+CONFIG_DEFAULTS = {
+    'mod_role': None,
+    'admin_role': None,
+    'command_prefix': '!'
+}
+
+PAGINATION_PARAMS = ('limit', 'offset')
+
+
+class FakeSnekAPI:
+    """
+    The state and request handlers of the stand-in API.
+
+    Every request to `/api/` is delayed by `latency` seconds (plus up to `jitter` seconds) and
+    fails with a 503 with a probability of `error_rate`.
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0, seed: int = 0) -> None:
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+
+        self.data: t.Dict[str, t.Dict[int, t.Dict]] = {name: dict() for name in COLLECTIONS}
+        self.requests = Counter()
+
+        # Bumped on every write to a collection, and sent as the ETag of its lists
+        self.versions = Counter()
+
+        # The sorted IDs and prefix XORs of the row hashes of each collection, and the version they're of
+        self.checksum_indexes: t.Dict[str, t.Tuple[int, t.List[int], t.List[int]]] = dict()
+
+    def create_app(self) -> web.Application:
+        """Create the aiohttp application serving the API."""
+        app = web.Application(middlewares=[self.middleware], client_max_size=1024 ** 3)
+
+        app.router.add_get('/_stats', self.get_stats)
+        app.router.add_delete('/_stats', self.reset_stats)
+
+        app.router.add_get('/api/{collection}', self.list_objects)
+        app.router.add_post('/api/{collection}', self.create_objects)
+        app.router.add_post('/api/{collection}/checksums', self.checksums)
+        app.router.add_put('/api/{collection}/bulk_update', self.bulk_update)
+        app.router.add_delete('/api/{collection}/bulk_delete', self.bulk_delete)
+        app.router.add_get(r'/api/{collection}/{id:\d+}', self.get_object)
+        app.router.add_put(r'/api/{collection}/{id:\d+}', self.update_object)
+        app.router.add_patch(r'/api/{collection}/{id:\d+}', self.update_object)
+        app.router.add_delete(r'/api/{collection}/{id:\d+}', self.delete_object)
+
+        return app
+
+    @web.middleware
+    async def middleware(self, request: web.Request, handler: t.Callable) -> web.StreamResponse:
+        """Count requests by route, and inject latency and errors into API requests."""
+        if not request.path.startswith('/api/'):
+            return await handler(request)
+
+        route = request.match_info.route.resource
+        self.requests[f'{request.method} {route.canonical if route else request.path}'] += 1
+
+        if self.latency or self.jitter:
+            await asyncio.sleep(self.latency + self.random.uniform(0, self.jitter))
+
+        if self.random.random() < self.error_rate:
+            return web.json_response({'detail': 'Injected failure.'}, status=503)
+
+        return await handler(request)
+
+    def collection(self, request: web.Request) -> t.Dict[int, t.Dict]:
+        """Return the objects of the collection requested, raising a 404 if there is no such collection."""
+        if (name := request.match_info['collection']) not in self.data:
+            raise web.HTTPNotFound()
+
+        return self.data[name]
+
+    def etag(self, collection: str) -> str:
+        """Return the ETag of `collection`, which changes whenever any object in it does."""
+        return f'"{collection}-{self.versions[collection]}"'
+
+    @staticmethod
+    def row_hash(obj: t.Dict) -> int:
+        """Return the 64-bit BLAKE2b hash of the canonical JSON of `obj`, as the bot computes it."""
+        data = json.dumps(obj, sort_keys=True, separators=(',', ':')).encode()
+        return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'big')
+
+    def checksum_index(self, collection: str) -> t.Tuple[t.List[int], t.List[int]]:
+        """Return the sorted IDs and the prefix XORs of the row hashes of `collection`, rebuilt if it changed."""
+        version = self.versions[collection]
+
+        if (index := self.checksum_indexes.get(collection)) is None or index[0] != version:
+            objects = self.data[collection]
+            ids = sorted(objects)
+
+            prefix = [0]
+            for id_ in ids:
+                prefix.append(prefix[-1] ^ self.row_hash(objects[id_]))
+
+            index = self.checksum_indexes[collection] = (version, ids, prefix)
+
+        return index[1], index[2]
+
+    def candidates(self, collection: str, filters: t.Dict[str, str]) -> t.Iterable[t.Dict]:
+        """Return the objects of `collection` that could match `filters`, looked up by ID like an index would."""
+        objects = self.data[collection]
+
+        if 'id__in' in filters:
+            return [objects[id_] for id_ in map(int, filters['id__in'].split(',')) if id_ in objects]
+
+        if 'id__gte' in filters or 'id__lt' in filters:
+            ids, _ = self.checksum_index(collection)
+            start = bisect_left(ids, int(filters.get('id__gte', 0)))
+            end = bisect_left(ids, int(filters['id__lt'])) if 'id__lt' in filters else len(ids)
+            return [objects[id_] for id_ in ids[start:end]]
+
+        return objects.values()
+
+    @staticmethod
+    def validate(collection: str, obj: t.Any, partial: bool = False) -> t.Dict:
+        """Return the errors of `obj` for `collection`, in the style of Django REST Framework."""
+        if not isinstance(obj, dict):
+            return {'non_field_errors': ['Expected an object.']}
+
+        _, fields = COLLECTIONS[collection]
+        errors = {field: ['This field is required.'] for field in fields if field not in obj and not partial}
+        errors.update({field: ['Unknown field.'] for field in obj if field not in fields})
+
+        return errors
+
+    @staticmethod
+    def matches(obj: t.Dict, filters: t.Dict[str, str]) -> bool:
+        """Return whether `obj` matches the query parameter `filters`."""
+        for name, value in filters.items():
+            if name == 'id__in':
+                if str(obj['id']) not in value.split(','):
+                    return False
+
+            elif name == 'id__gte':
+                if obj['id'] < int(value):
+                    return False
+
+            elif name == 'id__lt':
+                if obj['id'] >= int(value):
+                    return False
+
+            elif isinstance(field := obj.get(name), list):
+                if int(value) not in field:
+                    return False
+
+            elif str(field) != value:
+                return False
+
+        return True
+
+    async def get_stats(self, _: web.Request) -> web.Response:
+        """Return the number of requests served per route, and the size of each collection."""
+        return web.json_response({
+            'requests': dict(self.requests),
+            'sizes': {name: len(objects) for name, objects in self.data.items()}
+        })
+
+    async def reset_stats(self, _: web.Request) -> web.Response:
+        """Reset the request counters."""
+        self.requests.clear()
+        return web.Response(status=204)
+
+    async def list_objects(self, request: web.Request) -> web.Response:
+        """
+        List a collection, paginated with `limit` and `offset` if they are given.
+
+        The ETag of the whole collection is sent with every page, and a 304 is returned instead if
+        it matches `If-None-Match`.
+        """
+        self.collection(request)
+        etag = self.etag(request.match_info['collection'])
+
+        if request.headers.get('If-None-Match') == etag:
+            return web.Response(status=304, headers={'ETag': etag})
+
+        filters = {name: value for name, value in request.query.items() if name not in PAGINATION_PARAMS}
+        candidates = self.candidates(request.match_info['collection'], filters)
+        results = [obj for obj in candidates if self.matches(obj, filters)]
+
+        if 'limit' not in request.query:
+            return web.json_response(results, headers={'ETag': etag})
+
+        limit = int(request.query['limit'])
+        offset = int(request.query.get('offset', 0))
+
+        next_url = None
+        if offset + limit < len(results):
+            next_url = str(request.url.with_query(urlencode({**request.query, 'offset': offset + limit})))
+
+        return web.json_response({
+            'count': len(results),
+            'next': next_url,
+            'previous': None,
+            'results': results[offset:offset + limit]
+        }, headers={'ETag': etag})
+
+    async def create_objects(self, request: web.Request) -> web.Response:
+        """Create an object, or a list of objects atomically."""
+        objects = self.collection(request)
+        collection = request.match_info['collection']
+        key, _ = COLLECTIONS[collection]
+
+        payload = await request.json()
+        many = isinstance(payload, list)
+        items = payload if many else [payload]
+
+        errors = [self.validate(collection, item) for item in items]
+        for item, item_errors in zip(items, errors):
+            if not item_errors and item[key] in objects:
+                item_errors[key] = ['An object with this ID already exists.']
+
+        if any(errors):
+            return web.json_response(errors if many else errors[0], status=400)
+
+        for item in items:
+            objects[item[key]] = dict(item)
+
+            if collection == 'guilds':
+                self.data['guild_configs'].setdefault(item['id'], {'guild': item['id'], **CONFIG_DEFAULTS})
+                self.versions['guild_configs'] += 1
+
+        self.versions[collection] += 1
+
+        return web.json_response(payload, status=201)
+
+    async def checksums(self, request: web.Request) -> web.Response:
+        """Return the number of objects and the XOR of their row hashes in each `[lo, hi)` ID range."""
+        self.collection(request)
+        ids, prefix = self.checksum_index(request.match_info['collection'])
+
+        results = []
+        for lo, hi in (await request.json())['buckets']:
+            start, end = bisect_left(ids, lo), bisect_left(ids, hi)
+            results.append({'count': end - start, 'checksum': f'{prefix[end] ^ prefix[start]:016x}'})
+
+        return web.json_response(results)
+
+    async def bulk_update(self, request: web.Request) -> web.Response:
+        """Replace a list of objects atomically."""
+        objects = self.collection(request)
+        collection = request.match_info['collection']
+        key, _ = COLLECTIONS[collection]
+
+        items = await request.json()
+        if not isinstance(items, list):
+            return web.json_response({'non_field_errors': ['Expected a list.']}, status=400)
+
+        errors = [self.validate(collection, item) for item in items]
+        for item, item_errors in zip(items, errors):
+            if not item_errors and item[key] not in objects:
+                item_errors[key] = ['No object with this ID exists.']
+
+        if any(errors):
+            return web.json_response(errors, status=400)
+
+        for item in items:
+            objects[item[key]] = dict(item)
+
+        self.versions[collection] += 1
+        return web.json_response(items)
+
+    async def bulk_delete(self, request: web.Request) -> web.Response:
+        """Delete a list of objects by ID atomically."""
+        objects = self.collection(request)
+        ids = await request.json()
+
+        if missing := [id_ for id_ in ids if id_ not in objects]:
+            return web.json_response({'non_field_errors': [f'No objects exist with the IDs {missing}.']}, status=400)
+
+        for id_ in ids:
+            del objects[id_]
+
+        self.versions[request.match_info['collection']] += 1
+        return web.Response(status=204)
+
+    async def get_object(self, request: web.Request) -> web.Response:
+        """Return an object."""
+        objects = self.collection(request)
+
+        if (obj := objects.get(int(request.match_info['id']))) is None:
+            return web.json_response({'detail': 'Not found.'}, status=404)
+
+        return web.json_response(obj)
+
+    async def update_object(self, request: web.Request) -> web.Response:
+        """Replace (PUT) or update (PATCH) an object."""
+        objects = self.collection(request)
+        collection = request.match_info['collection']
+        id_ = int(request.match_info['id'])
+
+        if id_ not in objects:
+            return web.json_response({'detail': 'Not found.'}, status=404)
+
+        payload = await request.json()
+        if errors := self.validate(collection, payload, partial=request.method == 'PATCH'):
+            return web.json_response(errors, status=400)
+
+        objects[id_].update(payload)
+        self.versions[collection] += 1
+        return web.json_response(objects[id_])
+
+    async def delete_object(self, request: web.Request) -> web.Response:
+        """Delete an object."""
+        objects = self.collection(request)
+
+        if objects.pop(int(request.match_info['id']), None) is None:
+            return web.json_response({'detail': 'Not found.'}, status=404)
+
+        self.versions[request.match_info['collection']] += 1
+        return web.Response(status=204)
+
+
+def main() -> None:
+    """Serve the stand-in API until interrupted."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every request')
+    parser.add_argument('--jitter', type=float, default=0.0, help='maximum random seconds added on top')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='probability of a request failing with a 503')
+    args = parser.parse_args()
+
+    api = FakeSnekAPI(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate)
+    web.run_app(api.create_app(), host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
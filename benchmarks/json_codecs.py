@@ -0,0 +1,62 @@
+"""
+Compare the JSON codecs available to `APIClient` on realistic `users` payloads.
+
+Run with `python -m benchmarks.json_codecs [--users N] [--repeat N]`.
+"""
+import argparse
+import random
+import timeit
+import typing as t
+
+from snek.api.serialization import CODECS, JSONCodec
+
+
+def make_users(count: int, seed: int = 0) -> t.List[t.Dict]:
+    """Generate `count` user payloads shaped like the ones the `users` endpoint returns."""
+    rng = random.Random(seed)
+    guild_ids = [rng.getrandbits(63) for _ in range(50)]
+    role_ids = [rng.getrandbits(63) for _ in range(500)]
+
+    return [
+        {
+            'id': (user_id := rng.getrandbits(63)),
+            'name': f'user-{index}',
+            'discriminator': f'{rng.randrange(10000):04}',
+            'created_at': f'2019-{rng.randrange(1, 13):02}-{rng.randrange(1, 29):02} 12:34:56.789000',
+            'avatar_url': f'https://cdn.discordapp.com/avatars/{user_id}/{rng.getrandbits(128):032x}.webp?size=1024',
+            'roles': sorted(rng.sample(role_ids, rng.randrange(1, 8))),
+            'guilds': sorted(rng.sample(guild_ids, rng.randrange(1, 4)))
+        }
+        for index in range(count)
+    ]
+
+
+def bench_codec(codec: JSONCodec, payload: t.List[t.Dict], repeat: int) -> t.Tuple[float, float, int]:
+    """Return the best encode and decode time for `payload`, and the encoded size."""
+    encoded = codec.dumps(payload)
+
+    encode = min(timeit.repeat(lambda: codec.dumps(payload), number=1, repeat=repeat))
+    decode = min(timeit.repeat(lambda: codec.loads(encoded), number=1, repeat=repeat))
+
+    return encode, decode, len(encoded)
+
+
+def main() -> None:
+    """Run the benchmark and print a table of results."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, nargs='+', default=[1_000, 10_000, 50_000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f'{"users":>8} {"codec":>8} {"encode ms":>10} {"decode ms":>10} {"size KiB":>10}')
+
+    for count in args.users:
+        payload = make_users(count)
+
+        for codec in CODECS.values():
+            encode, decode, size = bench_codec(codec, payload, args.repeat)
+            print(f'{count:>8} {codec.name:>8} {encode * 1000:>10.2f} {decode * 1000:>10.2f} {size / 1024:>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
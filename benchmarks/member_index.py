@@ -0,0 +1,83 @@
+"""
+Compare building the users of `UserSyncer` with `MembershipIndex` against scanning every guild per user.
+
+Run with `python -m benchmarks.member_index [--users 10000 100000] [--guilds 300] [--legacy-max 20000]`.
+"""
+import argparse
+import asyncio
+import os
+import time
+import types
+import typing as t
+
+from benchmarks.dataset import FakeGuild, make_guilds
+
+os.environ.setdefault('SNEK_API_TOKEN', 'benchmark')
+
+from snek.exts.syncer.syncers.user import User, UserSyncer  # noqa: E402
+
+
+def legacy_cache_objects(guilds: t.List[FakeGuild]) -> t.Dict[int, User]:
+    """Build the users the way `UserSyncer` did before the index, probing every guild for every user."""
+    cache_users_dict = dict()
+    for guild in guilds:
+        for user in guild.members:
+            if user.id in cache_users_dict.keys():
+                user_dict = cache_users_dict[user.id]._asdict()
+                roles = user_dict.pop('roles') + tuple(role.id for role in user.roles)
+                cache_users_dict[user.id] = User(
+                    roles=tuple(sorted(roles)),
+                    **user_dict
+                )
+
+            else:
+                cache_users_dict[user.id] = User(
+                    id=user.id,
+                    name=user.name,
+                    discriminator=user.discriminator,
+                    created_at=str(user.created_at),
+                    avatar_url=str(user.avatar_url),
+                    roles=tuple(sorted(role.id for role in user.roles)),
+                    guilds=tuple(g.id for g in guilds if g.get_member(user.id) is not None)
+                )
+
+    return cache_users_dict
+
+
+def timed(func: t.Callable[[], t.Mapping[int, User]]) -> t.Tuple[float, t.Mapping[int, User]]:
+    """Return the wall time of calling `func`, and what it returned."""
+    started = time.perf_counter()
+    result = func()
+    return time.perf_counter() - started, result
+
+
+def main() -> None:
+    """Run the benchmark for each dataset size and print a table of results."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, nargs='+', default=[10_000, 100_000])
+    parser.add_argument('--guilds', type=int, default=300)
+    parser.add_argument('--legacy-max', type=int, default=20_000, help='largest dataset to run the old scan on')
+    args = parser.parse_args()
+
+    print(f'{"users":>8} {"guilds":>7} {"members":>9} {"index s":>9} {"legacy s":>9} {"speedup":>8}')
+
+    for users in args.users:
+        guilds = make_guilds(args.guilds, users)
+        members = sum(len(guild.members) for guild in guilds)
+        syncer = UserSyncer(types.SimpleNamespace(guilds=guilds))
+
+        index_time, indexed = timed(lambda: asyncio.run(syncer.get_cache_objects()))
+
+        if users <= args.legacy_max:
+            legacy_time, legacy = timed(lambda: legacy_cache_objects(guilds))
+            assert indexed == legacy, 'The index and the legacy scan disagree.'
+            legacy_column = f'{legacy_time:>9.2f} {legacy_time / index_time:>7.1f}x'
+
+        else:
+            legacy_column = f'{"-":>9} {"-":>8}'
+
+        print(f'{users:>8} {args.guilds:>7} {members:>9} {index_time:>9.2f} {legacy_column}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+Compare resolving command prefixes with `PrefixCache` against building them for every message.
+
+Run with `python -m benchmarks.prefix_matcher [--messages 1000000] [--guilds 1000] [--custom 0.1] [--dms 0.05]`.
+
+A firehose of messages is spread over the guilds, a `--custom` fraction of which set their own
+prefix, and DMs. Each message's prefixes are resolved and matched against its content the way
+`Bot.get_context` does. The legacy path gives DMs the default prefix, since it used to raise on them.
+"""
+import argparse
+import os
+import random
+import time
+import types
+import typing as t
+
+from discord.ext.commands import when_mentioned_or
+
+os.environ.setdefault('SNEK_API_TOKEN', 'benchmark')
+
+from snek.utils import DEFAULT_PREFIX, PrefixCache  # noqa: E402
+
+# The share of messages that invoke a command, the rest being chatter
+COMMAND_RATE = 0.02
+
+
+def make_firehose(
+    count: int, guilds: int, custom: float, dms: float, seed: int = 0
+) -> t.Tuple[types.SimpleNamespace, t.List[types.SimpleNamespace]]:
+    """Return a bot with the guild configs, and `count` messages sent across its guilds and in DMs."""
+    rng = random.Random(seed)
+
+    configs = dict()
+    for _ in range(guilds):
+        guild_id = rng.getrandbits(63)
+        prefix = rng.choice('?.$%') if rng.random() < custom else DEFAULT_PREFIX
+        configs[guild_id] = {'guild': guild_id, 'command_prefix': prefix}
+
+    bot = types.SimpleNamespace(user=types.SimpleNamespace(id=rng.getrandbits(63)), configs=configs)
+    bot.user.mention = f'<@{bot.user.id}>'
+
+    guild_objects = [types.SimpleNamespace(id=guild_id) for guild_id in configs]
+    messages = list()
+
+    for _ in range(count):
+        guild = None if rng.random() < dms else rng.choice(guild_objects)
+        prefix = configs[guild.id]['command_prefix'] if guild is not None else DEFAULT_PREFIX
+        content = f'{prefix}help' if rng.random() < COMMAND_RATE else 'just chatting about snakes'
+        messages.append(types.SimpleNamespace(guild=guild, content=content))
+
+    return bot, messages
+
+
+def legacy_prefixes(bot: types.SimpleNamespace, message: types.SimpleNamespace) -> t.List[str]:
+    """Return the prefixes for `message` the way `Snek.get_prefix` did before `PrefixCache`."""
+    if message.guild is None:
+        return when_mentioned_or(DEFAULT_PREFIX)(bot, message)
+
+    return when_mentioned_or(bot.configs[message.guild.id]['command_prefix'])(bot, message)
+
+
+def run(messages: t.List[types.SimpleNamespace], get_prefixes: t.Callable) -> t.Tuple[float, int]:
+    """Return the seconds taken to resolve and match the prefixes of every message, and how many matched."""
+    matched = 0
+    started = time.perf_counter()
+
+    for message in messages:
+        if message.content.startswith(tuple(get_prefixes(message))):
+            matched += 1
+
+    return time.perf_counter() - started, matched
+
+
+def main() -> None:
+    """Run the benchmark and print a table of results."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--messages', type=int, default=1_000_000)
+    parser.add_argument('--guilds', type=int, default=1000)
+    parser.add_argument('--custom', type=float, default=0.1, help='the fraction of guilds with their own prefix')
+    parser.add_argument('--dms', type=float, default=0.05, help='the fraction of messages sent in DMs')
+    args = parser.parse_args()
+
+    bot, messages = make_firehose(args.messages, args.guilds, args.custom, args.dms)
+    cache = PrefixCache(bot)
+
+    legacy_time, legacy_matched = run(messages, lambda message: legacy_prefixes(bot, message))
+    cached_time, cached_matched = run(messages, cache.get)
+    assert legacy_matched == cached_matched, 'The cache matched different messages'
+
+    print(f'{"matcher":>8} {"seconds":>8} {"ns/msg":>8} {"msgs/s":>11}')
+    for name, elapsed in (('legacy', legacy_time), ('cached', cached_time)):
+        print(f'{name:>8} {elapsed:>8.3f} {elapsed / len(messages) * 1e9:>8.0f} {len(messages) / elapsed:>11,.0f}')
+
+    print(f'{legacy_matched} commands matched, {legacy_time / cached_time:.1f}x faster with the cache')
+
+
+if __name__ == '__main__':
+    main()
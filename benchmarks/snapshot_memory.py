@@ -0,0 +1,147 @@
+"""
+Compare the memory held while diffing users with snapshots against the original namedtuple sets.
+
+Run with `python -m benchmarks.snapshot_memory [--users 10000 100000] [--guilds 300]`.
+
+The baseline is what the original `UserSyncer.get_diff` kept alive at once: the users decoded from
+the API, a set of `User` namedtuples of them and a set of their IDs, and the same for the cache,
+built member by member. The snapshots replace the cache side, and the database side is compared
+one page at a time, so only a page and a byte per cache object are held. The content hashes, the
+checksum tree and the membership mirror are new, so they're reported as what they add.
+
+For each structure the memory still allocated once it's built is reported, as measured by
+`tracemalloc`. The cache objects themselves are namedtuples either way, so the cache row's saving
+is marginal, coming from interned strings and the sorted ID column replacing the dict and sets;
+most of the saving comes from no longer holding the whole database.
+"""
+import argparse
+import asyncio
+import json
+import os
+import tracemalloc
+import types
+import typing as t
+
+from benchmarks.dataset import FakeGuild, make_guilds
+
+os.environ.setdefault('SNEK_API_TOKEN', 'benchmark')
+
+from snek.api.client import DEFAULT_PAGE_SIZE  # noqa: E402
+from snek.exts.syncer.snapshot import Snapshot  # noqa: E402
+from snek.exts.syncer.state import content_hash  # noqa: E402
+from snek.exts.syncer.syncers.checksum import ChecksumTree  # noqa: E402
+from snek.exts.syncer.syncers.user import User, UserSyncer  # noqa: E402
+
+
+def baseline_cache_users(guilds: t.List[FakeGuild]) -> t.Tuple[t.Dict[int, User], t.Set[User], t.Set[int]]:
+    """Return the cache users as the original `UserSyncer.get_diff` built them."""
+    cache_users_dict = dict()
+    for guild in guilds:
+        for user in guild.members:
+            if user.id in cache_users_dict.keys():
+                user_dict = cache_users_dict[user.id]._asdict()
+                roles = user_dict.pop('roles') + tuple(role.id for role in user.roles)
+                cache_users_dict[user.id] = User(
+                    roles=tuple(sorted(roles)),
+                    **user_dict
+                )
+
+            else:
+                cache_users_dict[user.id] = User(
+                    id=user.id,
+                    name=user.name,
+                    discriminator=user.discriminator,
+                    created_at=str(user.created_at),
+                    avatar_url=str(user.avatar_url),
+                    roles=tuple(sorted(role.id for role in user.roles)),
+                    guilds=tuple(g.id for g in guilds if g.get_member(user.id) is not None)
+                )
+
+    return cache_users_dict, set(cache_users_dict.values()), set(cache_users_dict.keys())
+
+
+def baseline_db_users(response: str) -> t.Tuple[t.List[t.Dict], t.Set[User], t.Set[int]]:
+    """Return the database users as the original `UserSyncer.get_diff` held them, from the API's `response`."""
+    users = json.loads(response)
+    db_users = {
+        User(
+            guilds=tuple(user.pop('guilds')),
+            roles=tuple(user.pop('roles')),
+            **user
+        )
+        for user in users
+    }
+
+    return users, db_users, {user.id for user in db_users}
+
+
+def measure(build: t.Callable[[], t.Any]) -> t.Tuple[int, t.Any]:
+    """Return the bytes still allocated after calling `build`, and what it returned to keep it alive."""
+    tracemalloc.start()
+    try:
+        result = build()
+        current, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return current, result
+
+
+def main() -> None:
+    """Run the benchmark for each dataset size and print a table of results."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, nargs='+', default=[10_000, 100_000])
+    parser.add_argument('--guilds', type=int, default=300)
+    args = parser.parse_args()
+
+    print(f'{"users":>8} {"structure":>10} {"baseline MiB":>13} {"snapshot MiB":>13} {"ratio":>6}')
+
+    for users in args.users:
+        guilds = make_guilds(args.guilds, users)
+        syncer = UserSyncer(types.SimpleNamespace(guilds=guilds))
+
+        rows = []
+
+        def cache_objects() -> Snapshot:
+            snapshot = asyncio.run(syncer.get_cache_objects())
+            syncer.membership = None
+            return snapshot
+
+        objects_size, snapshot = measure(cache_objects)
+
+        # The mirror is what building the cache objects keeps alive on the syncer beyond the snapshot. It's
+        # measured straight after, as the objects freed by the other rows are reused without being traced.
+        size_with_mirror, _ = measure(lambda: asyncio.run(syncer.get_cache_objects()))
+        mirror = ('mirror', 0, size_with_mirror - objects_size)
+
+        baseline_size, _ = measure(lambda: baseline_cache_users(guilds))
+        rows.append(('cache', baseline_size, objects_size))
+
+        # The database as the API returns it, matching the cache
+        api_users = [
+            {**user._asdict(), 'roles': list(user.roles), 'guilds': list(user.guilds)} for user in snapshot.values()
+        ]
+        response = json.dumps(api_users)
+        page = json.dumps(api_users[:DEFAULT_PAGE_SIZE])
+        del api_users
+
+        baseline_size, _ = measure(lambda: baseline_db_users(response))
+        size, _ = measure(lambda: ([syncer.from_api(data) for data in json.loads(page)], bytearray(len(snapshot))))
+        rows.append(('database', baseline_size, size))
+
+        size, _ = measure(lambda: snapshot.column(content_hash))
+        rows.append(('hashes', 0, size))
+
+        size, _ = measure(lambda: ChecksumTree(snapshot))
+        rows.append(('tree', 0, size))
+
+        rows.append(('total', sum(row[1] for row in rows), sum(row[2] for row in rows)))
+        rows.append(mirror)
+
+        for name, baseline_size, size in rows:
+            ratio = f'{baseline_size / size:>5.1f}x' if baseline_size else f'{"-":>6}'
+            print(f'{users:>8} {name:>10} {baseline_size / 2 ** 20:>13.1f} {size / 2 ** 20:>13.1f} {ratio}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+"""
+Drive full syncs against the stand-in Snek API and report how they perform.
+
+Run with `python -m benchmarks.sync_load [--users 1000 10000] [--guilds 50] [--latency 0.005]`.
+
+For each dataset size, the API is started empty in a separate process and synced once to populate
+it. It is then synced incrementally as after a restart, once unchanged and once after a fraction
+of the cache is changed (`--drift`), and finally in full after another drift. The wall time, the
+requests served by the API, the peak memory allocated by the bot process and the longest the event
+loop was blocked are reported for each. `--executor` picks where the diffs are computed.
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+import types
+import typing as t
+
+import aiohttp
+from aiohttp import web
+
+from benchmarks.dataset import FakeGuild, make_guilds
+from benchmarks.fake_api import FakeSnekAPI
+
+os.environ.setdefault('SNEK_API_TOKEN', 'benchmark')
+os.environ['SNEK_SYNC_STATE_DIR'] = STATE_DIR = tempfile.mkdtemp(prefix='snek-sync-state-')
+
+# (label, whether the sync is incremental, whether the cache drifts before it)
+RUNS = (
+    ('initial', False, False),
+    ('restart', True, False),
+    ('drifted', True, True),
+    ('full', False, True)
+)
+
+from snek.api import APIClient  # noqa: E402
+from snek.exts.syncer.executor import EXECUTOR_KINDS, SyncExecutor  # noqa: E402
+from snek.exts.syncer.scheduler import SyncScheduler  # noqa: E402
+from snek.exts.syncer.syncers import GuildSyncer, RoleSyncer, UserSyncer  # noqa: E402
+from snek.utils import PrefixCache  # noqa: E402
+
+
+def serve(port: int, latency: float, error_rate: float) -> None:
+    """Serve the stand-in API; run in a separate process so it doesn't compete with the bot's event loop."""
+    api = FakeSnekAPI(latency=latency, error_rate=error_rate)
+    web.run_app(api.create_app(), host='127.0.0.1', port=port, print=None)
+
+
+async def wait_for_api(url: str) -> None:
+    """Wait until the stand-in API accepts connections."""
+    async with aiohttp.ClientSession() as session:
+        for _ in range(100):
+            try:
+                async with session.get(f'{url}/_stats'):
+                    return
+            except aiohttp.ClientConnectionError:
+                await asyncio.sleep(0.1)
+
+    raise RuntimeError(f'The stand-in API at {url} did not start.')
+
+
+async def api_stats(url: str, reset: bool = False) -> t.Dict:
+    """Return the request counters of the stand-in API, and reset them if `reset` is True."""
+    async with aiohttp.ClientSession() as session:
+        async with session.get(f'{url}/_stats') as resp:
+            stats = await resp.json()
+
+        if reset:
+            await session.delete(f'{url}/_stats')
+
+    return stats
+
+
+def drift(guilds: t.List[FakeGuild], fraction: float) -> None:
+    """Rename a `fraction` of the users and roles in the cache, so the next sync has updates to send."""
+    if not fraction:
+        return
+
+    step = max(1, round(1 / fraction))
+    drifted = set()
+
+    for guild in guilds:
+        for index, role in enumerate(guild.roles):
+            if index % step == 0:
+                role.name += '*'
+
+        for index, member in enumerate(guild.members):
+            # Users are shared by their members, so each is renamed once
+            if index % step == 0 and member.id not in drifted:
+                member._user.name += '*'
+                drifted.add(member.id)
+
+
+async def run_sync(
+    bot: types.SimpleNamespace, url: str, incremental: bool, executor: SyncExecutor
+) -> t.Tuple[float, int, int, float]:
+    """
+    Run a sync and return its wall time, the number of API requests, the peak memory allocated, and
+    the maximum lag of the event loop.
+    """
+    await api_stats(url, reset=True)
+
+    tracemalloc.start()
+    started = time.perf_counter()
+
+    # New syncers load their state from disk, as they would after a restart
+    syncers = (GuildSyncer(bot, executor), RoleSyncer(bot, executor), UserSyncer(bot, executor))
+    timings = await SyncScheduler(syncers).sync(incremental=incremental)
+
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    stats = await api_stats(url)
+    return elapsed, sum(stats['requests'].values()), peak, timings.loop_lag.max
+
+
+async def bench(args: argparse.Namespace, users: int, port: int) -> None:
+    """Benchmark the syncs of one dataset size."""
+    url = f'http://127.0.0.1:{port}'
+    os.environ['SNEK_SITE_URL'] = url
+
+    shutil.rmtree(STATE_DIR, ignore_errors=True)
+
+    server = multiprocessing.Process(target=serve, args=(port, args.latency, args.error_rate), daemon=True)
+    server.start()
+
+    try:
+        await wait_for_api(url)
+
+        guilds = make_guilds(args.guilds, users, args.roles_per_guild)
+        api_client = APIClient(loop=asyncio.get_running_loop())
+        bot = types.SimpleNamespace(api_client=api_client, guilds=guilds, configs=None)
+        bot.prefix_cache = PrefixCache(bot)
+        executor = SyncExecutor(args.executor)
+
+        try:
+            for label, incremental, drifts in RUNS:
+                if drifts:
+                    drift(guilds, args.drift)
+
+                elapsed, requests, peak, lag = await run_sync(bot, url, incremental, executor)
+                print(
+                    f'{users:>8} {label:>8} {elapsed:>9.2f} {requests:>9} '
+                    f'{users / elapsed:>11.0f} {peak / 1024 ** 2:>10.1f} {lag * 1000:>11.0f}'
+                )
+
+        finally:
+            executor.shutdown()
+            await api_client.close()
+
+    finally:
+        server.terminate()
+        server.join()
+
+
+def main() -> None:
+    """Run the benchmark for each dataset size and print a table of results."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, nargs='+', default=[1_000, 10_000])
+    parser.add_argument('--guilds', type=int, default=50)
+    parser.add_argument('--roles-per-guild', type=int, default=20)
+    parser.add_argument('--drift', type=float, default=0.05, help='fraction of objects changed before the resync')
+    parser.add_argument('--latency', type=float, default=0.005, help='seconds the API adds to every request')
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--executor', choices=EXECUTOR_KINDS, default='thread', help='where diffs are computed')
+    args = parser.parse_args()
+
+    print(
+        f'{"users":>8} {"sync":>8} {"wall s":>9} {"requests":>9} '
+        f'{"users/s":>11} {"peak MiB":>10} {"max lag ms":>11}'
+    )
+
+    try:
+        for users in args.users:
+            asyncio.run(bench(args, users, args.port))
+    finally:
+        shutil.rmtree(STATE_DIR, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
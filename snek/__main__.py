@@ -6,12 +6,13 @@ from discord.ext.commands import when_mentioned_or
 
 from snek.bot import Snek
 from snek.exts import EXTENSIONS
+from snek.utils import DEFAULT_PREFIX
 
 log = logging.getLogger(__name__)
 
 
 snek = Snek(
-    command_prefix=when_mentioned_or('!'),
+    command_prefix=when_mentioned_or(DEFAULT_PREFIX),
     activity=discord.Activity(name='over everyone.', type=discord.ActivityType.watching),
     case_insensitive=True,
     max_messages=10_000
@@ -0,0 +1,12 @@
+from snek.api.cache import ResponseCache
+from snek.api.client import APIClient, BulkResult, ConditionalResponse, ResponseCodeError
+from snek.api.outbox import Outbox, OutboxEntry
+from snek.api.pool import ConnectorSettings
+from snek.api.resilience import CircuitBreaker, CircuitOpenError, RetryPolicy
+from snek.api.serialization import JSONCodec
+from snek.api.write_behind import WriteBehindQueue
+
+__all__ = (
+    'APIClient', 'BulkResult', 'CircuitBreaker', 'CircuitOpenError', 'ConditionalResponse', 'ConnectorSettings',
+    'JSONCodec', 'Outbox', 'OutboxEntry', 'ResponseCache', 'ResponseCodeError', 'RetryPolicy', 'WriteBehindQueue'
+)
@@ -0,0 +1,106 @@
+from collections import OrderedDict
+import copy
+import logging
+import time
+import typing as t
+
+from snek.api.endpoints import endpoint_template
+
+log = logging.getLogger(__name__)
+
+
+class ResponseCache:
+    """
+    A size-bounded LRU cache of API responses.
+
+    Only endpoints whose template (e.g. `users/{id}`) has a TTL in `ttls` are cached. Entries
+    are evicted in least-recently-used order once `max_size` is reached.
+    """
+
+    def __init__(self, max_size: int, ttls: t.Dict[str, float]) -> None:
+        self.max_size = max_size
+        self.ttls = ttls
+
+        self.hits = 0
+        self.misses = 0
+
+        # Maps `(endpoint, params)` to `(expiry, response)`
+        self._entries: t.OrderedDict[t.Tuple, t.Tuple[float, t.Any]] = OrderedDict()
+
+    def __len__(self) -> int:
+        """Returns the number of cached responses."""
+        return len(self._entries)
+
+    @staticmethod
+    def _key(endpoint: str, params: t.Optional[t.Dict]) -> t.Tuple:
+        return endpoint.strip('/'), tuple(sorted((params or {}).items()))
+
+    def ttl_for(self, endpoint: str) -> t.Optional[float]:
+        """Return the TTL of `endpoint`, or None if it isn't cached."""
+        return self.ttls.get(endpoint_template(endpoint))
+
+    def get(self, endpoint: str, params: t.Optional[t.Dict] = None) -> t.Optional[t.Any]:
+        """Return a copy of the cached response for `endpoint`, or None if there is no fresh entry."""
+        key = self._key(endpoint, params)
+        entry = self._entries.get(key)
+
+        if entry is None or entry[0] < time.monotonic():
+            self._entries.pop(key, None)
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+
+        # Callers are free to mutate responses, so never hand out the cached object itself
+        return copy.deepcopy(entry[1])
+
+    def set(self, endpoint: str, response: t.Any, params: t.Optional[t.Dict] = None) -> None:
+        """Cache `response` for `endpoint`, evicting the least recently used entries if needed."""
+        ttl = self.ttl_for(endpoint)
+        if ttl is None:
+            return
+
+        key = self._key(endpoint, params)
+        self._entries[key] = (time.monotonic() + ttl, copy.deepcopy(response))
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, endpoint: str) -> None:
+        """
+        Drop the cached responses affected by a write to `endpoint`.
+
+        This covers the endpoint itself, anything nested under it, and the collections it is nested in.
+        """
+        endpoint = endpoint.strip('/')
+
+        stale = [
+            key for key in self._entries
+            if key[0] == endpoint
+            or key[0].startswith(f'{endpoint}/')
+            or endpoint.startswith(f'{key[0]}/')
+        ]
+
+        for key in stale:
+            del self._entries[key]
+
+        if stale:
+            log.trace(f'Invalidated {len(stale)} cached responses for {endpoint}.')
+
+    def clear(self) -> None:
+        """Drop every cached response."""
+        self._entries.clear()
+
+    @property
+    def stats(self) -> t.Dict[str, t.Union[int, float]]:
+        """The hit/miss counters and current size of the cache."""
+        lookups = self.hits + self.misses
+
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'size': len(self._entries)
+        }
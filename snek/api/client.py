@@ -0,0 +1,626 @@
+import asyncio
+from collections import namedtuple
+import logging
+import os
+import time
+import typing as t
+from urllib.parse import parse_qsl, quote, urlsplit
+
+import aiohttp
+
+from snek.api.cache import ResponseCache
+from snek.api.metrics import APIMetrics
+from snek.api.outbox import (
+    DEFAULT_OUTBOX_BATCH_SIZE, DEFAULT_OUTBOX_REPLAY_INTERVAL, Outbox, OutboxEntry, resource_key
+)
+from snek.api.pool import ConnectorSettings, PoolMonitor
+from snek.api.resilience import CircuitBreaker, CircuitOpenError, RetryPolicy
+from snek.api.serialization import get_codec, JSONCodec
+
+log = logging.getLogger(__name__)
+
+DEFAULT_BULK_CHUNK_SIZE = int(os.environ.get('SNEK_API_BULK_CHUNK_SIZE', 500))
+DEFAULT_MAX_CONCURRENCY = int(os.environ.get('SNEK_API_MAX_CONCURRENCY', 20))
+DEFAULT_CACHE_SIZE = int(os.environ.get('SNEK_API_CACHE_SIZE', 1024))
+DEFAULT_PAGE_SIZE = int(os.environ.get('SNEK_API_PAGE_SIZE', 1000))
+
+# `failed` holds `(item, ResponseCodeError)` pairs for the items the API rejected
+BulkResult = namedtuple('BulkResult', ('succeeded', 'failed'))
+
+# The methods whose writes replace the whole resource, superseding older writes to it waiting in the outbox
+REPLACING_METHODS = frozenset({'POST', 'PUT', 'DELETE'})
+
+# Awaited by the bulk methods with the items of a chunk that succeeded, and `(item, ResponseCodeError)` pairs
+# for those that failed
+ChunkCallback = t.Callable[[t.List, t.List[t.Tuple[t.Any, 'ResponseCodeError']]], t.Awaitable[None]]
+
+# `json` is None when `modified` is False, as the API doesn't send the body again
+ConditionalResponse = namedtuple('ConditionalResponse', ('json', 'etag', 'modified'))
+
+
+class ResponseCodeError(ValueError):
+    """Raised when a non-ok HTTP status code is received."""
+
+    def __init__(
+        self,
+        response: aiohttp.ClientResponse,
+        response_json: t.Optional[t.Dict] = None,
+        response_text: str = ''
+    ):
+        self.response = response
+        self.status = response.status
+
+        self.response_json = response_json or dict()
+        self.response_text = response_text
+
+    def __str__(self) -> str:
+        return f'Status: {self.status} Response: {self.response_json or self.response_text}'
+
+
+class APIClient:
+    """Snek Site API Wrapper."""
+
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        bulk_chunk_size: int = DEFAULT_BULK_CHUNK_SIZE,
+        page_size: int = DEFAULT_PAGE_SIZE,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        cache_ttls: t.Optional[t.Dict[str, float]] = None,
+        cache_size: int = DEFAULT_CACHE_SIZE,
+        retry_policy: t.Optional[RetryPolicy] = None,
+        circuit_breaker: t.Optional[CircuitBreaker] = None,
+        connector_settings: t.Optional[ConnectorSettings] = None,
+        json_codec: t.Optional[JSONCodec] = None,
+        outbox: t.Optional[Outbox] = None,
+        **kwargs
+    ) -> None:
+        if token := os.environ.get('SNEK_API_TOKEN'):
+            headers = {
+                'Authorization': f'Token {token}'
+            }
+
+            if 'headers' in kwargs:
+                kwargs['headers'].update(headers)
+            else:
+                kwargs['headers'] = headers
+
+        else:
+            log.critical(
+                'Could not find "SNEK_API_TOKEN" environment variable '
+                '- WILL NOT BE ABLE TO COMMUNICATE WITH THE SNEK API!!'
+            )
+
+        self.loop = loop
+        self.session = None
+        self.bulk_chunk_size = bulk_chunk_size
+        self.page_size = page_size
+        self.max_concurrency = max_concurrency
+
+        # Bounds the number of requests in flight; created alongside the session
+        self._semaphore = None
+
+        # GET responses are only cached for the endpoint templates given a TTL
+        self.cache = ResponseCache(cache_size, cache_ttls) if cache_ttls and cache_size > 0 else None
+
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.circuit_breaker = circuit_breaker or CircuitBreaker()
+
+        self.connector_settings = connector_settings or ConnectorSettings()
+        self.pool_monitor = PoolMonitor()
+
+        self.json_codec = json_codec or get_codec()
+        self.metrics = APIMetrics()
+
+        # Durable writes that fail while the API is unavailable are kept in the outbox and replayed
+        self.outbox = outbox
+        log.debug(f'Using the {self.json_codec.name} codec for API payloads.')
+
+        self.ready = asyncio.Event(loop=loop)
+        self._creation_task = None
+        self._default_session_kwargs = kwargs
+
+        self.recreate()
+
+    async def _create_session(self, **session_kwargs) -> None:
+        """
+        Create the aiohttp session with `session_kwargs` and set the ready event.
+
+        Unless given in `session_kwargs`, the connector and timeout are built from the connector settings.
+        """
+        await self.close()
+
+        session_kwargs = {**self._default_session_kwargs, **session_kwargs}
+        session_kwargs.setdefault('connector', self.connector_settings.connector())
+        session_kwargs.setdefault('timeout', self.connector_settings.timeout())
+        session_kwargs['trace_configs'] = [*session_kwargs.get('trace_configs', ()), self.pool_monitor.trace_config]
+
+        log.debug(f'Creating the API session with {self.connector_settings}')
+        self.session = aiohttp.ClientSession(**session_kwargs)
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self.ready.set()
+
+    async def close(self) -> None:
+        """Close the aiohttp session and clear the ready event."""
+        if self.session:
+            await self.session.close()
+
+        self.ready.clear()
+
+    def recreate(self, force: bool = False, **session_kwargs) -> None:
+        """
+        Schedules the aiohttp session to be created with `session_kwargs` if it is closed.
+
+        If `force` is True, the session will be recreated even if one is open. If a task
+        to create the session is pending, it will be cancelled.
+        """
+        if force or self.session is None or self.session.closed:
+            # Cancel creation task if one exists
+            if force and self._creation_task:
+                self._creation_task.cancel()
+
+            # Don't schedule a task if one is already in progress
+            if force or self._creation_task is None or self._creation_task.done():
+                self._creation_task = self.loop.create_task(self._create_session(**session_kwargs))
+
+    @property
+    def concurrency(self) -> int:
+        """
+        The maximum number of requests the client keeps in flight.
+
+        This is `max_concurrency`, lowered to the connector's pool size so that requests
+        never queue inside aiohttp waiting for a free connection.
+        """
+        limits = [self.max_concurrency]
+
+        if self.session is not None:
+            connector = self.session.connector
+            limits.extend(limit for limit in (connector.limit, connector.limit_per_host) if limit)
+
+        return max(1, min(limits))
+
+    @property
+    def pool_stats(self) -> t.Dict[str, t.Union[int, float]]:
+        """Connection pool statistics: in-use/idle connections, queued requests and queue wait times."""
+        return self.pool_monitor.stats(self.session)
+
+    async def read_json(self, response: aiohttp.ClientResponse) -> t.Any:
+        """Decode the JSON body of `response` with the client's JSON codec."""
+        body = await response.read()
+        return self.json_codec.loads(body) if body else None
+
+    async def maybe_raise_for_status(self, response: aiohttp.ClientResponse, should_raise: bool) -> None:
+        """Raise ResponseCodeError for non-OK response if an exception should be raised."""
+        if should_raise and response.status >= 400:
+            if response.content_type == 'application/json':
+                response_json = await self.read_json(response)
+                raise ResponseCodeError(response=response, response_json=response_json)
+
+            response_text = await response.text()
+            raise ResponseCodeError(response=response, response_text=response_text)
+
+    @staticmethod
+    def endpoint_url(endpoint: str) -> str:
+        return f'{os.environ.get("SNEK_SITE_URL", "https://sneknetwork.com")}/api/{quote(endpoint)}'
+
+    async def request(
+        self, method: str, endpoint: str, raise_for_status: bool = True, durable: bool = False, **kwargs
+    ) -> t.Dict:
+        """
+        Send an HTTP request to the Snek API and return the JSON response.
+
+        GET requests are served from the response cache if it is enabled for `endpoint`. Any other
+        request invalidates the cached responses it may have affected.
+
+        Failed requests are retried according to the client's retry policy, and `CircuitOpenError`
+        is raised without sending anything while the circuit breaker considers the API down.
+
+        If `durable` is True and the client has an outbox, a write with a `json` payload that fails
+        because the API is unavailable is queued in the outbox to be replayed, and None is returned.
+        To keep the writes to a resource in order while older ones wait in the outbox, durable writes
+        and PATCHes to it are queued behind them, and other writes supersede them once they succeed.
+        """
+        method = method.upper()
+        cached = self.cache is not None and method == 'GET' and self.cache.ttl_for(endpoint) is not None
+
+        if cached and (response := self.cache.get(endpoint, kwargs.get('params'))) is not None:
+            return response
+
+        writes = self.outbox is not None and method != 'GET' and kwargs.keys() <= {'json'}
+        spool = durable and writes
+
+        resource = resource_key(endpoint, kwargs.get('json')) if writes else None
+        pending = writes and self.outbox.has_pending(resource)
+
+        if pending and (durable or method not in REPLACING_METHODS):
+            self.outbox.append(method, endpoint, kwargs.get('json'))
+            return None
+
+        await self.ready.wait()
+
+        try:
+            response, status, _ = await self._send_with_retries(method, endpoint, raise_for_status, **kwargs)
+
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError, CircuitOpenError, ResponseCodeError) as err:
+            if not spool or isinstance(err, ResponseCodeError) and err.status < 500:
+                raise
+
+            log.warning(f'{method} {endpoint} failed with {type(err).__name__}: {err}; queued it in the outbox.')
+            self.outbox.append(method, endpoint, kwargs.get('json'))
+            return None
+
+        finally:
+            if self.cache is not None and method != 'GET':
+                self.cache.invalidate(endpoint)
+
+        if pending and status < 400:
+            self.outbox.supersede(resource)
+
+        if cached and status < 400:
+            self.cache.set(endpoint, response, kwargs.get('params'))
+
+        return response
+
+    async def _send_with_retries(
+        self, method: str, endpoint: str, raise_for_status: bool, **kwargs
+    ) -> t.Tuple[t.Optional[t.Dict], int, t.Mapping[str, str]]:
+        """Send the request, retrying it as the retry policy allows, and return the JSON, status and headers."""
+        if 'json' in kwargs:
+            kwargs['data'] = self.json_codec.dumps(kwargs.pop('json'))
+            kwargs['headers'] = {**kwargs.get('headers', {}), 'Content-Type': 'application/json'}
+
+        data = kwargs.get('data')
+        bytes_sent = len(data) if isinstance(data, (bytes, str)) else 0
+        attempt = 0
+
+        while True:
+            self.circuit_breaker.check()
+
+            status = None
+            bytes_received = 0
+            started = time.perf_counter()
+
+            try:
+                async with self._semaphore:
+                    # Time the request itself rather than the wait for a free slot
+                    started = time.perf_counter()
+
+                    async with self.session.request(method, self.endpoint_url(endpoint), **kwargs) as resp:
+                        status = resp.status
+                        bytes_received = resp.content_length or 0
+
+                        if resp.status >= 500:
+                            self.circuit_breaker.record_failure()
+                        else:
+                            self.circuit_breaker.record_success()
+
+                        delay = self.retry_policy.delay(method, attempt, resp.status, resp.headers.get('Retry-After'))
+
+                        if delay is None:
+                            if resp.status in (204, 304):
+                                return None, resp.status, resp.headers
+
+                            await self.maybe_raise_for_status(resp, raise_for_status)
+                            return await self.read_json(resp), resp.status, resp.headers
+
+                        reason = f'status {resp.status}'
+
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as err:
+                self.circuit_breaker.record_failure()
+
+                if (delay := self.retry_policy.delay(method, attempt)) is None:
+                    raise
+
+                reason = f'{type(err).__name__}: {err}'
+
+            finally:
+                self.metrics.record(
+                    method, endpoint, status, time.perf_counter() - started, bytes_sent, bytes_received
+                )
+
+            attempt += 1
+            log.debug(f'{method} {endpoint} failed with {reason}; retry {attempt} in {delay:.2f}s.')
+            await asyncio.sleep(delay)
+
+    async def get(self, endpoint: str, raise_for_status: bool = True, **kwargs) -> t.Dict:
+        """Snek API GET request."""
+        return await self.request("GET", endpoint, raise_for_status=raise_for_status, **kwargs)
+
+    async def get_conditional(self, endpoint: str, etag: t.Optional[str] = None, **kwargs) -> ConditionalResponse:
+        """
+        Snek API GET request, made conditional on the resource no longer matching `etag`.
+
+        The response cache is bypassed. If the API doesn't support ETags, the response is always
+        considered modified, and its `etag` is None.
+        """
+        if etag is not None:
+            kwargs['headers'] = {**kwargs.get('headers', {}), 'If-None-Match': etag}
+
+        await self.ready.wait()
+        response, status, headers = await self._send_with_retries('GET', endpoint, True, **kwargs)
+
+        return ConditionalResponse(response, headers.get('ETag'), status != 304)
+
+    async def post(self, endpoint: str, raise_for_status: bool = True, **kwargs) -> t.Dict:
+        """Snek API POST request."""
+        return await self.request("POST", endpoint, raise_for_status=raise_for_status, **kwargs)
+
+    async def put(self, endpoint: str, raise_for_status: bool = True, **kwargs) -> t.Dict:
+        """Snek API PUT request."""
+        return await self.request("PUT", endpoint, raise_for_status=raise_for_status, **kwargs)
+
+    async def patch(self, endpoint: str, raise_for_status: bool = True, **kwargs) -> t.Dict:
+        """Snek API PATCH request."""
+        return await self.request("PATCH", endpoint, raise_for_status=raise_for_status, **kwargs)
+
+    async def delete(self, endpoint: str, raise_for_status: bool = True, **kwargs) -> t.Optional[t.Dict]:
+        """Snek API DELETE request."""
+        return await self.request("DELETE", endpoint, raise_for_status=raise_for_status, **kwargs)
+
+    async def replay_outbox(self, batch_size: int = DEFAULT_OUTBOX_BATCH_SIZE) -> int:
+        """
+        Replay a batch of the oldest writes in the outbox, and return how many were removed from it.
+
+        Writes to different resources are replayed concurrently, and those to the same resource in
+        order. A resource's writes stop at the first one that fails because the API is unavailable,
+        and writes the API rejects are dropped.
+        """
+        resources: t.Dict[str, t.List[OutboxEntry]] = dict()
+        for entry in self.outbox.peek(batch_size):
+            resources.setdefault(entry.resource, []).append(entry)
+
+        removed = 0
+
+        async def replay(entries: t.List[OutboxEntry]) -> None:
+            nonlocal removed
+
+            for entry in entries:
+                try:
+                    # Sent around `request`, which would queue the write behind itself
+                    await self._send_with_retries(entry.method, entry.endpoint, True, json=entry.payload)
+
+                except ResponseCodeError as err:
+                    if err.status >= 500:
+                        return
+
+                    log.error(f'Dropping the queued {entry.method} {entry.endpoint} rejected by the API: {err}')
+                    self.outbox.dropped += 1
+
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError, CircuitOpenError):
+                    return
+
+                else:
+                    self.outbox.replayed += 1
+
+                finally:
+                    if self.cache is not None:
+                        self.cache.invalidate(entry.endpoint)
+
+                self.outbox.remove(entry)
+                removed += 1
+
+        await self.map(replay, resources.values())
+        return removed
+
+    async def replay_outbox_forever(self, interval: float = DEFAULT_OUTBOX_REPLAY_INTERVAL) -> None:
+        """Replay the writes in the outbox as they're queued, checking for them every `interval` seconds."""
+        while True:
+            if not self.outbox:
+                await asyncio.sleep(interval)
+                continue
+
+            started = time.perf_counter()
+
+            try:
+                removed = await self.replay_outbox()
+            except Exception:
+                log.exception('Replaying the outbox failed; retrying later.')
+                removed = 0
+
+            if removed:
+                self.outbox.replay_rate = removed / (time.perf_counter() - started)
+                log.info(f'Replayed {removed} API writes from the outbox; {len(self.outbox)} are left.')
+
+            else:
+                # The API is still unavailable
+                await asyncio.sleep(interval)
+
+    async def iter_pages(
+        self, endpoint: str, page_size: t.Optional[int] = None, params: t.Optional[t.Dict] = None, **kwargs
+    ) -> t.AsyncIterator[t.List[t.Dict]]:
+        """
+        Iterate over a list endpoint one page at a time, yielding the objects in each page.
+
+        Pages are requested with `limit` and `offset` parameters. If the API returns a `next` link,
+        its query parameters are followed instead, which also covers cursor pagination. An endpoint
+        that isn't paginated and returns a plain list is yielded as a single page.
+        """
+        params = {**(params or {}), 'limit': page_size or self.page_size, 'offset': 0}
+
+        while True:
+            page = await self.get(endpoint, params=params, **kwargs)
+
+            if isinstance(page, list):
+                yield page
+                return
+
+            results = page['results']
+            if results:
+                yield results
+
+            if 'next' in page:
+                if not page['next']:
+                    return
+
+                params = {**params, **dict(parse_qsl(urlsplit(page['next']).query))}
+
+            elif len(results) < params['limit']:
+                return
+
+            else:
+                params['offset'] += len(results)
+
+    async def map(
+        self,
+        func: t.Callable[[t.Any], t.Awaitable],
+        items: t.Iterable,
+        concurrency: t.Optional[int] = None,
+        return_exceptions: bool = False
+    ) -> t.List:
+        """
+        Await `func(item)` for every item in `items`, keeping up to `concurrency` calls in flight.
+
+        `concurrency` defaults to the client's own limit. Results are returned in the order of `items`.
+        Like `asyncio.gather`, exceptions are returned in place of results if `return_exceptions` is
+        True; otherwise the first exception is raised and the outstanding calls are cancelled.
+        """
+        await self.ready.wait()
+
+        items = list(items)
+        results = [None] * len(items)
+        indices = iter(range(len(items)))
+
+        async def worker() -> None:
+            # The workers share `indices`, so each item is only picked up once
+            for index in indices:
+                try:
+                    results[index] = await func(items[index])
+                except Exception as err:
+                    if not return_exceptions:
+                        raise
+
+                    results[index] = err
+
+        workers = [
+            self.loop.create_task(worker())
+            for _ in range(min(concurrency or self.concurrency, len(items)))
+        ]
+
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+
+        return results
+
+    async def _bulk(
+        self,
+        method: str,
+        endpoint: str,
+        bulk_endpoint: str,
+        items: t.Sequence,
+        fallback: t.Callable[[t.Any], t.Awaitable],
+        chunk_size: t.Optional[int] = None,
+        on_chunk: t.Optional[ChunkCallback] = None
+    ) -> BulkResult:
+        """
+        Send `items` to `bulk_endpoint` as chunked list payloads, where `endpoint` is the collection they belong to.
+
+        Chunks are sent concurrently through `map`. If the API rejects a chunk, each item in that
+        chunk is retried on its own with `fallback`, so a single bad item only fails itself instead
+        of the whole chunk.
+
+        If `on_chunk` is given, it's awaited with the items that succeeded and failed once each chunk is done.
+        """
+        chunk_size = chunk_size or self.bulk_chunk_size
+        succeeded = list()
+        failed = list()
+
+        async def send_item(item: t.Any) -> t.Optional[ResponseCodeError]:
+            try:
+                await fallback(item)
+            except ResponseCodeError as err:
+                return err
+
+        async def send_chunk(chunk: t.List) -> None:
+            try:
+                await self.request(method, bulk_endpoint, json=chunk)
+
+            except ResponseCodeError as err:
+                log.warning(
+                    f'Bulk {method} to {bulk_endpoint} failed with status {err.status}; '
+                    f'retrying {len(chunk)} items individually.'
+                )
+                errors = await self.map(send_item, chunk)
+
+                chunk_succeeded = [item for item, err in zip(chunk, errors) if err is None]
+                chunk_failed = [(item, err) for item, err in zip(chunk, errors) if err is not None]
+
+            else:
+                chunk_succeeded, chunk_failed = chunk, []
+
+                if self.outbox is not None:
+                    for item in chunk:
+                        # Items are payloads, or the IDs of the objects to delete
+                        self.outbox.supersede(resource_key(endpoint, item if isinstance(item, dict) else {'id': item}))
+
+            succeeded.extend(chunk_succeeded)
+            failed.extend(chunk_failed)
+
+            if on_chunk is not None:
+                await on_chunk(chunk_succeeded, chunk_failed)
+
+        chunks = [list(items[start:start + chunk_size]) for start in range(0, len(items), chunk_size)]
+
+        try:
+            await self.map(send_chunk, chunks)
+        finally:
+            if self.cache is not None:
+                self.cache.invalidate(endpoint)
+
+        return BulkResult(succeeded, failed)
+
+    async def post_many(
+        self,
+        endpoint: str,
+        items: t.Sequence[t.Dict],
+        chunk_size: t.Optional[int] = None,
+        on_chunk: t.Optional[ChunkCallback] = None
+    ) -> BulkResult:
+        """Snek API bulk POST request, creating `items` in chunks of `chunk_size`."""
+        return await self._bulk(
+            'POST',
+            endpoint,
+            endpoint,
+            items,
+            lambda item: self.post(endpoint, json=item),
+            chunk_size,
+            on_chunk
+        )
+
+    async def put_many(
+        self,
+        endpoint: str,
+        items: t.Sequence[t.Dict],
+        chunk_size: t.Optional[int] = None,
+        on_chunk: t.Optional[ChunkCallback] = None
+    ) -> BulkResult:
+        """Snek API bulk PUT request, replacing `items` (keyed by their `id`) in chunks of `chunk_size`."""
+        return await self._bulk(
+            'PUT',
+            endpoint,
+            f'{endpoint}/bulk_update',
+            items,
+            lambda item: self.put(f'{endpoint}/{item["id"]}', json=item),
+            chunk_size,
+            on_chunk
+        )
+
+    async def delete_many(
+        self,
+        endpoint: str,
+        ids: t.Sequence[int],
+        chunk_size: t.Optional[int] = None,
+        on_chunk: t.Optional[ChunkCallback] = None
+    ) -> BulkResult:
+        """Snek API bulk DELETE request, deleting the objects with `ids` in chunks of `chunk_size`."""
+        return await self._bulk(
+            'DELETE',
+            endpoint,
+            f'{endpoint}/bulk_delete',
+            ids,
+            lambda id_: self.delete(f'{endpoint}/{id_}'),
+            chunk_size,
+            on_chunk
+        )
@@ -0,0 +1,12 @@
+import re
+
+_ID_SEGMENT = re.compile(r'(?<=/)\d+(?=/|$)')
+
+
+def endpoint_template(endpoint: str) -> str:
+    """
+    Return the template of `endpoint`, with its numeric path segments replaced by `{id}`.
+
+    For example, `users/1234` becomes `users/{id}`.
+    """
+    return _ID_SEGMENT.sub('{id}', endpoint.strip('/'))
@@ -0,0 +1,97 @@
+from collections import Counter
+import typing as t
+
+from snek.api.endpoints import endpoint_template
+from snek.utils.metrics import format_labels, Histogram, metric_family
+
+
+class EndpointStats:
+    """Request statistics for one method and endpoint template."""
+
+    __slots__ = ('count', 'status_classes', 'bytes_sent', 'bytes_received', 'latency')
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.status_classes = Counter()
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.latency = Histogram()
+
+    @property
+    def errors(self) -> int:
+        """The number of requests that failed with a 5xx status or without a response."""
+        return self.status_classes['5xx'] + self.status_classes['error']
+
+
+class APIMetrics:
+    """
+    Records the requests made to the Snek API, per method and endpoint template.
+
+    Each attempt of a retried request is recorded on its own.
+    """
+
+    def __init__(self) -> None:
+        self.endpoints: t.Dict[t.Tuple[str, str], EndpointStats] = dict()
+
+    def record(
+        self,
+        method: str,
+        endpoint: str,
+        status: t.Optional[int],
+        latency: float,
+        bytes_sent: int = 0,
+        bytes_received: int = 0
+    ) -> None:
+        """Record a request; `status` is None if no response was received."""
+        key = (method, endpoint_template(endpoint))
+
+        if (stats := self.endpoints.get(key)) is None:
+            stats = self.endpoints[key] = EndpointStats()
+
+        stats.count += 1
+        stats.status_classes[f'{status // 100}xx' if status else 'error'] += 1
+        stats.bytes_sent += bytes_sent
+        stats.bytes_received += bytes_received
+        stats.latency.observe(latency)
+
+    def reset(self) -> None:
+        """Forget every recorded request."""
+        self.endpoints.clear()
+
+    def prometheus(self) -> t.List[str]:
+        """Return the recorded metrics in the Prometheus text exposition format."""
+        endpoints = sorted(self.endpoints.items())
+        labels = {key: {'method': key[0], 'endpoint': key[1]} for key, _ in endpoints}
+
+        return [
+            *metric_family(
+                'snek_api_requests_total', 'counter', 'Snek API requests by status class.',
+                (
+                    f'snek_api_requests_total{format_labels({**labels[key], "status_class": status_class})} {count}'
+                    for key, stats in endpoints
+                    for status_class, count in sorted(stats.status_classes.items())
+                )
+            ),
+            *metric_family(
+                'snek_api_request_bytes_total', 'counter', 'Bytes sent in Snek API request bodies.',
+                (
+                    f'snek_api_request_bytes_total{format_labels(labels[key])} {stats.bytes_sent}'
+                    for key, stats in endpoints
+                )
+            ),
+            *metric_family(
+                'snek_api_response_bytes_total', 'counter', 'Bytes received in Snek API response bodies.',
+                (
+                    f'snek_api_response_bytes_total{format_labels(labels[key])} {stats.bytes_received}'
+                    for key, stats in endpoints
+                )
+            ),
+            *metric_family(
+                'snek_api_request_duration_seconds', 'histogram', 'Snek API request latency.',
+                (
+                    sample
+                    for key, stats in endpoints
+                    for sample in stats.latency.prometheus_samples('snek_api_request_duration_seconds', labels[key])
+                )
+            )
+        ]
@@ -0,0 +1,133 @@
+from collections import Counter, namedtuple
+import json
+import logging
+import os
+import pathlib
+import sqlite3
+import time
+import typing as t
+
+log = logging.getLogger(__name__)
+
+# The outbox is disabled if the path is set to an empty string
+DEFAULT_OUTBOX_PATH = os.environ.get('SNEK_API_OUTBOX_PATH', 'data/outbox.sqlite3')
+DEFAULT_OUTBOX_BATCH_SIZE = int(os.environ.get('SNEK_API_OUTBOX_BATCH_SIZE', 100))
+DEFAULT_OUTBOX_REPLAY_INTERVAL = float(os.environ.get('SNEK_API_OUTBOX_REPLAY_INTERVAL', 5))
+
+# A write waiting in the outbox; `resource` is what the write applies to, e.g. `users/1234`
+OutboxEntry = namedtuple('OutboxEntry', ('seq', 'method', 'endpoint', 'resource', 'payload', 'queued_at'))
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS writes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    method TEXT NOT NULL,
+    endpoint TEXT NOT NULL,
+    resource TEXT NOT NULL,
+    payload TEXT,
+    queued_at REAL NOT NULL
+)
+'''
+
+
+def resource_key(endpoint: str, payload: t.Any = None) -> str:
+    """
+    Return the resource a write to `endpoint` with `payload` applies to.
+
+    Writes to a collection, e.g. creating a user, apply to the object with the ID in their payload.
+    """
+    endpoint = endpoint.strip('/')
+
+    if '/' not in endpoint and isinstance(payload, dict) and 'id' in payload:
+        return f'{endpoint}/{payload["id"]}'
+
+    return endpoint
+
+
+class Outbox:
+    """
+    A durable queue of writes to the Snek API, kept while the API is unavailable.
+
+    Writes are appended to a SQLite database in WAL mode, so they survive restarts, and removed
+    once they were replayed. `APIClient` replays them oldest first, in order for each resource.
+    """
+
+    def __init__(self, path: t.Union[str, os.PathLike]) -> None:
+        self.path = pathlib.Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        self._db = sqlite3.connect(str(self.path), isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute(_SCHEMA)
+
+        # The number of writes waiting for each resource
+        self._pending = Counter(resource for resource, in self._db.execute('SELECT resource FROM writes'))
+
+        if self._pending:
+            log.info(f'{len(self)} API writes are waiting in the outbox at {self.path}.')
+
+        self.queued = 0
+        self.replayed = 0
+        self.dropped = 0
+        self.superseded = 0
+
+        # Writes replayed per second by the last replay
+        self.replay_rate = 0.0
+
+    def __len__(self) -> int:
+        """Return the number of writes waiting."""
+        return sum(self._pending.values())
+
+    def has_pending(self, resource: str) -> bool:
+        """Return whether writes to `resource` are waiting, so later ones must wait behind them."""
+        return resource in self._pending
+
+    @property
+    def oldest_age(self) -> float:
+        """The number of seconds the oldest write has been waiting for, or 0 if none is."""
+        row = self._db.execute('SELECT MIN(queued_at) FROM writes').fetchone()
+        return time.time() - row[0] if row[0] is not None else 0.0
+
+    def append(self, method: str, endpoint: str, payload: t.Any = None) -> None:
+        """Queue a `method` request to `endpoint` with the JSON `payload`."""
+        resource = resource_key(endpoint, payload)
+
+        self._db.execute(
+            'INSERT INTO writes (method, endpoint, resource, payload, queued_at) VALUES (?, ?, ?, ?, ?)',
+            (method, endpoint, resource, json.dumps(payload), time.time())
+        )
+
+        self._pending[resource] += 1
+        self.queued += 1
+
+    def peek(self, limit: int) -> t.List[OutboxEntry]:
+        """Return the `limit` oldest writes."""
+        rows = self._db.execute(
+            'SELECT seq, method, endpoint, resource, payload, queued_at FROM writes ORDER BY seq LIMIT ?', (limit,)
+        )
+        return [
+            OutboxEntry(seq, method, endpoint, resource, json.loads(payload), queued_at)
+            for seq, method, endpoint, resource, payload, queued_at in rows
+        ]
+
+    def remove(self, entry: OutboxEntry) -> None:
+        """Remove a write, once it was replayed or the API rejected it."""
+        # It may have been superseded meanwhile
+        if not self._db.execute('DELETE FROM writes WHERE seq = ?', (entry.seq,)).rowcount:
+            return
+
+        self._pending[entry.resource] -= 1
+        if self._pending[entry.resource] <= 0:
+            del self._pending[entry.resource]
+
+    def supersede(self, resource: str) -> None:
+        """Remove the writes waiting for `resource`, once a newer write replaced the whole of it."""
+        if resource not in self._pending:
+            return
+
+        self._db.execute('DELETE FROM writes WHERE resource = ?', (resource,))
+        self.superseded += self._pending.pop(resource)
+
+    def close(self) -> None:
+        """Close the database."""
+        self._db.close()
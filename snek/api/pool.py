@@ -0,0 +1,138 @@
+import logging
+import os
+import time
+import types
+import typing as t
+
+import aiohttp
+
+log = logging.getLogger(__name__)
+
+# The value of a setting not passed to `ConnectorSettings`, as None disables it
+UNSET = object()
+
+
+def _setting(value: t.Any, name: str, default: t.Any, cast: t.Callable = float) -> t.Any:
+    """Return `value`, falling back to the environment variable `name` and then `default` if it is `UNSET`."""
+    if value is not UNSET:
+        return value
+
+    if (env_value := os.environ.get(name)) is None:
+        return default
+
+    # An empty variable explicitly disables the setting
+    return cast(env_value) if env_value else None
+
+
+class ConnectorSettings:
+    """
+    Connection pool and timeout settings for the API session.
+
+    Every setting not passed defaults to its `SNEK_API_*` environment variable. A limit of 0 means
+    no limit, and a timeout of None means no timeout.
+    """
+
+    def __init__(
+        self,
+        limit: int = UNSET,
+        limit_per_host: int = UNSET,
+        keepalive_timeout: t.Optional[float] = UNSET,
+        dns_cache_ttl: t.Optional[float] = UNSET,
+        connect_timeout: t.Optional[float] = UNSET,
+        read_timeout: t.Optional[float] = UNSET,
+        total_timeout: t.Optional[float] = UNSET
+    ) -> None:
+        self.limit = _setting(limit, 'SNEK_API_POOL_LIMIT', 100, int)
+        self.limit_per_host = _setting(limit_per_host, 'SNEK_API_POOL_LIMIT_PER_HOST', 0, int)
+        self.keepalive_timeout = _setting(keepalive_timeout, 'SNEK_API_KEEPALIVE_TIMEOUT', 30)
+        self.dns_cache_ttl = _setting(dns_cache_ttl, 'SNEK_API_DNS_CACHE_TTL', 300)
+        self.connect_timeout = _setting(connect_timeout, 'SNEK_API_CONNECT_TIMEOUT', 10)
+        self.read_timeout = _setting(read_timeout, 'SNEK_API_READ_TIMEOUT', 30)
+        self.total_timeout = _setting(total_timeout, 'SNEK_API_TOTAL_TIMEOUT', 120)
+
+    def __repr__(self) -> str:
+        attrs = ', '.join(f'{name}={value!r}' for name, value in vars(self).items())
+        return f'<ConnectorSettings {attrs}>'
+
+    def connector(self) -> aiohttp.TCPConnector:
+        """Create a TCP connector using these settings. This must be called from within the event loop."""
+        return aiohttp.TCPConnector(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            keepalive_timeout=self.keepalive_timeout,
+            use_dns_cache=self.dns_cache_ttl != 0,
+            ttl_dns_cache=self.dns_cache_ttl
+        )
+
+    def timeout(self) -> aiohttp.ClientTimeout:
+        """Create the client timeout using these settings."""
+        return aiohttp.ClientTimeout(
+            total=self.total_timeout,
+            sock_connect=self.connect_timeout,
+            sock_read=self.read_timeout
+        )
+
+
+class PoolMonitor:
+    """
+    Tracks how the API session uses its connection pool.
+
+    `trace_config` must be passed to the session, whose connector is then inspected by `stats`.
+    """
+
+    def __init__(self) -> None:
+        self.trace_config = aiohttp.TraceConfig()
+        self.trace_config.on_connection_queued_start.append(self._on_queued_start)
+        self.trace_config.on_connection_queued_end.append(self._on_queued_end)
+        self.trace_config.on_connection_create_end.append(self._on_create_end)
+        self.trace_config.on_connection_reuseconn.append(self._on_reuse)
+
+        self.queued_total = 0
+        self.queue_wait_total = 0.0
+        self.queue_wait_max = 0.0
+        self.connections_created = 0
+        self.connections_reused = 0
+
+    async def _on_queued_start(self, _: aiohttp.ClientSession, ctx: types.SimpleNamespace, __: t.Any) -> None:
+        ctx.queued_at = time.perf_counter()
+
+    async def _on_queued_end(self, _: aiohttp.ClientSession, ctx: types.SimpleNamespace, __: t.Any) -> None:
+        wait = time.perf_counter() - ctx.queued_at
+
+        self.queued_total += 1
+        self.queue_wait_total += wait
+        self.queue_wait_max = max(self.queue_wait_max, wait)
+
+        log.trace(f'Waited {wait * 1000:.1f}ms for a free API connection.')
+
+    async def _on_create_end(self, *_) -> None:
+        self.connections_created += 1
+
+    async def _on_reuse(self, *_) -> None:
+        self.connections_reused += 1
+
+    def stats(self, session: t.Optional[aiohttp.ClientSession]) -> t.Dict[str, t.Union[int, float]]:
+        """
+        Return the pool statistics for `session`.
+
+        The requests queued for a connection are counted from the connector's waiters, as aiohttp
+        doesn't signal the end of a wait cancelled e.g. by a timeout.
+        """
+        in_use = idle = queued = 0
+
+        if session is not None and not session.closed:
+            # aiohttp doesn't expose these publicly, so tolerate them changing
+            connector = session.connector
+            in_use = len(getattr(connector, '_acquired', ()))
+            idle = sum(len(conns) for conns in getattr(connector, '_conns', {}).values())
+            queued = sum(len(waiters) for waiters in getattr(connector, '_waiters', {}).values())
+
+        return {
+            'in_use': in_use,
+            'idle': idle,
+            'queued': queued,
+            'queue_wait_avg': self.queue_wait_total / self.queued_total if self.queued_total else 0.0,
+            'queue_wait_max': self.queue_wait_max,
+            'connections_created': self.connections_created,
+            'connections_reused': self.connections_reused
+        }
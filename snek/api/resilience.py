@@ -0,0 +1,155 @@
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+import logging
+import os
+import random
+import time
+import typing as t
+
+log = logging.getLogger(__name__)
+
+DEFAULT_MAX_RETRIES = int(os.environ.get('SNEK_API_MAX_RETRIES', 3))
+DEFAULT_RETRY_BASE_DELAY = float(os.environ.get('SNEK_API_RETRY_BASE_DELAY', 0.5))
+DEFAULT_RETRY_MAX_DELAY = float(os.environ.get('SNEK_API_RETRY_MAX_DELAY', 30))
+
+DEFAULT_BREAKER_THRESHOLD = int(os.environ.get('SNEK_API_BREAKER_THRESHOLD', 5))
+DEFAULT_BREAKER_RESET_TIMEOUT = float(os.environ.get('SNEK_API_BREAKER_RESET_TIMEOUT', 30))
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of sending a request while the circuit breaker considers the Snek API down."""
+
+    def __init__(self, retry_after: float) -> None:
+        super().__init__(f'The Snek API is unavailable; retry in {retry_after:.0f}s.')
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value: t.Optional[str]) -> t.Optional[float]:
+    """Parse the value of a `Retry-After` header, given either in seconds or as an HTTP date."""
+    if not value:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+class RetryPolicy:
+    """
+    Decides whether and when a failed request is retried.
+
+    Connection errors, timeouts and 5xx responses are only retried for idempotent methods. A 429
+    means the request was not processed, so it is retried for any method, honouring `Retry-After`.
+    Otherwise, the delay is an exponential backoff with full jitter.
+    """
+
+    IDEMPOTENT_METHODS = frozenset(('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'))
+    RETRY_STATUSES = frozenset((500, 502, 503, 504))
+
+    def __init__(
+        self,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+        base_delay: float = DEFAULT_RETRY_BASE_DELAY,
+        max_delay: float = DEFAULT_RETRY_MAX_DELAY
+    ) -> None:
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def backoff(self, attempt: int) -> float:
+        """Return a jittered exponential backoff for the zero-based `attempt`."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def delay(
+        self, method: str, attempt: int, status: t.Optional[int] = None, retry_after: t.Optional[str] = None
+    ) -> t.Optional[float]:
+        """
+        Return how long to wait before retrying, or None if the request should not be retried.
+
+        `status` is None if the request failed before a response was received.
+        """
+        if attempt >= self.max_retries:
+            return None
+
+        if status == 429:
+            if (seconds := parse_retry_after(retry_after)) is not None:
+                # Don't hold up the caller for longer than we'd ever back off for
+                return seconds if seconds <= self.max_delay else None
+
+            return self.backoff(attempt)
+
+        if method not in self.IDEMPOTENT_METHODS:
+            return None
+
+        if status is None or status in self.RETRY_STATUSES:
+            return self.backoff(attempt)
+
+        return None
+
+
+class CircuitBreaker:
+    """
+    Fails requests fast while the Snek API is down.
+
+    After `failure_threshold` consecutive failures the circuit opens, and requests are rejected
+    with `CircuitOpenError` for `reset_timeout` seconds. Then it is half-open: a single probe
+    request is let through, and its outcome closes or re-opens the circuit.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(
+        self,
+        failure_threshold: int = DEFAULT_BREAKER_THRESHOLD,
+        reset_timeout: float = DEFAULT_BREAKER_RESET_TIMEOUT
+    ) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.state = self.CLOSED
+        self.failures = 0
+        self._changed_at = time.monotonic()
+
+    def _set_state(self, state: str) -> None:
+        if state != self.state:
+            log.warning(f'Snek API circuit breaker is now {state}.')
+
+        self.state = state
+        self._changed_at = time.monotonic()
+
+    def check(self) -> None:
+        """Raise `CircuitOpenError` if a request should not be sent right now."""
+        if self.state == self.CLOSED:
+            return
+
+        remaining = self.reset_timeout - (time.monotonic() - self._changed_at)
+
+        # While half-open this also rejects requests until the probe reports back or times out
+        if remaining > 0:
+            raise CircuitOpenError(remaining)
+
+        self._set_state(self.HALF_OPEN)
+
+    def record_success(self) -> None:
+        """Record a successful request, closing the circuit."""
+        self.failures = 0
+
+        if self.state != self.CLOSED:
+            self._set_state(self.CLOSED)
+
+    def record_failure(self) -> None:
+        """Record a failed request, opening the circuit if the threshold is reached."""
+        self.failures += 1
+
+        if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.failure_threshold):
+            self._set_state(self.OPEN)
@@ -0,0 +1,45 @@
+from collections import namedtuple
+import json
+import logging
+import os
+import typing as t
+
+log = logging.getLogger(__name__)
+
+# `dumps` must return bytes, and `loads` must accept bytes
+JSONCodec = namedtuple('JSONCodec', ('name', 'dumps', 'loads'))
+
+STDLIB_CODEC = JSONCodec(
+    name='json',
+    dumps=lambda obj: json.dumps(obj, separators=(',', ':')).encode('utf-8'),
+    loads=json.loads
+)
+
+CODECS: t.Dict[str, JSONCodec] = {STDLIB_CODEC.name: STDLIB_CODEC}
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+else:
+    CODECS['orjson'] = JSONCodec(name='orjson', dumps=orjson.dumps, loads=orjson.loads)
+
+# The preferred codecs, fastest first
+PREFERENCE = ('orjson', 'json')
+
+
+def get_codec(name: t.Optional[str] = None) -> JSONCodec:
+    """
+    Return the JSON codec called `name`, or the `SNEK_API_JSON_CODEC` environment variable.
+
+    If neither is given, the fastest installed codec is returned.
+    """
+    name = name or os.environ.get('SNEK_API_JSON_CODEC')
+
+    if name:
+        if name not in CODECS:
+            raise ValueError(f'The JSON codec {name!r} is not installed; choose from {", ".join(CODECS)}.')
+
+        return CODECS[name]
+
+    return next(CODECS[name] for name in PREFERENCE if name in CODECS)
@@ -0,0 +1,86 @@
+import asyncio
+from contextlib import suppress
+import logging
+import os
+import typing as t
+
+from snek.api.client import APIClient
+
+log = logging.getLogger(__name__)
+
+DEFAULT_WRITE_WINDOW = float(os.environ.get('SNEK_API_WRITE_WINDOW', 2))
+
+
+class WriteBehindQueue:
+    """
+    Coalesces PATCH requests to the Snek API.
+
+    Payloads for the same endpoint are merged while they wait, so a burst of updates to one
+    object becomes a single PATCH. Pending writes are flushed together, `window` seconds after
+    the first one of a batch was queued.
+    """
+
+    def __init__(self, api_client: APIClient, window: float = DEFAULT_WRITE_WINDOW) -> None:
+        self.api_client = api_client
+        self.window = window
+
+        self._pending: t.Dict[str, t.Dict] = dict()
+        self._flush_task: t.Optional[asyncio.Task] = None
+
+        # Set on close to cut the wait of the scheduled flush short
+        self._closing = asyncio.Event(loop=api_client.loop)
+
+    def __len__(self) -> int:
+        """Returns the number of endpoints with pending writes."""
+        return len(self._pending)
+
+    def patch(self, endpoint: str, payload: t.Dict) -> None:
+        """Queue a PATCH of `payload` to `endpoint`, merging it into any pending payload for the endpoint."""
+        self._pending.setdefault(endpoint, dict()).update(payload)
+
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = self.api_client.loop.create_task(self._flush_later())
+
+    def pending(self, endpoint: str) -> t.Dict:
+        """Return a copy of the payload still waiting to be sent to `endpoint`."""
+        return dict(self._pending.get(endpoint, ()))
+
+    def discard(self, endpoint: str) -> None:
+        """Drop the pending payload for `endpoint`, e.g. because the object was deleted."""
+        self._pending.pop(endpoint, None)
+
+    async def _flush_later(self) -> None:
+        # Writes queued while a flush awaits the API make up the next batch, as no flush is scheduled for them
+        while self._pending:
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._closing.wait(), timeout=self.window)
+
+            await self.flush()
+
+    async def flush(self) -> None:
+        """Send every pending write now."""
+        pending, self._pending = self._pending, dict()
+
+        if not pending:
+            return
+
+        log.trace(f'Flushing {len(pending)} coalesced API writes.')
+
+        results = await self.api_client.map(
+            lambda item: self.api_client.patch(item[0], json=item[1], durable=True),
+            pending.items(),
+            return_exceptions=True
+        )
+
+        for (endpoint, payload), result in zip(pending.items(), results):
+            if isinstance(result, Exception):
+                log.error(f'Coalesced PATCH to {endpoint} with {payload} failed: {result}')
+
+    async def close(self) -> None:
+        """Send every pending write, including those of a flush that is already underway."""
+        self._closing.set()
+
+        if self._flush_task is not None:
+            await self._flush_task
+
+        await self.flush()
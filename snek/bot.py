@@ -1,13 +1,21 @@
+import asyncio
 import logging
 import typing as t
 
 import discord
-from discord.ext.commands import Bot, Cog, when_mentioned_or
+from discord.ext.commands import Bot, Cog
 
-from snek.api import APIClient
+from snek.api import APIClient, Outbox, WriteBehindQueue
+from snek.api.outbox import DEFAULT_OUTBOX_PATH
+from snek.utils import EventMetrics, PrefixCache
 
 log = logging.getLogger('Snek')
 
+# Seconds to cache the API responses of hot GET endpoints for, keyed by endpoint template
+API_CACHE_TTLS = {
+    'users/{id}': 60
+}
+
 
 class Snek(Bot):
     """The ultimate multi-purpose Discord bot."""
@@ -16,21 +24,56 @@ class Snek(Bot):
         super().__init__(*args, **kwargs)
         log.info('Snek initializing..')
 
-        self.api_client = APIClient(loop=self.loop)
+        # Counts every dispatched event, and times every listener
+        self.event_metrics = EventMetrics()
+
+        # Writes that fail while the API is down are kept here and replayed once it's back
+        self.outbox = Outbox(DEFAULT_OUTBOX_PATH) if DEFAULT_OUTBOX_PATH else None
+
+        self.api_client = APIClient(loop=self.loop, cache_ttls=API_CACHE_TTLS, outbox=self.outbox)
+        self.write_queue = WriteBehindQueue(self.api_client)
+
+        self._outbox_replay: t.Optional[asyncio.Task] = None
+        if self.outbox is not None:
+            self._outbox_replay = self.loop.create_task(self.api_client.replay_outbox_forever())
 
         # Syncer takes care of this
         self.configs: t.Optional[t.Dict[int, str]] = None
+        self.prefix_cache = PrefixCache(self)
 
     def add_cog(self, cog: Cog) -> None:
         """Adds a cog to the bot and logs the operation."""
         super().add_cog(cog)
         log.info(f"Cog loaded: {cog.qualified_name}")
 
+    def add_listener(self, func: t.Callable[..., t.Awaitable], name: t.Optional[str] = None) -> None:
+        """Adds a listener, instrumented to record its calls in `event_metrics`."""
+        name = func.__name__ if name is None else name
+        super().add_listener(self.event_metrics.instrument(name, func), name)
+
+    def remove_listener(self, func: t.Callable[..., t.Awaitable], name: t.Optional[str] = None) -> None:
+        """Removes a listener added with `add_listener`."""
+        name = func.__name__ if name is None else name
+        super().remove_listener(self.event_metrics.uninstrument(name, func), name)
+
+    def dispatch(self, event_name: str, *args, **kwargs) -> None:
+        """Counts the event in `event_metrics` and dispatches it to its listeners."""
+        self.event_metrics.dispatched[event_name] += 1
+        super().dispatch(event_name, *args, **kwargs)
+
     async def close(self) -> None:
-        """Close the Discord and API Client connection."""
+        """Close the Discord connection, flush pending API writes and close the API Client connection."""
         await super().close()
+        await self.write_queue.close()
+
+        if self._outbox_replay is not None:
+            self._outbox_replay.cancel()
+
         await self.api_client.close()
 
-    async def get_prefix(self, message: discord.Message) -> str:
-        """Returns the prefix for the guild where a command was invoked."""
-        return when_mentioned_or(self.configs[message.guild.id]['command_prefix'])(self, message)
+        if self.outbox is not None:
+            self.outbox.close()
+
+    async def get_prefix(self, message: discord.Message) -> t.Tuple[str, ...]:
+        """Returns the prefixes for the guild where a command was invoked, or the default ones in DMs."""
+        return self.prefix_cache.get(message)
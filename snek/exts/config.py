@@ -4,13 +4,14 @@ import typing as t
 from discord.ext.commands import Cog, Context, group, RoleConverter
 
 from snek.bot import Snek
+from snek.utils import DEFAULT_PREFIX
 
 log = logging.getLogger(__name__)
 
 CONFIG_DEFAULTS = {
     'mod_role': None,
     'admin_role': None,
-    'command_prefix': '!'
+    'command_prefix': DEFAULT_PREFIX
 }
 
 
@@ -52,6 +53,9 @@ class Config(Cog):
             )
             self.bot.configs[ctx.guild.id][key] = value
 
+            if key == 'command_prefix':
+                self.bot.prefix_cache.invalidate(ctx.guild.id)
+
             await ctx.send(f'✅ Config key `{key}` successfully updated.')
 
     @config_group.command(name='get', aliases=('g',))
@@ -72,6 +76,9 @@ class Config(Cog):
             )
             self.bot.configs[ctx.guild.id][key] = value
 
+            if key == 'command_prefix':
+                self.bot.prefix_cache.invalidate(ctx.guild.id)
+
             await ctx.send(f'✅ Config key `{key}` was sucessfully reset to `{value}`')
         else:
             await ctx.send('❌ There is no such config key.')
@@ -3,7 +3,7 @@ import typing as t
 
 from discord.ext.commands import Cog, Context, errors
 
-from snek.api import ResponseCodeError
+from snek.api import CircuitOpenError, ResponseCodeError
 from snek.bot import Snek
 
 log = logging.getLogger(__name__)
@@ -42,6 +42,8 @@ class ErrorHandler(Cog):
         elif isinstance(error, errors.CommandInvokeError):
             if isinstance(error.original, ResponseCodeError):
                 await self.handle_snek_api_error(ctx, error.original)
+            elif isinstance(error.original, CircuitOpenError):
+                await self.handle_circuit_open_error(ctx, error.original)
             else:
                 await self.handle_unexpected_error(ctx, error.original)
             return  # Return early to avoid logging
@@ -137,6 +139,11 @@ class ErrorHandler(Cog):
             log.warning(f"Unexpected response from Snek API for command {ctx.command}: {error.status}")
             await ctx.send(f"Received an unexpected status code from the Snek API: `{error.status}`.")
 
+    async def handle_circuit_open_error(self, ctx: Context, error: CircuitOpenError) -> None:
+        """Send an error message in `ctx.channel` for CircuitOpenError, raised while the Snek API is unavailable."""
+        log.debug(f"Snek API circuit breaker is open for command {ctx.command}: {error}")
+        await ctx.send("Sorry, the Snek API is currently unavailable. Please try again later.")
+
     async def handle_unexpected_error(self, ctx: Context, error: errors.CommandError) -> None:
         """Send a generic error message in `ctx.channel` and log the exeception."""
         await ctx.send(
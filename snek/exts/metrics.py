@@ -0,0 +1,246 @@
+import asyncio
+import logging
+import os
+import pathlib
+import typing as t
+
+from aiohttp import web
+import discord
+from discord.ext.commands import Cog, Context, group
+import humanize
+
+from snek.bot import Snek
+from snek.utils import PaginatedEmbed
+from snek.utils.metrics import format_labels, metric_family
+
+log = logging.getLogger(__name__)
+
+METRICS_FILE = os.environ.get('SNEK_METRICS_FILE')
+METRICS_HOST = os.environ.get('SNEK_METRICS_HOST', '127.0.0.1')
+METRICS_PORT = os.environ.get('SNEK_METRICS_PORT')
+METRICS_INTERVAL = float(os.environ.get('SNEK_METRICS_INTERVAL', 15))
+
+# The directory the `metrics dump` command may write to
+METRICS_DUMP_DIR = pathlib.Path(os.environ.get('SNEK_METRICS_DUMP_DIR', 'data/metrics'))
+
+
+class Metrics(Cog):
+    """
+    Runtime metrics of the bot.
+
+    Metrics are also exported in the Prometheus text format: over HTTP on `/metrics` if
+    `SNEK_METRICS_PORT` is set, and to the file `SNEK_METRICS_FILE` every `SNEK_METRICS_INTERVAL`
+    seconds if it is set. The `metrics dump` command writes them to files in `SNEK_METRICS_DUMP_DIR`.
+    """
+
+    def __init__(self, bot: Snek) -> None:
+        self.bot = bot
+
+        self._runner: t.Optional[web.AppRunner] = None
+        self._export_task = self.bot.loop.create_task(self.export())
+
+    def render(self) -> str:
+        """Return every metric in the Prometheus text exposition format."""
+        api_client = self.bot.api_client
+        pool_stats = api_client.pool_stats
+
+        lines = api_client.metrics.prometheus()
+
+        lines.extend(metric_family(
+            'snek_api_pool_connections', 'gauge', 'Snek API connections by state.',
+            (
+                f'snek_api_pool_connections{format_labels({"state": state})} {pool_stats[state]}'
+                for state in ('in_use', 'idle', 'queued')
+            )
+        ))
+        lines.extend(metric_family(
+            'snek_api_pool_queue_wait_seconds_max', 'gauge', 'The longest wait for a free Snek API connection.',
+            (f'snek_api_pool_queue_wait_seconds_max {pool_stats["queue_wait_max"]}',)
+        ))
+
+        if api_client.cache is not None:
+            lines.extend(metric_family(
+                'snek_api_cache_lookups_total', 'counter', 'Snek API response cache lookups.',
+                (
+                    f'snek_api_cache_lookups_total{format_labels({"result": "hit"})} {api_client.cache.hits}',
+                    f'snek_api_cache_lookups_total{format_labels({"result": "miss"})} {api_client.cache.misses}'
+                )
+            ))
+
+        if (outbox := api_client.outbox) is not None:
+            lines.extend(metric_family(
+                'snek_api_outbox_depth', 'gauge', 'Snek API writes waiting in the outbox.',
+                (f'snek_api_outbox_depth {len(outbox)}',)
+            ))
+            lines.extend(metric_family(
+                'snek_api_outbox_oldest_age_seconds', 'gauge', 'How long the oldest write in the outbox has waited.',
+                (f'snek_api_outbox_oldest_age_seconds {outbox.oldest_age}',)
+            ))
+            lines.extend(metric_family(
+                'snek_api_outbox_replay_rate', 'gauge', 'Writes per second sent by the last replay of the outbox.',
+                (f'snek_api_outbox_replay_rate {outbox.replay_rate}',)
+            ))
+            lines.extend(metric_family(
+                'snek_api_outbox_writes_total', 'counter', 'API writes through the outbox, by what became of them.',
+                (
+                    f'snek_api_outbox_writes_total{format_labels({"result": "queued"})} {outbox.queued}',
+                    f'snek_api_outbox_writes_total{format_labels({"result": "replayed"})} {outbox.replayed}',
+                    f'snek_api_outbox_writes_total{format_labels({"result": "dropped"})} {outbox.dropped}',
+                    f'snek_api_outbox_writes_total{format_labels({"result": "superseded"})} {outbox.superseded}'
+                )
+            ))
+
+        lines.extend(self.bot.event_metrics.prometheus())
+
+        if (syncer := self.bot.get_cog('Syncer')) is not None:
+            lines.extend(syncer.dispatcher.prometheus())
+
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path: t.Union[str, os.PathLike]) -> None:
+        """Write every metric to the file at `path`, replacing it atomically."""
+        path = pathlib.Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        temp_path = path.with_name(f'.{path.name}.tmp')
+        temp_path.write_text(self.render(), encoding='utf-8')
+        temp_path.replace(path)
+
+    async def handle_metrics(self, _: web.Request) -> web.Response:
+        """Serve every metric over HTTP."""
+        return web.Response(text=self.render(), content_type='text/plain')
+
+    async def export(self) -> None:
+        """Export the metrics over HTTP and to a file, as configured."""
+        if METRICS_PORT:
+            app = web.Application()
+            app.router.add_get('/metrics', self.handle_metrics)
+
+            self._runner = web.AppRunner(app)
+            await self._runner.setup()
+            await web.TCPSite(self._runner, METRICS_HOST, int(METRICS_PORT)).start()
+
+            log.info(f'Serving metrics on http://{METRICS_HOST}:{METRICS_PORT}/metrics')
+
+        if METRICS_FILE:
+            while True:
+                try:
+                    self.write(METRICS_FILE)
+                except OSError:
+                    log.exception(f'Failed to write the metrics to {METRICS_FILE}.')
+
+                await asyncio.sleep(METRICS_INTERVAL)
+
+    def cog_unload(self) -> None:
+        """Stop exporting the metrics."""
+        self._export_task.cancel()
+
+        if self._runner is not None:
+            self.bot.loop.create_task(self._runner.cleanup())
+
+    @group(name='metrics', invoke_without_command=True)
+    async def metrics_group(self, ctx: Context) -> None:
+        """Show runtime metrics of the bot."""
+        await ctx.send_help(ctx.command)
+
+    @metrics_group.command(name='api')
+    async def api_command(self, ctx: Context) -> None:
+        """Show the Snek API requests per endpoint, busiest first."""
+        api_client = self.bot.api_client
+        pool_stats = api_client.pool_stats
+
+        summary = (
+            f'**Pool:** {pool_stats["in_use"]} in use, {pool_stats["idle"]} idle, {pool_stats["queued"]} queued '
+            f'(max wait {pool_stats["queue_wait_max"] * 1000:.0f}ms)'
+        )
+
+        if api_client.cache is not None:
+            cache_stats = api_client.cache.stats
+            summary += (
+                f'\n**Cache:** {cache_stats["hits"]} hits, {cache_stats["misses"]} misses '
+                f'({cache_stats["hit_rate"]:.0%}), {cache_stats["size"]} entries'
+            )
+
+        if (outbox := api_client.outbox) is not None:
+            summary += (
+                f'\n**Outbox:** {len(outbox)} waiting (oldest {outbox.oldest_age:.0f}s), {outbox.queued} queued, '
+                f'{outbox.replayed} replayed, {outbox.dropped} dropped, {outbox.superseded} superseded'
+            )
+
+        endpoints = sorted(api_client.metrics.endpoints.items(), key=lambda item: item[1].count, reverse=True)
+        lines = [
+            f'`{method} {endpoint}` **{stats.count}** requests, {stats.errors} errors\n'
+            f'p50 {stats.latency.percentile(50) * 1000:.0f}ms · '
+            f'p95 {stats.latency.percentile(95) * 1000:.0f}ms · '
+            f'p99 {stats.latency.percentile(99) * 1000:.0f}ms · '
+            f'{humanize.naturalsize(stats.bytes_received)} received'
+            for (method, endpoint), stats in endpoints
+        ]
+
+        embed = PaginatedEmbed.from_lines(
+            lines or ['No requests recorded yet.'],
+            page_prefix=summary,
+            max_lines=8,
+            title='Snek API Metrics',
+            color=discord.Color.blurple()
+        )
+
+        await embed.paginate(ctx)
+
+    @metrics_group.command(name='events')
+    async def events_command(self, ctx: Context, count: int = 10) -> None:
+        """Show the `count` slowest event handlers, by their 95th percentile latency."""
+        event_metrics = self.bot.event_metrics
+
+        busiest = ', '.join(f'`{event}` {total}' for event, total in event_metrics.dispatched.most_common(5))
+        summary = f'**Events:** {sum(event_metrics.dispatched.values())} dispatched ({busiest or "none yet"})'
+
+        lines = [
+            f'`{handler}` on `{event}` **{stats.count}** calls, {stats.errors} errors, {stats.in_flight} in flight\n'
+            f'p50 {stats.latency.percentile(50) * 1000:.0f}ms · '
+            f'p95 {stats.latency.percentile(95) * 1000:.0f}ms · '
+            f'p99 {stats.latency.percentile(99) * 1000:.0f}ms · '
+            f'max {stats.latency.max * 1000:.0f}ms'
+            for (event, handler), stats in event_metrics.slowest(count)
+        ]
+
+        embed = PaginatedEmbed.from_lines(
+            lines or ['No handler calls recorded yet.'],
+            page_prefix=summary,
+            max_lines=8,
+            title='Event Handler Metrics',
+            color=discord.Color.blurple()
+        )
+
+        await embed.paginate(ctx)
+
+    @metrics_group.command(name='dump')
+    async def dump_command(self, ctx: Context, path: t.Optional[str] = None) -> None:
+        """
+        Write every metric in the Prometheus text format to `path`, or `SNEK_METRICS_FILE`.
+
+        `path` is relative to `SNEK_METRICS_DUMP_DIR`, and may not lead outside of it.
+        """
+        if path is not None:
+            dump_dir = METRICS_DUMP_DIR.resolve()
+            path = (dump_dir / path).resolve()
+
+            if dump_dir not in path.parents:
+                await ctx.send(f'❌ Metrics can only be written to files in `{METRICS_DUMP_DIR}`.')
+                return
+
+        elif (path := METRICS_FILE) is None:
+            await ctx.send('❌ No path was given and `SNEK_METRICS_FILE` is not set.')
+            return
+
+        self.write(path)
+        await ctx.send(f'✅ Metrics written to `{path}`.')
+
+    async def cog_check(self, ctx: Context) -> bool:
+        """Only allow the owner of the bot to invoke the commands in this cog."""
+        return await self.bot.is_owner(ctx.author)
+
+
+def setup(bot: Snek) -> None:
+    """Load the `Metrics` cog."""
+    bot.add_cog(Metrics(bot))
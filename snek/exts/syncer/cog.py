@@ -7,56 +7,107 @@ from discord.ext.commands import Cog, Context
 
 from snek.api import ResponseCodeError
 from snek.bot import Snek
+from snek.exts.syncer.dispatcher import KeyedDispatcher, serialized
+from snek.exts.syncer.executor import SyncExecutor
+from snek.exts.syncer.index import MembershipMirror
+from snek.exts.syncer.scheduler import format_dry_run, format_timings, SyncScheduler, SyncTimings
 from snek.exts.syncer.syncers import GuildSyncer, RoleSyncer, UserSyncer
+from snek.exts.syncer.syncers.user import user_from_member
 
 log = logging.getLogger(__name__)
 
 
+def already_exists(err: ResponseCodeError) -> bool:
+    """Return whether `err` is the API rejecting a created object because one with its ID already exists."""
+    if err.status != 400 or not isinstance(err.response_json, dict):
+        return False
+
+    return any('already exists' in str(message) for message in err.response_json.get('id', ()))
+
+
 class Syncer(Cog):
 
     def __init__(self, bot: Snek) -> None:
         self.bot = bot
 
-        self.guild_syncer = GuildSyncer(bot)
-        self.role_syncer = RoleSyncer(bot)
-        self.user_syncer = UserSyncer(bot)
+        # The CPU-bound parts of the diffs run off the event loop, in a pool shared by the syncers
+        self.executor = SyncExecutor()
+
+        self.guild_syncer = GuildSyncer(bot, self.executor)
+        self.role_syncer = RoleSyncer(bot, self.executor)
+        self.user_syncer = UserSyncer(bot, self.executor)
 
-    async def sync(self, ctx: t.Optional[Context] = None) -> None:
-        """Synchronise the guilds/roles/users with the database."""
-        await self.guild_syncer.sync(ctx)
-        await self.role_syncer.sync(ctx)
-        await self.user_syncer.sync(ctx)
+        self.scheduler = SyncScheduler((self.guild_syncer, self.role_syncer, self.user_syncer))
+
+        # The listeners of events for the same guild, role or user run one at a time, in order
+        self.dispatcher = KeyedDispatcher()
+
+    @property
+    def membership(self) -> MembershipMirror:
+        """
+        The guilds and roles of every cached user, mirroring those written to the database.
+
+        The mirror is built by the user syncer's full snapshots, and kept up to date by the listeners
+        so they don't need to fetch a user to compute their new guilds and roles.
+        """
+        if self.user_syncer.membership is None:
+            self.user_syncer.membership = MembershipMirror.from_guilds(self.bot.guilds)
+
+        return self.user_syncer.membership
+
+    def update_membership(self, change: str, *args) -> None:
+        """
+        Apply a `change` to the membership mirror, e.g. `add`, calling the `MembershipMirror` method of that name.
+
+        If the user syncer is building a full snapshot, the change is also recorded to be replayed
+        onto the mirror that replaces this one.
+        """
+        getattr(self.membership, change)(*args)
+
+        if (changes := self.user_syncer.membership_changes) is not None:
+            changes.append((change, args))
+
+    async def sync(
+        self, ctx: t.Optional[Context] = None, incremental: bool = False, guild: t.Optional[discord.Guild] = None
+    ) -> SyncTimings:
+        """
+        Synchronise the guilds/roles/users with the database.
+
+        The synchronisation is incremental if `incremental` is True, or limited to `guild` if it's given.
+        It waits for any synchronisation under way to finish first.
+        """
+        return await self.scheduler.sync(ctx, incremental, guild)
 
     @Cog.listener()
     async def on_ready(self) -> None:
-        """Synchronise on ready."""
-        await self.sync()
+        """Synchronise the objects changed since the last synchronisation on ready."""
+        await self.sync(incremental=True)
 
     @Cog.listener()
+    @serialized(lambda guild: ('guild', guild.id))
     async def on_guild_join(self, guild: discord.Guild) -> None:
-        """Adds the joined guild into the database through the Snek API."""
-        payload = {
-            'id': guild.id,
-            'name': guild.name,
-            'created_at': str(guild.created_at),
-            'icon_url': str(guild.icon_url)
-        }
+        """
+        Adds the joined guild into the database through the Snek API.
 
+        Only the guild, its roles and its members are synchronised; the members' guild lists are
+        updated with their other memberships.
+        """
         log.info(f'Joined guild {guild.name} ({guild.id})')
 
-        try:
-            await self.bot.api_client.put(f'guilds/{guild.id}', json=payload)
+        for member in guild.members:
+            self.update_membership('add', member)
 
-        except ResponseCodeError as err:
-            if err.response.status != 404:
-                raise
+        await self.sync(guild=guild)
 
-            # If we got a 404, that means the guild is new.
-            await self.bot.api_client.post('guilds', json=payload)
-
-        await self.sync()
+    @Cog.listener()
+    @serialized(lambda guild: ('guild', guild.id))
+    async def on_guild_remove(self, guild: discord.Guild) -> None:
+        """Forget the memberships of the left guild; the database keeps them until the next synchronisation."""
+        log.info(f'Left guild {guild.name} ({guild.id})')
+        self.update_membership('remove_guild', guild)
 
     @Cog.listener()
+    @serialized(lambda before, after: ('guild', after.id))
     async def on_guild_update(self, before: discord.Guild, after: discord.Guild) -> None:
         """Adds the updated guild information into the database through the Snek API."""
         attrs = ('name', 'icon_url')
@@ -64,18 +115,23 @@ class Syncer(Cog):
         payload = dict()
         for attr in attrs:
             if getattr(before, attr) != (new_value := getattr(after, attr)):
-                payload[attr] = new_value
+                if attr == 'icon_url':
+                    payload[attr] = str(new_value)
+                else:
+                    payload[attr] = new_value
 
         if payload:
             log.trace(f'Updated guild {after.name} ({after.id})')
-            await self.bot.api_client.patch(f'guilds/{after.id}', json=payload)
+            self.bot.write_queue.patch(f'guilds/{after.id}', payload)
 
     @Cog.listener()
+    @serialized(lambda role: ('role', role.id))
     async def on_guild_role_create(self, role: discord.Role) -> None:
         """Adds the newly created role to the database through the API."""
         log.trace(f'New role {role.name} ({role.id}) created in guild {role.guild.name} ({role.guild.id})')
         await self.bot.api_client.post(
             'roles',
+            durable=True,
             json={
                 'id': role.id,
                 'color': role.color.value,
@@ -88,6 +144,7 @@ class Syncer(Cog):
         )
 
     @Cog.listener()
+    @serialized(lambda before, after: ('role', after.id))
     async def on_guild_role_update(self, before: discord.Role, after: discord.Role) -> None:
         """Adds the updated role information into the database through the Snek API."""
         attrs = ('name', 'color', 'permissions', 'position')
@@ -102,15 +159,18 @@ class Syncer(Cog):
 
         if payload:
             log.trace(f'Updated role {after.name} ({after.id}) for guild {after.guild.name} ({after.guild.id})')
-            await self.bot.api_client.patch(f'roles/{after.id}', json=payload)
+            self.bot.write_queue.patch(f'roles/{after.id}', payload)
 
     @Cog.listener()
+    @serialized(lambda role: ('role', role.id))
     async def on_guild_role_delete(self, role: discord.Role) -> None:
         """Deletes the role from the database when deleted from a guild."""
         log.trace(f'Deleted role {role.name} ({role.id}) from guild {role.guild.name} ({role.guild.id})')
-        await self.bot.api_client.delete(f'roles/{role.id}')
+        self.bot.write_queue.discard(f'roles/{role.id}')
+        await self.bot.api_client.delete(f'roles/{role.id}', durable=True)
 
     @Cog.listener()
+    @serialized(lambda member: ('user', member.id))
     async def on_member_join(self, member: discord.Member) -> None:
         """
         Adds a new user or updates an existing user to the database when a member joins a guild.
@@ -118,30 +178,51 @@ class Syncer(Cog):
         If the joining member is a user that is already know to the database (e.g. a user who
         previously left), it will update the user's information. If the user is not yet known,
         the user is added.
+
+        Users are looked up in the IDs written by the syncs first, so new users are added straight
+        away; updating only falls back to adding for users that lookup can't rule out. The lookup
+        misses users who were in the database before the bot first synchronised them, so adding
+        falls back to updating when the user already exists.
+
+        Every write is durable, so it's queued behind the writes to the user still waiting in the
+        outbox rather than racing their replay. A queued write is replayed as it is, without the
+        fallback.
         """
-        payload = {
-            'id': member.id,
-            'name': member.name,
-            'discriminator': member.discriminator,
-            'created_at': str(member.created_at),
-            'avatar_url': str(member.avatar_url),
-            'roles': sorted(role.id for role in member.roles),
-            'guilds': [guild.id for guild in self.bot.guilds if guild.get_member(member.id) is not None]
-        }
+        self.update_membership('add', member)
+        payload = user_from_member(member, self.membership)._asdict()
 
         log.trace(f'User {member.name} ({member.id}) joined guild {member.guild.name} ({member.guild.id})')
 
+        # The whole user written below supersedes its pending update, which would otherwise be applied over it
+        self.bot.write_queue.discard(f'users/{member.id}')
+
+        # Users the last sync didn't write, and which weren't created since, are new
+        if self.user_syncer.in_database(member.id) is False:
+            try:
+                await self.bot.api_client.post('users', json=payload, durable=True)
+
+            except ResponseCodeError as err:
+                if not already_exists(err):
+                    raise
+
+                await self.bot.api_client.put(f'users/{member.id}', json=payload, durable=True)
+
+            self.user_syncer.created_ids.add(member.id)
+            return
+
         try:
-            await self.bot.api_client.put(f'users/{member.id}', json=payload)
+            await self.bot.api_client.put(f'users/{member.id}', json=payload, durable=True)
 
         except ResponseCodeError as err:
             if err.response.status != 404:
                 raise
 
             # If we got a 404, that means the user is new.
-            await self.bot.api_client.post('users', json=payload)
+            await self.bot.api_client.post('users', json=payload, durable=True)
+            self.user_syncer.created_ids.add(member.id)
 
     @Cog.listener()
+    @serialized(lambda before, after: ('user', after.id))
     async def on_member_update(self, before: discord.Member, after: discord.Member) -> None:
         """Update the roles of the member in the database if a change is detected."""
         if before.roles != after.roles:
@@ -149,40 +230,26 @@ class Syncer(Cog):
                 f'Updated roles for user {after.name} ({after.id}) in guild {after.guild.name} ({after.guild.id})'
             )
 
-            member_info = await self.bot.api_client.get(f'users/{after.id}')
-
-            before_roles = set(role.id for role in before.roles)
-            after_roles = set(role.id for role in after.roles)
-            roles = member_info['roles']
-
-            added = after_roles - before_roles
-            if added:
-                roles.extend(added)
-
-            deleted = before_roles - after_roles
-            if deleted:
-                for role in deleted:
-                    roles.remove(role)
-
-            # There must either be a role added or removed, so both situations have been handled
-            await self.bot.api_client.patch(f'users/{after.id}', json={'roles': roles})
+            self.update_membership('update_roles', before, after)
+            self.bot.write_queue.patch(f'users/{after.id}', {'roles': list(self.membership.roles(after.id))})
 
     @Cog.listener()
+    @serialized(lambda member: ('user', member.id))
     async def on_member_remove(self, member: discord.Member) -> None:
         """Remove guild from the user's data in the database."""
         log.trace(f'User {member.name} ({member.id}) left guild {member.guild} ({member.guild.id})')
 
-        member_info = await self.bot.api_client.get(f'users/{member.id}')
-
-        await self.bot.api_client.patch(
+        self.update_membership('remove', member)
+        self.bot.write_queue.patch(
             f'users/{member.id}',
-            json={
-                'guilds': list(set(member_info['guilds']) - {member.guild.id}),
-                'roles': list(set(member_info['roles']) - {role.id for role in member.guild.roles})
+            {
+                'guilds': list(self.membership.guilds(member.id)),
+                'roles': list(self.membership.roles(member.id))
             }
         )
 
     @Cog.listener()
+    @serialized(lambda before, after: ('user', after.id))
     async def on_user_update(self, before: discord.User, after: discord.User) -> None:
         """Update the user information in the database if a relevant change is detected."""
         attrs = ('name', 'discriminator', 'avatar_url')
@@ -199,7 +266,7 @@ class Syncer(Cog):
             log.trace(
                 f'Updated user info for {after.name} ({after.id})'
             )
-            await self.bot.api_client.patch(f'users/{after.id}', json=payload)
+            self.bot.write_queue.patch(f'users/{after.id}', payload)
 
     @commands.group(name='sync', invoke_without_command=True)
     async def sync_group(self, ctx: Context) -> None:
@@ -209,22 +276,43 @@ class Syncer(Cog):
     @sync_group.command(name='guilds')
     async def sync_guilds_command(self, ctx: Context) -> None:
         """Manually synchronise cached guilds with the guilds in the API."""
-        await self.guild_syncer.sync(ctx)
+        await self.scheduler.sync(ctx, syncers=(self.guild_syncer,))
 
     @sync_group.command(name='roles')
     async def sync_roles_command(self, ctx: Context) -> None:
         """Manually synchronise cached roles with the roles in the API."""
-        await self.role_syncer.sync(ctx)
+        await self.scheduler.sync(ctx, syncers=(self.role_syncer,))
 
     @sync_group.command(name='users')
     async def sync_users_command(self, ctx: Context) -> None:
         """Manually synchronise cached users with the users in the API."""
-        await self.user_syncer.sync(ctx)
+        await self.scheduler.sync(ctx, syncers=(self.user_syncer,))
 
     @sync_group.command(name='all')
     async def sync_all_command(self, ctx: Context) -> None:
         """Manually synchronise guilds/roles/users with the API."""
-        await self.sync(ctx)
+        timings = await self.sync(ctx)
+        await ctx.send(f'⏱️ {format_timings(timings)}')
+
+    @sync_group.command(name='profile', aliases=('dry-run', 'dryrun'))
+    async def sync_profile_command(self, ctx: Context, incremental: bool = False) -> None:
+        """
+        Compute what synchronising guilds/roles/users would write, without writing anything.
+
+        Shows the size of each diff, the time spent building the cache snapshot, fetching from the
+        API and comparing, and the peak memory allocated. Pass `yes` to profile an incremental
+        synchronisation.
+        """
+        async with ctx.typing():
+            results = await self.scheduler.dry_run(incremental)
+
+        lines = (format_dry_run(name, result) for name, result in results.items())
+        await ctx.send('🔍 Dry run, nothing was written:\n' + '\n'.join(f'`{line}`' for line in lines))
+
+    def cog_unload(self) -> None:
+        """Cancel the queued listeners, and shut the sync executor down."""
+        self.dispatcher.close()
+        self.executor.shutdown()
 
     async def cog_check(self, ctx: Context) -> bool:
         """Only allow the owner of the bot to invoke the commands in this cog."""
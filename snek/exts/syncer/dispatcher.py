@@ -0,0 +1,138 @@
+import asyncio
+from collections import Counter
+import functools
+import logging
+import os
+import time
+import typing as t
+
+from snek.utils.metrics import format_labels, Histogram, metric_family
+
+log = logging.getLogger(__name__)
+
+# The number of handlers that may be queued for a single key before submitting more waits for room
+MAX_QUEUE_DEPTH = int(os.environ.get('SNEK_SYNC_DISPATCH_DEPTH', 100))
+
+
+class KeyedDispatcher:
+    """
+    Runs handlers one at a time per key, e.g. per user ID, and concurrently across keys.
+
+    Handlers for the same key run in the order they were submitted, so two events for the same
+    object can't interleave their writes. Each key has a bounded queue, drained by a task that
+    only exists while the queue isn't empty.
+    """
+
+    def __init__(self, max_depth: int = MAX_QUEUE_DEPTH) -> None:
+        self.max_depth = max_depth
+
+        self._queues: t.Dict[t.Hashable, asyncio.Queue] = dict()
+        self._workers: t.Dict[t.Hashable, asyncio.Task] = dict()
+
+        # The number of submissions waiting for room in each key's queue, which keep it from being dropped
+        self._waiting = Counter()
+
+        # How long handlers waited in their queue, and how long they ran, in seconds
+        self.lag = Histogram()
+        self.runtime = Histogram()
+
+        self.submitted = 0
+        self.failed = 0
+
+    @property
+    def depth(self) -> int:
+        """The number of handlers queued and not started yet, across every key."""
+        return sum(queue.qsize() for queue in self._queues.values())
+
+    async def submit(self, key: t.Hashable, func: t.Callable[..., t.Awaitable], *args) -> None:
+        """
+        Queue `func(*args)` to run once the handlers submitted before it for `key` are done.
+
+        If `max_depth` handlers are already queued for `key`, this waits until one of them starts.
+        """
+        if (queue := self._queues.get(key)) is None:
+            queue = self._queues[key] = asyncio.Queue(self.max_depth)
+
+        self._waiting[key] += 1
+        try:
+            await queue.put((time.perf_counter(), func, args))
+        finally:
+            self._waiting[key] -= 1
+            if not self._waiting[key]:
+                del self._waiting[key]
+
+        self.submitted += 1
+
+        if key not in self._workers:
+            self._workers[key] = asyncio.ensure_future(self._drain(key, queue))
+
+    async def _drain(self, key: t.Hashable, queue: asyncio.Queue) -> None:
+        try:
+            while not queue.empty():
+                queued, func, args = queue.get_nowait()
+
+                started = time.perf_counter()
+                self.lag.observe(started - queued)
+
+                try:
+                    await func(*args)
+                except Exception:
+                    self.failed += 1
+                    log.exception(f'The {func.__name__} handler for {key} failed.')
+                finally:
+                    self.runtime.observe(time.perf_counter() - started)
+
+        finally:
+            del self._workers[key]
+
+            # A submission waiting for room starts another worker once it's queued
+            if queue.empty() and key not in self._waiting and self._queues.get(key) is queue:
+                del self._queues[key]
+
+    def close(self) -> None:
+        """Cancel every queued and running handler."""
+        for task in self._workers.values():
+            task.cancel()
+
+    def prometheus(self, name: str = 'snek_sync_dispatch') -> t.List[str]:
+        """Return the dispatcher's metrics in the Prometheus text exposition format."""
+        lines = metric_family(
+            f'{name}_lag_seconds', 'histogram', 'How long handlers waited behind others for the same key.',
+            self.lag.prometheus_samples(f'{name}_lag_seconds', {})
+        )
+        lines.extend(metric_family(
+            f'{name}_runtime_seconds', 'histogram', 'How long handlers ran.',
+            self.runtime.prometheus_samples(f'{name}_runtime_seconds', {})
+        ))
+        lines.extend(metric_family(
+            f'{name}_handlers_total', 'counter', 'Handlers submitted, and those that raised.',
+            (
+                f'{name}_handlers_total{format_labels({"result": "submitted"})} {self.submitted}',
+                f'{name}_handlers_total{format_labels({"result": "failed"})} {self.failed}'
+            )
+        ))
+        lines.extend(metric_family(
+            f'{name}_queue_depth', 'gauge', 'Handlers queued and not started yet.',
+            (f'{name}_queue_depth {self.depth}',)
+        ))
+
+        return lines
+
+
+def serialized(key: t.Callable[..., t.Hashable]) -> t.Callable:
+    """
+    Run the decorated cog method through the cog's `dispatcher`, keyed by `key(*args)`.
+
+    The method returns once its call is queued, rather than once it's done. The bot's event metrics
+    time the method when it runs, rather than when it's queued.
+    """
+    def decorator(func: t.Callable[..., t.Awaitable]) -> t.Callable[..., t.Awaitable]:
+        @functools.wraps(func)
+        async def wrapper(self: t.Any, *args) -> None:
+            handler = self.bot.event_metrics.instrument(func.__name__, func)
+            await self.dispatcher.submit(key(*args), handler, self, *args)
+
+        wrapper.__instrumented__ = True
+        return wrapper
+
+    return decorator
@@ -0,0 +1,56 @@
+import asyncio
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+import functools
+import logging
+import os
+import typing as t
+
+log = logging.getLogger(__name__)
+
+# Where the CPU-bound parts of diffs run: on the event loop itself, in a thread pool, or in a process pool
+EXECUTOR = os.environ.get('SNEK_SYNC_EXECUTOR', 'thread')
+EXECUTOR_WORKERS = int(os.environ.get('SNEK_SYNC_EXECUTOR_WORKERS', 2))
+
+EXECUTOR_KINDS = ('loop', 'thread', 'process')
+
+
+class SyncExecutor:
+    """
+    Runs the CPU-bound parts of diffs, such as hashing the cache objects, off the event loop.
+
+    The work is given plain data snapshotted from the cache, never the cache itself, which the
+    gateway keeps changing on the loop. In a thread pool, the loop keeps running whenever the
+    worker releases the GIL, which is often enough to keep the gateway heartbeat on time. A process
+    pool doesn't share the GIL at all, but the work and its results must be pickled. The pool is
+    created on first use.
+    """
+
+    def __init__(self, kind: str = EXECUTOR, workers: int = EXECUTOR_WORKERS) -> None:
+        if kind not in EXECUTOR_KINDS:
+            raise ValueError(f'The sync executor must be one of {", ".join(EXECUTOR_KINDS)}, not {kind!r}.')
+
+        self.kind = kind
+        self.workers = workers
+
+        self._pool: t.Optional[Executor] = None
+
+    async def run(self, func: t.Callable, *args) -> t.Any:
+        """Return `func(*args)`, run in the executor's pool if it has one."""
+        if self.kind == 'loop':
+            return func(*args)
+
+        if self._pool is None:
+            log.debug(f'Starting the sync {self.kind} pool with {self.workers} workers.')
+
+            if self.kind == 'thread':
+                self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix='snek-sync')
+            else:
+                self._pool = ProcessPoolExecutor(self.workers)
+
+        return await asyncio.get_running_loop().run_in_executor(self._pool, functools.partial(func, *args))
+
+    def shutdown(self) -> None:
+        """Shut the pool down once the work in progress is done."""
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
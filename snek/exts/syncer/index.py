@@ -0,0 +1,216 @@
+import typing as t
+
+import discord
+
+from snek.exts.syncer.snapshot import Interner
+
+
+class MembershipIndex:
+    """
+    An inverted index of the guilds each cached user is a member of, and the roles they have in them.
+
+    Built in a single pass over the members of each guild, so looking up a user's guilds or roles
+    doesn't require probing every guild the bot is in. It can then be kept up to date as members
+    join, leave and have their roles changed.
+    """
+
+    __slots__ = ('members', '_guilds', '_roles')
+
+    def __init__(self) -> None:
+        # The first member seen for each user, which the user's attributes are read from
+        self.members: t.Dict[int, discord.Member] = dict()
+
+        self._guilds: t.Dict[int, t.List[int]] = dict()
+        self._roles: t.Dict[int, t.Set[int]] = dict()
+
+    @classmethod
+    def from_guilds(cls, guilds: t.Iterable[discord.Guild]) -> 'MembershipIndex':
+        """Index the members of every guild in `guilds`."""
+        return cls.from_members(cls.iter_members(guilds))
+
+    @classmethod
+    def from_users(cls, guilds: t.Iterable[discord.Guild], user_ids: t.Set[int]) -> 'MembershipIndex':
+        """Index only the memberships of the users with the IDs `user_ids` in `guilds`."""
+        return cls.from_members(cls.iter_members(guilds, user_ids))
+
+    @classmethod
+    def from_members(cls, members: t.Iterable[t.Optional[discord.Member]]) -> 'MembershipIndex':
+        """Index the memberships of `members`, skipping None."""
+        index = cls()
+
+        for member in members:
+            if member is not None:
+                index.add(member)
+
+        return index
+
+    @staticmethod
+    def iter_members(
+        guilds: t.Iterable[discord.Guild], user_ids: t.Optional[t.Set[int]] = None
+    ) -> t.Iterator[t.Optional[discord.Member]]:
+        """
+        Iterate over the members of every guild in `guilds`, or only those of the users with the IDs `user_ids`.
+
+        Each guild is either probed for every user or scanned, whichever takes fewer lookups. Every
+        lookup yields, None when it misses, so consuming the members a chunk at a time also bounds
+        the lookups made meanwhile.
+        """
+        for guild in guilds:
+            if user_ids is None:
+                yield from guild.members
+
+            elif len(user_ids) <= guild.member_count:
+                yield from (guild.get_member(user_id) for user_id in user_ids)
+
+            else:
+                yield from (member if member.id in user_ids else None for member in guild.members)
+
+    @classmethod
+    def from_user(cls, guilds: t.Iterable[discord.Guild], user_id: int) -> 'MembershipIndex':
+        """Index only the memberships of the user with the ID `user_id` in `guilds`."""
+        return cls.from_users(guilds, {user_id})
+
+    def add(self, member: discord.Member) -> None:
+        """Add the guild and roles of `member` to the index."""
+        if (guilds := self._guilds.get(member.id)) is None:
+            self.members[member.id] = member
+            guilds = self._guilds[member.id] = list()
+            roles = self._roles[member.id] = set()
+
+        else:
+            roles = self._roles[member.id]
+
+        if member.guild.id not in guilds:
+            guilds.append(member.guild.id)
+
+        roles.update(role.id for role in member.roles)
+
+    def remove(self, member: discord.Member) -> None:
+        """Remove the guild of `member` and its roles from the index, and the user if it was their last guild."""
+        if (guilds := self._guilds.get(member.id)) is None:
+            return
+
+        if member.guild.id in guilds:
+            guilds.remove(member.guild.id)
+
+        if not guilds:
+            del self.members[member.id], self._guilds[member.id], self._roles[member.id]
+            return
+
+        # The user's attributes may still be read from `member`, as members share their user
+        self._roles[member.id].difference_update(role.id for role in member.guild.roles)
+
+    def update_roles(self, before: discord.Member, after: discord.Member) -> None:
+        """Replace the roles `before` had in its guild with those `after` has."""
+        if (roles := self._roles.get(after.id)) is None:
+            self.add(after)
+            return
+
+        roles.difference_update(role.id for role in before.roles)
+        roles.update(role.id for role in after.roles)
+
+    def remove_guild(self, guild: discord.Guild) -> None:
+        """Remove every membership of `guild` from the index."""
+        for member in guild.members:
+            self.remove(member)
+
+    def guilds(self, user_id: int) -> t.Tuple[int, ...]:
+        """Return the IDs of the guilds the user is a member of, in the order they were indexed."""
+        return tuple(self._guilds.get(user_id, ()))
+
+    def roles(self, user_id: int) -> t.Tuple[int, ...]:
+        """Return the sorted IDs of the roles the user has across all their guilds."""
+        return tuple(sorted(self._roles.get(user_id, ())))
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._guilds
+
+    def __len__(self) -> int:
+        return len(self._guilds)
+
+
+class MembershipMirror:
+    """
+    The guilds and roles of every user, as last written to the database, kept compactly.
+
+    Each user only maps to a pair of tuples, their guild IDs and sorted role IDs. When the mirror
+    is built from an index, the tuples are interned, e.g. with those of a snapshot of the users.
+    Listeners then keep it up to date without fetching the users.
+    """
+
+    __slots__ = ('_memberships',)
+
+    def __init__(self) -> None:
+        self._memberships: t.Dict[int, t.Tuple[t.Tuple[int, ...], t.Tuple[int, ...]]] = dict()
+
+    @classmethod
+    def from_index(cls, index: MembershipIndex, intern: t.Optional[Interner] = None) -> 'MembershipMirror':
+        """Mirror the memberships in `index`, sharing equal tuples with those already interned by `intern`."""
+        mirror = cls()
+        intern = Interner() if intern is None else intern
+
+        for user_id in index.members:
+            mirror.set(user_id, intern(index.guilds(user_id)), intern(index.roles(user_id)))
+
+        return mirror
+
+    @classmethod
+    def from_guilds(cls, guilds: t.Iterable[discord.Guild]) -> 'MembershipMirror':
+        """Mirror the memberships of every member of `guilds`."""
+        return cls.from_index(MembershipIndex.from_guilds(guilds))
+
+    def set(self, user_id: int, guilds: t.Tuple[int, ...], roles: t.Tuple[int, ...]) -> None:
+        """Record the `guilds` of the user with the ID `user_id`, and their sorted `roles`."""
+        self._memberships[user_id] = (guilds, roles)
+
+    def add(self, member: discord.Member) -> None:
+        """Add the guild and roles of `member`."""
+        guilds, roles = self._memberships.get(member.id, ((), ()))
+
+        if member.guild.id not in guilds:
+            guilds += (member.guild.id,)
+
+        self._memberships[member.id] = (guilds, tuple(sorted({*roles, *(role.id for role in member.roles)})))
+
+    def remove(self, member: discord.Member) -> None:
+        """Remove the guild of `member` and its roles, and the user if it was their last guild."""
+        if (membership := self._memberships.get(member.id)) is None:
+            return
+
+        guilds = tuple(guild_id for guild_id in membership[0] if guild_id != member.guild.id)
+
+        if not guilds:
+            del self._memberships[member.id]
+            return
+
+        roles = set(membership[1]).difference(role.id for role in member.guild.roles)
+        self._memberships[member.id] = (guilds, tuple(sorted(roles)))
+
+    def update_roles(self, before: discord.Member, after: discord.Member) -> None:
+        """Replace the roles `before` had in its guild with those `after` has."""
+        if (membership := self._memberships.get(after.id)) is None:
+            self.add(after)
+            return
+
+        roles = set(membership[1]).difference(role.id for role in before.roles)
+        roles.update(role.id for role in after.roles)
+        self._memberships[after.id] = (membership[0], tuple(sorted(roles)))
+
+    def remove_guild(self, guild: discord.Guild) -> None:
+        """Remove every membership of `guild`."""
+        for member in guild.members:
+            self.remove(member)
+
+    def guilds(self, user_id: int) -> t.Tuple[int, ...]:
+        """Return the IDs of the guilds the user is a member of."""
+        return self._memberships.get(user_id, ((), ()))[0]
+
+    def roles(self, user_id: int) -> t.Tuple[int, ...]:
+        """Return the sorted IDs of the roles the user has across all their guilds."""
+        return self._memberships.get(user_id, ((), ()))[1]
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._memberships
+
+    def __len__(self) -> int:
+        return len(self._memberships)
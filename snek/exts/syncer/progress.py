@@ -0,0 +1,57 @@
+import logging
+import os
+import time
+import typing as t
+
+import discord
+
+log = logging.getLogger(__name__)
+
+# The minimum number of seconds between two progress reports of a sync
+PROGRESS_INTERVAL = float(os.environ.get('SNEK_SYNC_PROGRESS_INTERVAL', 5))
+
+
+class SyncProgress:
+    """
+    The number of objects of a diff a sync has processed so far.
+
+    Progress is logged, and shown in the sync's status message if it has one, at most once every
+    `interval` seconds so large syncs don't hit Discord's rate limits.
+    """
+
+    def __init__(
+        self, name: str, total: int, message: t.Optional[discord.Message] = None, interval: float = PROGRESS_INTERVAL
+    ) -> None:
+        self.name = name
+        self.total = total
+        self.message = message
+        self.interval = interval
+
+        self.processed = 0
+        self.started = self._reported = time.perf_counter()
+
+    @property
+    def rate(self) -> float:
+        """The number of objects processed per second so far."""
+        elapsed = time.perf_counter() - self.started
+        return self.processed / elapsed if elapsed > 0 else 0.0
+
+    def __str__(self) -> str:
+        return f'{self.processed}/{self.total} {self.name}s ({self.rate:.0f}/s)'
+
+    async def advance(self, count: int) -> None:
+        """Count `count` more objects as processed, and report the progress if the last report is old enough."""
+        self.processed += count
+
+        if (now := time.perf_counter()) - self._reported < self.interval:
+            return
+
+        # Set before editing the message, so chunks finishing meanwhile don't report too
+        self._reported = now
+        log.info(f'Synchronising {self}..')
+
+        if self.message is not None:
+            try:
+                await self.message.edit(content=f'📊 Synchronising {self}..')
+            except discord.HTTPException as err:
+                log.warning(f'Could not update the progress of the {self.name} sync: {err}')
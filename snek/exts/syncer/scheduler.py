@@ -0,0 +1,197 @@
+import asyncio
+from collections import namedtuple
+import logging
+import time
+import tracemalloc
+import typing as t
+
+import discord
+from discord.ext.commands import Context
+
+from snek.exts.syncer.syncers.base import ObjectSyncerABC
+from snek.utils import LoopLagMonitor
+
+log = logging.getLogger(__name__)
+
+# The wall time of each phase of a sync in seconds, where `diff` and `write` are keyed by syncer name,
+# and a histogram of the event loop's lag during the sync
+SyncTimings = namedtuple('SyncTimings', ('diff', 'write', 'total', 'loop_lag'))
+
+
+def format_timings(timings: SyncTimings) -> str:
+    """Return a one-line summary of `timings`."""
+    diff = ', '.join(f'{name} {seconds:.2f}s' for name, seconds in timings.diff.items())
+    write = ', '.join(f'{name} {seconds:.2f}s' for name, seconds in timings.write.items())
+    lag = f'p99 {timings.loop_lag.percentile(99) * 1000:.0f}ms, max {timings.loop_lag.max * 1000:.0f}ms'
+
+    return f'diff: {diff}; write: {write}; total: {timings.total:.2f}s; loop lag: {lag}'
+
+
+# The diff a syncer would apply, the timings of computing it, and the peak memory allocated meanwhile in bytes
+DryRun = namedtuple('DryRun', ('diff', 'timings', 'peak'))
+
+
+def format_dry_run(name: str, dry_run: DryRun) -> str:
+    """Return a one-line summary of the dry run of the syncer called `name`."""
+    diff, timings, peak = dry_run
+    deleted = '-' if diff.deleted is None else len(diff.deleted)
+    peak = '-' if peak is None else f'{peak / 2 ** 20:.1f} MiB'
+
+    return (
+        f'{name}s: {len(diff.created)} created, {len(diff.updated)} updated, {deleted} deleted; '
+        f'cache {timings.cache:.2f}s, fetch {timings.fetch:.2f}s, compare {timings.compare:.2f}s, '
+        f'total {timings.total:.2f}s; peak {peak}'
+    )
+
+
+class SyncScheduler:
+    """
+    Run syncers as concurrently as their dependencies allow.
+
+    The diffs of every syncer are computed at once, as they only read from the API. The writes are
+    run in phases instead: a syncer's writes start once its diff is ready and the writes of the
+    syncers it depends on are done, e.g. roles and users are written once guilds are.
+
+    Syncs and dry runs are run one at a time, as they share the syncers' state, such as the hashes
+    staged to be recorded once the writes are done.
+    """
+
+    def __init__(self, syncers: t.Iterable[ObjectSyncerABC]) -> None:
+        self.syncers = list(syncers)
+        self.phases = self.order(self.syncers)
+
+        # The timings of the last sync
+        self.timings: t.Optional[SyncTimings] = None
+
+        # Held by the sync or dry run under way
+        self.lock = asyncio.Lock()
+
+    @staticmethod
+    def order(syncers: t.List[ObjectSyncerABC]) -> t.List[t.List[ObjectSyncerABC]]:
+        """
+        Group `syncers` into phases, each depending only on syncers in earlier phases.
+
+        Dependencies on syncers that aren't in `syncers` are ignored.
+        """
+        names = {syncer.name for syncer in syncers}
+        remaining = list(syncers)
+        done = set()
+        phases = []
+
+        while remaining:
+            phase = [
+                syncer for syncer in remaining
+                if all(name in done or name not in names for name in syncer.depends_on)
+            ]
+
+            if not phase:
+                raise ValueError(f'The {", ".join(syncer.name for syncer in remaining)} syncers depend on each other.')
+
+            phases.append(phase)
+            done.update(syncer.name for syncer in phase)
+            remaining = [syncer for syncer in remaining if syncer not in phase]
+
+        return phases
+
+    async def dry_run(
+        self, incremental: bool = False, guild: t.Optional[discord.Guild] = None
+    ) -> t.Dict[str, DryRun]:
+        """
+        Compute the diff of every syncer without writing anything, and profile each, keyed by syncer name.
+
+        The syncers are run one at a time, so their timings and allocations are their own. Allocations
+        are traced with `tracemalloc`, which slows the diffs down, and those made in a process pool
+        aren't traced. If allocations are already being traced, their peak isn't reported.
+        """
+        results = dict()
+
+        if self.lock.locked():
+            log.info('Waiting for the synchronisation under way to finish before the dry run..')
+
+        async with self.lock:
+            for syncer in (syncer for phase in self.phases for syncer in phase):
+                results[syncer.name] = await self.profile(syncer, incremental, guild)
+
+        return results
+
+    @staticmethod
+    async def profile(syncer: ObjectSyncerABC, incremental: bool, guild: t.Optional[discord.Guild]) -> DryRun:
+        """Return the dry run of `syncer`, with the peak memory allocated meanwhile if it can be traced."""
+        if tracing := not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+        try:
+            diff, timings = await syncer.dry_run(incremental, guild)
+            _, peak = tracemalloc.get_traced_memory()
+
+        finally:
+            if tracing:
+                tracemalloc.stop()
+
+        return DryRun(diff, timings, peak if tracing else None)
+
+    async def sync(
+        self,
+        ctx: t.Optional[Context] = None,
+        incremental: bool = False,
+        guild: t.Optional[discord.Guild] = None,
+        syncers: t.Optional[t.Iterable[ObjectSyncerABC]] = None
+    ) -> SyncTimings:
+        """
+        Run every syncer, or only `syncers`, and return the timings of each phase, and the lag of the event loop.
+
+        The syncers are run incrementally if `incremental` is True, or limited to `guild` if it's given.
+        If a sync or dry run is under way, this one waits for it to finish.
+        """
+        if self.lock.locked():
+            log.info('Waiting for the synchronisation under way to finish..')
+
+        async with self.lock:
+            return await self._sync(ctx, incremental, guild, self.syncers if syncers is None else list(syncers))
+
+    async def _sync(
+        self,
+        ctx: t.Optional[Context],
+        incremental: bool,
+        guild: t.Optional[discord.Guild],
+        syncers: t.List[ObjectSyncerABC]
+    ) -> SyncTimings:
+        started = time.perf_counter()
+        diff_timings = dict()
+        write_timings = dict()
+
+        async def get_diff(syncer: ObjectSyncerABC) -> t.Any:
+            diff_started = time.perf_counter()
+
+            try:
+                return await syncer.get_diff(incremental, guild)
+            finally:
+                diff_timings[syncer.name] = time.perf_counter() - diff_started
+
+        async def write(syncer: ObjectSyncerABC) -> None:
+            # Wait for the diff first, so only the writes are timed
+            await asyncio.wait({diffs[syncer.name]})
+
+            write_started = time.perf_counter()
+            await syncer.sync(ctx, diff=diffs[syncer.name], guild=guild)
+            write_timings[syncer.name] = time.perf_counter() - write_started
+
+        # Started first, so it also measures the diffs blocking the loop as soon as they start
+        monitor = LoopLagMonitor()
+        monitor.start()
+
+        diffs = {syncer.name: asyncio.ensure_future(get_diff(syncer)) for syncer in syncers}
+        try:
+            for phase in self.order(syncers):
+                await asyncio.gather(*(write(syncer) for syncer in phase))
+
+        finally:
+            monitor.stop()
+
+            for task in diffs.values():
+                task.cancel()
+
+        self.timings = SyncTimings(diff_timings, write_timings, time.perf_counter() - started, monitor.lag)
+        log.info(f'Synchronisation finished; {format_timings(self.timings)}')
+
+        return self.timings
@@ -0,0 +1,140 @@
+from array import array
+import asyncio
+from bisect import bisect_left
+from collections.abc import ItemsView, Mapping, ValuesView
+from itertools import islice
+import os
+import typing as t
+
+# The number of cache objects snapshotted between yields to the event loop, which bounds how long each blocks it
+CHUNK_SIZE = int(os.environ.get('SNEK_SYNC_SNAPSHOT_CHUNK_SIZE', 1000))
+
+
+async def chunked(iterable: t.Iterable, size: int = CHUNK_SIZE) -> t.AsyncIterator[t.List]:
+    """
+    Iterate over `iterable` in lists of up to `size` items, yielding to the event loop after each.
+
+    A lazy `iterable`, e.g. a generator reading the cache, is only advanced a chunk at a time, so
+    the gateway and the listeners keep running while it's consumed.
+    """
+    iterator = iter(iterable)
+
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+        await asyncio.sleep(0)
+
+
+class Interner:
+    """
+    Deduplicate equal immutable values, e.g. strings and tuples, so each is only stored once.
+
+    Values repeated across many objects, such as role names or the role IDs of users with the same
+    roles, then share a single object.
+    """
+
+    __slots__ = ('_values',)
+
+    def __init__(self) -> None:
+        self._values: t.Dict[t.Hashable, t.Hashable] = dict()
+
+    def __call__(self, value: t.Hashable) -> t.Any:
+        return self._values.setdefault(value, value)
+
+
+class _SnapshotItems(ItemsView):
+    __slots__ = ()
+
+    def __iter__(self) -> t.Iterator[t.Tuple[int, t.Any]]:
+        return zip(self._mapping.ids, self._mapping.entries)
+
+
+class _SnapshotValues(ValuesView):
+    __slots__ = ()
+
+    def __iter__(self) -> t.Iterator[t.Any]:
+        return iter(self._mapping.entries)
+
+
+class Snapshot(Mapping):
+    """
+    An immutable mapping of IDs to values, stored as columns.
+
+    The IDs are kept sorted in an `array('Q')`, 8 bytes each, and the values in `entries`, in the
+    same order: a list of objects, or an array of numbers. Snapshots take a fraction of the memory
+    of a dict, and can share their IDs; looking up an ID is a binary search.
+    """
+
+    __slots__ = ('ids', 'entries')
+
+    def __init__(self, ids: t.Optional[array] = None, entries: t.Optional[t.Sequence] = None) -> None:
+        self.ids = array('Q') if ids is None else ids
+        self.entries = list() if entries is None else entries
+
+        if len(self.ids) != len(self.entries):
+            raise ValueError(f'A snapshot needs as many entries as IDs, not {len(self.entries)} for {len(self.ids)}.')
+
+    @classmethod
+    def from_items(cls, items: t.Iterable[t.Tuple[int, t.Any]], typecode: t.Optional[str] = None) -> 'Snapshot':
+        """Return a snapshot of `items`, with the values in an array of `typecode` if it's given, or a list."""
+        items = sorted(items, key=lambda item: item[0])
+
+        ids = array('Q', (id_ for id_, _ in items))
+        values = (value for _, value in items)
+
+        return cls(ids, array(typecode, values) if typecode else list(values))
+
+    def column(self, func: t.Callable[[t.Any], int], typecode: str = 'Q') -> 'Snapshot':
+        """Return a snapshot of `func(value)` for every value in an array of `typecode`, sharing the IDs."""
+        return Snapshot(self.ids, array(typecode, map(func, self.entries)))
+
+    def index(self, id_: int) -> int:
+        """Return the position of `id_` in the snapshot, or -1 if it isn't in it."""
+        index = bisect_left(self.ids, id_)
+        return index if index < len(self.ids) and self.ids[index] == id_ else -1
+
+    def updated(self, items: t.Mapping[int, t.Any], removed: t.Iterable[int] = ()) -> 'Snapshot':
+        """Return a copy of the snapshot with `items` set, and without the IDs in `removed`."""
+        changes = [*items.items(), *((id_, None) for id_ in removed if id_ not in items)]
+        changes.sort(key=lambda change: change[0])
+
+        ids = array('Q')
+        entries = array(self.entries.typecode) if isinstance(self.entries, array) else list()
+        start = 0
+
+        # Merge the sorted changes into the sorted columns
+        for id_, value in changes:
+            index = bisect_left(self.ids, id_, start)
+            ids.extend(self.ids[start:index])
+            entries.extend(self.entries[start:index])
+
+            if id_ in items:
+                ids.append(id_)
+                entries.append(value)
+
+            start = index + 1 if index < len(self.ids) and self.ids[index] == id_ else index
+
+        ids.extend(self.ids[start:])
+        entries.extend(self.entries[start:])
+
+        return Snapshot(ids, entries)
+
+    def __getitem__(self, id_: int) -> t.Any:
+        if (index := self.index(id_)) < 0:
+            raise KeyError(id_)
+
+        return self.entries[index]
+
+    def __contains__(self, id_: object) -> bool:
+        return isinstance(id_, int) and self.index(id_) >= 0
+
+    def __iter__(self) -> t.Iterator[int]:
+        return iter(self.ids)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def items(self) -> ItemsView:
+        return _SnapshotItems(self)
+
+    def values(self) -> ValuesView:
+        return _SnapshotValues(self)
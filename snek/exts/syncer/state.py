@@ -0,0 +1,172 @@
+from array import array
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import typing as t
+
+from snek.exts.syncer.snapshot import Snapshot
+
+log = logging.getLogger(__name__)
+
+STATE_DIR = pathlib.Path(os.environ.get('SNEK_SYNC_STATE_DIR', 'data/syncer'))
+
+# The hash recorded for an object whose state in the database is unknown, e.g. because syncing it failed
+UNKNOWN = 0
+
+
+def content_hash(obj: tuple) -> int:
+    """Return the 64-bit hash of the contents of a synchronised object, stable across restarts."""
+    return int.from_bytes(hashlib.blake2b(repr(tuple(obj)).encode(), digest_size=8).digest(), 'big')
+
+
+class SyncState:
+    """
+    What a syncer knows about the database from its last synchronisation, persisted across restarts.
+
+    `hashes` maps the ID of each object synchronised to the content hash it was synchronised with,
+    and `etag` is the ETag the API returned for the collection right after. `stale` maps the IDs of
+    objects kept in the database though they're no longer in the cache to the row hash the API
+    last returned them with, so reconciling checksums doesn't fetch them every time.
+
+    While a sync is under way, each batch of objects written is appended to a checkpoint file next
+    to the state. If the sync is interrupted, the checkpoints are applied when the state is next
+    loaded, so the following incremental sync resumes after the last batch written.
+    """
+
+    def __init__(self, path: pathlib.Path) -> None:
+        self.path = path
+        self.checkpoint_path = path.with_name(f'{path.stem}.checkpoint.jsonl')
+
+        self.etag: t.Optional[str] = None
+        self.hashes = Snapshot(entries=array('Q'))
+        self.stale = Snapshot(entries=array('Q'))
+
+        # The hashes of the cache objects being synchronised, and the stale objects seen in the database
+        # meanwhile, recorded once the sync is done
+        self.staged: t.Optional[Snapshot] = None
+        self.staged_stale: t.Optional[Snapshot] = None
+
+    @classmethod
+    def load(cls, path: pathlib.Path) -> 'SyncState':
+        """Load the state from the file at `path`, or return an empty state if it doesn't exist or can't be read."""
+        state = cls(path)
+
+        try:
+            with path.open(encoding='utf-8') as file:
+                data = json.load(file)
+
+            state.etag = data['etag']
+            state.hashes = Snapshot(array('Q', data['ids']), array('Q', data['hashes']))
+            state.stale = Snapshot(array('Q', data.get('stale_ids', ())), array('Q', data.get('stale_hashes', ())))
+
+        except FileNotFoundError:
+            pass
+
+        except (OSError, ValueError, KeyError, TypeError, OverflowError) as err:
+            log.warning(f'Ignoring the unreadable sync state in {path}: {err}')
+
+        state.resume()
+        return state
+
+    def resume(self) -> None:
+        """Apply the checkpoints of an interrupted sync to the hashes."""
+        written = dict()
+        removed = set()
+
+        try:
+            with self.checkpoint_path.open(encoding='utf-8') as file:
+                for line in file:
+                    try:
+                        checkpoint = json.loads(line)
+                    except ValueError:
+                        # The last line may have been cut short by the interruption
+                        break
+
+                    written.update(zip(checkpoint['ids'], checkpoint['hashes']))
+                    written.update(dict.fromkeys(checkpoint['failed'], UNKNOWN))
+                    removed.update(checkpoint['removed'])
+                    removed.difference_update(checkpoint['ids'])
+
+        except FileNotFoundError:
+            return
+
+        except (OSError, KeyError, TypeError) as err:
+            log.warning(f'Ignoring the unreadable sync checkpoints in {self.checkpoint_path}: {err}')
+            return
+
+        done = len(written) + len(removed)
+        log.info(f'Resuming the interrupted sync checkpointed in {self.checkpoint_path} after {done} objects.')
+
+        for id_ in removed:
+            written.pop(id_, None)
+
+        self.hashes = self.hashes.updated(written, removed)
+
+        # The database changed since the ETag was recorded, so it's compared again on the next sync
+        self.etag = None
+
+    def checkpoint(self, ids: t.Iterable[int], failed: t.Iterable[int] = (), removed: t.Iterable[int] = ()) -> None:
+        """
+        Record that the staged objects with `ids` were written, those with `failed` weren't, and those with `removed`
+        were deleted, so the sync resumes after them if it's interrupted.
+        """
+        ids = list(ids)
+        staged = self.staged if self.staged is not None else Snapshot()
+
+        checkpoint = {
+            'ids': ids,
+            'hashes': [staged.get(id_, UNKNOWN) for id_ in ids],
+            'failed': list(failed),
+            'removed': list(removed)
+        }
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        with self.checkpoint_path.open('a', encoding='utf-8') as file:
+            file.write(json.dumps(checkpoint, separators=(',', ':')) + '\n')
+            file.flush()
+            os.fsync(file.fileno())
+
+    def commit(self, etag: t.Optional[str], failed_ids: t.Iterable[int]) -> None:
+        """Record the staged hashes and `etag`, marking the objects with `failed_ids` as unknown."""
+        hashes = self.staged if self.staged is not None else self.hashes
+
+        if failed := dict.fromkeys(failed_ids, UNKNOWN):
+            hashes = hashes.updated(failed)
+
+        self.hashes = hashes
+
+        if self.staged_stale is not None:
+            self.stale = self.staged_stale
+
+        self.etag = etag
+        self.staged = self.staged_stale = None
+
+    def save(self) -> None:
+        """Write the state to its file, replacing it atomically."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        temp_path = self.path.with_name(f'.{self.path.name}.tmp')
+        with temp_path.open('w', encoding='utf-8') as file:
+            data = {
+                'etag': self.etag,
+                'ids': self.hashes.ids.tolist(),
+                'hashes': self.hashes.entries.tolist(),
+                'stale_ids': self.stale.ids.tolist(),
+                'stale_hashes': self.stale.entries.tolist()
+            }
+            json.dump(data, file, separators=(',', ':'))
+
+        temp_path.replace(self.path)
+
+        # The state now includes everything checkpointed
+        self.clear_checkpoints()
+
+    def clear_checkpoints(self) -> None:
+        """Delete the checkpoints of the sync under way."""
+        try:
+            self.checkpoint_path.unlink()
+        except FileNotFoundError:
+            pass
@@ -1,39 +1,572 @@
 from abc import ABC, abstractmethod
+from array import array
 from collections import namedtuple
 import logging
+import math
+import time
 import typing as t
 
+import discord
 from discord.ext.commands import Context
 
-from snek.api import ResponseCodeError
+from snek.api import CircuitOpenError, ResponseCodeError
 from snek.bot import Snek
+from snek.exts.syncer.executor import SyncExecutor
+from snek.exts.syncer.progress import SyncProgress
+from snek.exts.syncer.snapshot import chunked, Snapshot
+from snek.exts.syncer.state import content_hash, STATE_DIR, SyncState, UNKNOWN
+from snek.exts.syncer.syncers.checksum import (
+    Bucket, BucketChecksum, ChecksumTree, FANOUT, LEAF_SIZE, ROOT_BUCKET, row_hash
+)
 
 log = logging.getLogger(__name__)
 
 Diff = namedtuple('Diff', ('created', 'updated', 'deleted'))
 
+# The wall time of computing a diff in seconds: `cache` building and hashing the cache snapshot, `compare`
+# comparing it with the database, and `fetch` the rest, mostly waiting for the API
+DiffTimings = namedtuple('DiffTimings', ('cache', 'fetch', 'compare', 'total'))
+
+# A list of `(item, ResponseCodeError)` pairs for the items the API rejected
+Failures = t.List[t.Tuple[t.Any, ResponseCodeError]]
+
+
+def item_id(item: t.Union[t.Dict, int]) -> int:
+    """Return the ID of an item sent by the bulk methods: an object's payload, or an ID to delete."""
+    return item['id'] if isinstance(item, dict) else item
+
+
+def digest(
+    objects: Snapshot, checksums: bool, stale: t.Optional[Snapshot] = None
+) -> t.Tuple[array, t.Optional[ChecksumTree]]:
+    """
+    Return the content hashes of `objects` in their order, and their checksum tree if `checksums` is True.
+
+    The tree includes the `stale` row hashes of objects kept in the database though not in the cache.
+    """
+    return objects.column(content_hash).entries, ChecksumTree(objects, stale) if checksums else None
+
+
+def compare_page(
+    page: t.List[t.Dict],
+    cache_page: t.List[t.Optional[tuple]],
+    from_api: t.Callable[[t.Dict], tuple],
+    hash_stale: bool,
+    delete_stale: bool
+) -> t.Tuple[t.List[tuple], t.Dict[int, int], t.List[tuple]]:
+    """
+    Compare a `page` of database objects with `cache_page`, the cache objects of the same IDs or None.
+
+    Return the cache objects that differ, the row hashes of the database objects not in the cache
+    if `hash_stale` is True, and those objects if `delete_stale` is True.
+    """
+    updated = []
+    stale = dict()
+    deleted = []
+
+    for data, cache_object in zip(page, cache_page):
+        if cache_object is None:
+            if hash_stale:
+                # Hashed as the API returned it, before `from_api` takes it apart
+                stale[data['id']] = row_hash(data)
+
+            if delete_stale:
+                deleted.append(from_api(data))
+
+            continue
+
+        if cache_object != from_api(data):
+            updated.append(cache_object)
+
+    return updated, stale, deleted
+
+
+def changed_ids(hashes: Snapshot, previous: Snapshot) -> t.Set[int]:
+    """Return the IDs in `hashes` whose hash differs from the one in `previous`, or that aren't in it."""
+    return {id_ for id_, hash_ in hashes.items() if previous.get(id_) != hash_}
+
+
+# The number of IDs filtered on per request when fetching objects by ID
+ID_FILTER_SIZE = 100
+
+# The number of buckets whose checksums are requested at once
+CHECKSUM_REQUEST_SIZE = 1000
+
 
 class ObjectSyncerABC(ABC):
     """Base class for synchronising the database with Discord objects in the cache."""
 
-    def __init__(self, bot: Snek) -> None:
+    def __init__(self, bot: Snek, executor: t.Optional[SyncExecutor] = None) -> None:
         self.bot = bot
+        self.executor = SyncExecutor() if executor is None else executor
+        self.state = SyncState.load(STATE_DIR / f'{self.name}s.json')
+
+        # The progress of the sync under way, if any
+        self.progress: t.Optional[SyncProgress] = None
+
+        # The IDs of the objects created in the database outside of syncs, e.g. by listeners
+        self.created_ids: t.Set[int] = set()
+
+        # The timings of the last diff computed
+        self.diff_timings: t.Optional[DiffTimings] = None
+        self._compare_time = 0.0
+
+        # Whether a dry run is under way, in which case the snapshot mustn't replace state the listeners keep
+        self.dry_running = False
+
+    # Whether objects in the database but not in the cache are included in the diff
+    delete_stale = False
+
+    # The names of the syncers whose writes must be done before this syncer's, when they're run together
+    depends_on: t.Tuple[str, ...] = ()
+
+    # Whether full syncs reconcile checksums of ID ranges with the API, rather than comparing every object;
+    # turned off for the syncer if the API doesn't support it
+    use_checksums = True
+
+    # Whether the collection's ETag is recorded after full syncs; turned off for the syncer once the API
+    # doesn't return one, as the request would otherwise fetch the collection for nothing
+    use_etag = True
 
     @property
     @abstractmethod
     def name(self) -> str:
         """The name of the syncer."""
 
+    @property
     @abstractmethod
-    async def get_diff(self) -> None:
-        """Return the difference between the cache and the database."""
+    def endpoint(self) -> str:
+        """The API endpoint listing the synchronised objects."""
+
+    @abstractmethod
+    async def get_cache_objects(self, guild: t.Optional[discord.Guild] = None) -> Snapshot:
+        """
+        Return a snapshot of the objects in the cache, or only those related to `guild` if it's given.
+
+        The cache is read on the event loop, a chunk at a time between yields to it, e.g. with `snapshot_items`.
+        """
 
+    @staticmethod
     @abstractmethod
-    async def sync_diff(self, diff: Diff) -> None:
-        """Perform the API calls for synchronisation."""
+    def from_api(data: t.Dict) -> tuple:
+        """
+        Convert an object returned by the API to its cache representation.
+
+        It's a static method so it can be sent to the syncer's executor, even to a process pool.
+        """
+
+    def in_database(self, id_: int) -> t.Optional[bool]:
+        """
+        Return whether the object with `id_` is in the database, or None if no sync was recorded to tell.
+
+        The IDs synchronised by the syncs so far are held sorted in the sync state, so this is a binary
+        search rather than a request. Objects whose creation failed in that sync, or which were
+        deleted from the database outside of the bot since, are still considered in it. Objects that
+        were never in the cache while a sync was recorded aren't, even if they're in the database.
+        """
+        if id_ in self.created_ids or id_ in self.state.hashes:
+            return True
+
+        return False if self.state.hashes else None
+
+    async def get_diff(self, incremental: bool = False, guild: t.Optional[discord.Guild] = None) -> Diff:
+        """
+        Return the difference between the cache and the database.
+
+        If `guild` is given, only the objects related to it are compared, e.g. its roles and members.
+
+        If `incremental` is True and the state of a previous sync was recorded, only the objects
+        whose content hash changed since are fetched and compared. If the collection's ETag shows
+        the database hasn't changed either, the hashes alone decide what to create and update.
+        Otherwise, the whole database is compared, by reconciling checksums if the API supports it.
+
+        The cache objects are hashed, and their hashes merged with those recorded, in the syncer's executor.
+        """
+        log.trace(f'Getting the diff for {self.name}s..')
+        started = time.perf_counter()
+        self._compare_time = 0.0
+
+        # The checksum tree is only needed to reconcile the whole database
+        checksums = guild is None and not (incremental and self.state.hashes) and self.use_checksums
+        cache_objects, hashes, tree = await self.snapshot(guild, checksums)
+        cache_time = time.perf_counter() - started
+
+        # The row hashes of the objects kept in the database though not in the cache, if the diff tells them
+        stale = None
+
+        if guild is not None:
+            diff = await self.compare(self.iter_guild_objects(guild, cache_objects.ids), cache_objects)
+
+            # The objects outside the guild keep the state they had
+            removed = [obj.id for obj in diff.deleted or ()]
+            hashes = await self.executor.run(self.state.hashes.updated, hashes, removed)
+
+        elif incremental and self.state.hashes:
+            diff = await self.get_incremental_diff(cache_objects, hashes)
+        elif checksums:
+            diff, stale = await self.get_reconciled_diff(cache_objects, tree)
+        else:
+            stale = None if self.delete_stale else dict()
+            diff = await self.compare(self.bot.api_client.iter_pages(self.endpoint), cache_objects, stale=stale)
+
+        if guild is None and not self.delete_stale:
+            # Objects that left the cache are still in the database, as they aren't deleted from it
+            hashes = await self.executor.run(self.state.hashes.updated, hashes)
+
+        self.state.staged = hashes
+        self.state.staged_stale = None if stale is None else Snapshot.from_items(stale.items(), 'Q')
+
+        total = time.perf_counter() - started
+        self.diff_timings = DiffTimings(cache_time, total - cache_time - self._compare_time, self._compare_time, total)
+
+        return diff
+
+    async def dry_run(
+        self, incremental: bool = False, guild: t.Optional[discord.Guild] = None
+    ) -> t.Tuple[Diff, DiffTimings]:
+        """
+        Return the diff `get_diff` returns and its timings, without recording anything on the syncer.
+
+        A sync may be under way, checkpointing with the hashes it staged, so the state `get_diff`
+        sets is restored afterwards, and the cache snapshot doesn't replace e.g. the user mirror.
+        """
+        state = self.state
+        saved = (state.staged, state.staged_stale, self.diff_timings, self._compare_time, self.use_checksums)
+        self.dry_running = True
+
+        try:
+            diff = await self.get_diff(incremental, guild)
+            return diff, self.diff_timings
+        finally:
+            self.dry_running = False
+            state.staged, state.staged_stale, self.diff_timings, self._compare_time, self.use_checksums = saved
+
+    async def snapshot(
+        self, guild: t.Optional[discord.Guild] = None, checksums: bool = False
+    ) -> t.Tuple[Snapshot, Snapshot, t.Optional[ChecksumTree]]:
+        """
+        Return a snapshot of the cache objects, their content hashes, and their checksum tree if `checksums` is True.
+
+        The cache objects are snapshotted into plain data on the event loop, as the cache is only
+        consistent there: the gateway updates it, and the listeners the syncer's state, on the loop.
+        The snapshot yields to the loop between chunks of objects, and the hashing is done in the
+        syncer's executor.
+        """
+        cache_objects = await self.get_cache_objects(guild)
+        hashes, tree = await self.executor.run(digest, cache_objects, checksums, self.state.stale)
+
+        return cache_objects, Snapshot(cache_objects.ids, hashes), tree
+
+    async def snapshot_items(self, items: t.Iterable[t.Tuple[int, t.Any]]) -> Snapshot:
+        """
+        Return a snapshot of `items`, read from the cache a chunk at a time with `chunked`.
+
+        The items are sorted into the snapshot in the syncer's executor.
+        """
+        collected = []
+
+        async for chunk in chunked(items):
+            collected.extend(chunk)
+
+        return await self.executor.run(Snapshot.from_items, collected)
+
+    async def get_incremental_diff(self, cache_objects: Snapshot, hashes: Snapshot) -> Diff:
+        """Return the difference between the cache and the database for the objects changed since the last sync."""
+        previous = self.state.hashes
+
+        compare_started = time.perf_counter()
+        changed = await self.executor.run(changed_ids, hashes, previous)
+        self._compare_time += time.perf_counter() - compare_started
+        stale = previous.keys() - hashes.keys() if self.delete_stale else set()
+
+        unchanged = False
+        if self.state.etag is not None:
+            response = await self.bot.api_client.get_conditional(self.endpoint, self.state.etag, params={'limit': 1})
+            unchanged = not response.modified
+
+        if unchanged:
+            # The database is as the last sync left it, so only objects in an unknown state are fetched
+            created = {cache_objects[id_] for id_ in changed if id_ not in previous}
+            updated = {cache_objects[id_] for id_ in changed if previous.get(id_)}
+            fetched = {id_ for id_ in changed if previous.get(id_) == UNKNOWN} | stale
+
+        else:
+            created, updated = set(), set()
+            fetched = changed | stale
+
+        log.trace(f'Fetching {len(fetched)} of {len(hashes)} {self.name}s changed since the last sync..')
+        diff = await self.compare(self.iter_objects(fetched), cache_objects, fetched)
+
+        return Diff(
+            diff.created | created,
+            diff.updated | updated,
+            diff.deleted
+        )
+
+    async def get_reconciled_diff(
+        self, cache_objects: Snapshot, tree: ChecksumTree
+    ) -> t.Tuple[Diff, t.Optional[t.Dict[int, int]]]:
+        """
+        Return the difference between the cache and the database by reconciling checksums of ID ranges.
+
+        Only the objects in the buckets whose checksums differ are fetched, so the cost is
+        proportional to how much differs rather than to the size of the collection. If so much
+        differs that fetching every object is cheaper, or the API doesn't support checksums,
+        every object is compared instead.
 
-    async def sync(self, ctx: t.Optional[Context] = None) -> None:
-        """Perform the synchronisation."""
+        `tree` holds the checksums of `cache_objects`, and of the stale objects recorded in the sync
+        state. Unless the syncer deletes them, the row hashes of the stale objects are returned too,
+        updated with those seen in the fetched buckets.
+        """
+        try:
+            leaves = await self.get_differing_buckets(tree)
+
+        except ResponseCodeError as err:
+            if err.status not in (404, 405):
+                raise
+
+            log.info(f'The API doesn\'t support checksums for {self.endpoint}; comparing every {self.name}.')
+            self.use_checksums = False
+            leaves = None
+
+        stale = None if self.delete_stale else dict()
+
+        if leaves is None:
+            diff = await self.compare(self.bot.api_client.iter_pages(self.endpoint), cache_objects, stale=stale)
+            return diff, stale
+
+        ids = {id_ for bucket in leaves for id_ in tree.ids_in(bucket)}
+        log.trace(f'Fetching the {self.name}s in {len(leaves)} ID ranges whose checksums differ..')
+
+        diff = await self.compare(self.iter_buckets(leaves), cache_objects, ids, stale)
+
+        if stale is not None:
+            # The stale objects outside the fetched buckets are as they were, unless they're back in the cache
+            stale.update(
+                (id_, hash_) for id_, hash_ in self.state.stale.items() if id_ not in ids and id_ not in cache_objects
+            )
+
+        return diff, stale
+
+    async def get_differing_buckets(self, tree: ChecksumTree) -> t.Optional[t.List[Bucket]]:
+        """
+        Return the smallest buckets whose checksums differ between `tree` and the API.
+
+        Buckets that differ are split and compared again, until they hold at most `LEAF_SIZE`
+        objects. None is returned once they'd take more requests to fetch than the whole collection.
+        """
+        buckets = tree.split(ROOT_BUCKET)
+        leaves = []
+        pages = None
+
+        while buckets:
+            differing = 0
+            split = []
+            checksums = await self.get_checksums(buckets)
+
+            if pages is None:
+                pages = math.ceil(sum(checksum.count for checksum in checksums) / self.bot.api_client.page_size)
+
+            for bucket, remote in zip(buckets, checksums):
+                if (local := tree.checksum(bucket)) == remote:
+                    continue
+
+                # Splitting a bucket that's empty on either side wouldn't save fetching anything
+                if (
+                    min(local.count, remote.count) == 0
+                    or max(local.count, remote.count) <= LEAF_SIZE
+                    or bucket.hi - bucket.lo <= FANOUT
+                ):
+                    leaves.append(bucket)
+                else:
+                    differing += 1
+                    split.extend(tree.split(bucket))
+
+            # Every differing bucket takes at least a request to fetch
+            if len(leaves) + differing > pages:
+                log.trace(f'Too many {self.name}s differ to fetch them by ID range.')
+                return None
+
+            buckets = split
+
+        return leaves
+
+    async def get_checksums(self, buckets: t.List[Bucket]) -> t.List[BucketChecksum]:
+        """Return the checksums of the database objects in `buckets`, computed by the API."""
+        checksums = []
+
+        for start in range(0, len(buckets), CHECKSUM_REQUEST_SIZE):
+            response = await self.bot.api_client.post(
+                f'{self.endpoint}/checksums',
+                json={'buckets': [[bucket.lo, bucket.hi] for bucket in buckets[start:start + CHECKSUM_REQUEST_SIZE]]}
+            )
+            checksums.extend(BucketChecksum(**checksum) for checksum in response)
+
+        return checksums
+
+    async def iter_buckets(self, buckets: t.List[Bucket]) -> t.AsyncIterator[t.List[t.Dict]]:
+        """
+        Iterate over the objects in the database in `buckets`, one page at a time.
+
+        Adjacent buckets are fetched together, and separate ones concurrently, as each holds few objects.
+        """
+        runs = []
+
+        for bucket in sorted(buckets):
+            if runs and runs[-1].hi == bucket.lo:
+                runs[-1] = Bucket(runs[-1].lo, bucket.hi)
+            else:
+                runs.append(bucket)
+
+        async def fetch(bucket: Bucket) -> t.List[t.List[t.Dict]]:
+            params = {'id__gte': bucket.lo, 'id__lt': bucket.hi}
+            return [page async for page in self.bot.api_client.iter_pages(self.endpoint, params=params)]
+
+        for pages in await self.bot.api_client.map(fetch, runs):
+            for page in pages:
+                yield page
+
+    def iter_guild_objects(self, guild: discord.Guild, ids: t.Collection[int]) -> t.AsyncIterator[t.List[t.Dict]]:
+        """
+        Iterate over the objects in the database related to `guild`, one page at a time.
+
+        `ids` are the IDs of the objects related to it in the cache, which are fetched by default.
+        """
+        return self.iter_objects(ids)
+
+    async def iter_objects(self, ids: t.Collection[int]) -> t.AsyncIterator[t.List[t.Dict]]:
+        """Iterate over the objects in the database with the given `ids`, one page at a time."""
+        ids = sorted(ids)
+
+        for start in range(0, len(ids), ID_FILTER_SIZE):
+            params = {'id__in': ','.join(str(id_) for id_ in ids[start:start + ID_FILTER_SIZE])}
+
+            async for page in self.bot.api_client.iter_pages(self.endpoint, params=params):
+                yield page
+
+    async def compare(
+        self,
+        pages: t.AsyncIterator[t.List[t.Dict]],
+        cache_objects: Snapshot,
+        ids: t.Optional[t.Iterable[int]] = None,
+        stale: t.Optional[t.Dict[int, int]] = None
+    ) -> Diff:
+        """
+        Return the difference between the cache and the database objects in `pages`.
+
+        `ids` limits the cache objects considered created to those that could be in `pages`; by
+        default, they're all considered. The database is compared against the cache one page at
+        a time as it arrives, so only the cache and the diff itself are held in memory. Each page
+        is compared in the syncer's executor, with the cache objects of the same IDs.
+
+        The row hashes of the database objects not in the cache are added to `stale` if it's given.
+        """
+        # Whether each cache object was seen in the database, by position in the snapshot
+        seen = bytearray(len(cache_objects))
+        updated = set()
+        deleted = set()
+
+        async for page in pages:
+            page_started = time.perf_counter()
+
+            # Only the cache objects in the page are sent to the executor, as a process pool pickles them
+            indexes = [cache_objects.index(data['id']) for data in page]
+            cache_page = [cache_objects.entries[index] if index >= 0 else None for index in indexes]
+
+            page_updated, page_stale, page_deleted = await self.executor.run(
+                compare_page, page, cache_page, self.from_api, stale is not None, self.delete_stale
+            )
+
+            for index in indexes:
+                if index >= 0:
+                    seen[index] = True
+
+            updated.update(page_updated)
+            deleted.update(page_deleted)
+            if stale is not None:
+                stale.update(page_stale)
+
+            self._compare_time += time.perf_counter() - page_started
+
+        candidates = range(len(cache_objects)) if ids is None else map(cache_objects.index, ids)
+        created = {cache_objects.entries[index] for index in candidates if index >= 0 and not seen[index]}
+
+        return Diff(created, updated, deleted if self.delete_stale else None)
+
+    @abstractmethod
+    async def sync_diff(self, diff: Diff, guild: t.Optional[discord.Guild] = None) -> Failures:
+        """
+        Perform the API calls for synchronisation and return the items that failed to synchronise.
+
+        `guild` is the guild the diff is limited to, if any.
+        """
+
+    async def checkpoint(self, succeeded: t.List, failed: Failures) -> None:
+        """
+        Record a chunk of objects written by `sync_diff`, so the sync resumes after it if it's interrupted.
+
+        This is the `on_chunk` callback `sync_diff` gives the bulk methods of the API client.
+        """
+        # Creates and updates are sent as payloads, and deletes as IDs
+        written = [item['id'] for item in succeeded if isinstance(item, dict)]
+        removed = [item for item in succeeded if not isinstance(item, dict)]
+
+        try:
+            self.state.checkpoint(written, (item_id(item) for item, _ in failed), removed)
+        except OSError as err:
+            log.warning(f'Could not checkpoint the {self.name} sync to {self.state.checkpoint_path}: {err}')
+
+        if self.progress is not None:
+            await self.progress.advance(len(succeeded) + len(failed))
+
+    async def record_state(self, failed: Failures, scoped: bool = False) -> None:
+        """
+        Record the content hashes of the objects synchronised, and the collection's ETag after the sync.
+
+        After a sync `scoped` to a guild, the ETag recorded by the last full sync is kept, as the
+        database may have changed outside the guild since.
+        """
+        if scoped:
+            # Without the state of a full sync, the rest of the database is unknown
+            if not self.state.hashes:
+                self.state.clear_checkpoints()
+                return
+
+            etag = self.state.etag
+
+        elif self.use_etag:
+            etag = (await self.bot.api_client.get_conditional(self.endpoint, params={'limit': 1})).etag
+
+            if etag is None:
+                log.info(f'The API doesn\'t return ETags for {self.endpoint}; no longer requesting them.')
+                self.use_etag = False
+
+        else:
+            etag = None
+
+        self.state.commit(etag, (item_id(item) for item, _ in failed))
+
+        try:
+            await self.executor.run(self.state.save)
+        except OSError as err:
+            log.warning(f'Could not save the {self.name} sync state to {self.state.path}: {err}')
+
+    async def sync(
+        self,
+        ctx: t.Optional[Context] = None,
+        incremental: bool = False,
+        diff: t.Optional[t.Awaitable[Diff]] = None,
+        guild: t.Optional[discord.Guild] = None
+    ) -> None:
+        """
+        Perform the synchronisation, incrementally from the last one if `incremental` is True.
+
+        If `guild` is given, only the objects related to it are synchronised. `diff` may be given
+        to apply a diff computed ahead of time, e.g. a task computing it; errors raised computing
+        it are reported like errors raised applying it.
+
+        The status message sent to `ctx` is updated with the progress of the writes as they're made.
+        """
         log.info(f'Starting the {self.name} syncer..')
 
         msg = mention = ''
@@ -42,16 +575,37 @@ class ObjectSyncerABC(ABC):
             mention = ctx.author.mention
 
         try:
-            await self.sync_diff(await self.get_diff())
+            if diff is None:
+                diff = self.get_diff(incremental, guild)
+
+            diff = await diff
+            total = sum(len(objects) for objects in diff if objects)
+            self.progress = SyncProgress(self.name, total, msg or None)
+
+            failed = await self.sync_diff(diff, guild)
+            await self.record_state(failed, scoped=guild is not None)
+
         except ResponseCodeError as err:
             log.exception(f'{self.name.capitalize()} syncer failed!')
 
             results = f'Status {err.status}\n```{err.response_json or "See log output for details."}```'
             status = f'❌ {mention} {self.name.capitalize()} synchronisation failed: {results}'
 
+        except CircuitOpenError as err:
+            log.error(f'{self.name.capitalize()} syncer failed: {err}')
+            status = f'❌ {mention} {self.name.capitalize()} synchronisation failed: the Snek API is unavailable.'
+
         else:
-            log.info(f'The {self.name} syncer is finished.')
-            status = f'✅ Synchronisation of {self.name}s is complete.'
+            if failed:
+                log.warning(f'The {self.name} syncer is finished, but {len(failed)} {self.name}(s) failed to sync.')
+                for item, err in failed:
+                    log.debug(f'Failed to sync {self.name} {item}: {err}')
+
+                status = f'⚠️ {mention} Synchronisation of {self.name}s is complete, but {len(failed)} failed.'
+
+            else:
+                log.info(f'The {self.name} syncer is finished; synchronised {self.progress}.')
+                status = f'✅ Synchronisation of {self.name}s is complete.'
 
         if msg:
             await msg.edit(content=status)
@@ -0,0 +1,91 @@
+from array import array
+from bisect import bisect_left
+from collections import namedtuple
+import hashlib
+import heapq
+import json
+import os
+import typing as t
+
+from snek.exts.syncer.snapshot import Snapshot
+
+FANOUT = int(os.environ.get('SNEK_SYNC_CHECKSUM_FANOUT', 16))
+LEAF_SIZE = int(os.environ.get('SNEK_SYNC_CHECKSUM_LEAF_SIZE', 64))
+
+# A half-open range of IDs, `[lo, hi)`
+Bucket = namedtuple('Bucket', ('lo', 'hi'))
+
+# Snowflakes fit in 63 bits, and every bound must fit in a signed 64-bit integer for the JSON codecs
+# and the API's filters, so the root bucket stops at the largest one
+ROOT_BUCKET = Bucket(0, 2 ** 63 - 1)
+
+# The number of objects in a bucket, and the XOR of their row hashes as 16 hex digits
+BucketChecksum = namedtuple('BucketChecksum', ('count', 'checksum'))
+
+
+def row_hash(obj: t.Dict) -> int:
+    """
+    Return the 64-bit hash of an object as the API represents it.
+
+    The hash is the BLAKE2b digest of its canonical JSON, with sorted keys and no whitespace, so
+    the API computes the same hash for the same object.
+    """
+    data = json.dumps(obj, sort_keys=True, separators=(',', ':')).encode()
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'big')
+
+
+class ChecksumTree:
+    """
+    Checksums of the objects in the cache over ranges of their IDs.
+
+    A bucket's checksum is the XOR of the row hashes of the objects in it, so it doesn't depend
+    on their order, and prefix XORs over the sorted IDs make any bucket's checksum O(log n).
+
+    `stale` maps the IDs of objects kept in the database though they left the cache to the row
+    hashes they were last seen with, so their buckets match the database's as long as they're kept.
+    """
+
+    def __init__(self, objects: Snapshot, stale: t.Optional[Snapshot] = None) -> None:
+        # The objects are namedtuples with the fields of their API representation
+        rows = ((id_, row_hash(obj._asdict())) for id_, obj in objects.items())
+
+        if stale:
+            rows = list(heapq.merge(rows, ((id_, hash_) for id_, hash_ in stale.items() if id_ not in objects)))
+            self.ids = array('Q', (id_ for id_, _ in rows))
+        else:
+            self.ids = objects.ids
+
+        self._prefix = array('Q', (0,))
+        for _, hash_ in rows:
+            self._prefix.append(self._prefix[-1] ^ hash_)
+
+    def span(self, bucket: Bucket) -> t.Tuple[int, int]:
+        """Return the start and end index in `ids` of the objects in `bucket`."""
+        return bisect_left(self.ids, bucket.lo), bisect_left(self.ids, bucket.hi)
+
+    def ids_in(self, bucket: Bucket) -> t.Sequence[int]:
+        """Return the IDs of the objects in `bucket`."""
+        start, end = self.span(bucket)
+        return self.ids[start:end]
+
+    def checksum(self, bucket: Bucket) -> BucketChecksum:
+        """Return the checksum of `bucket`."""
+        start, end = self.span(bucket)
+        return BucketChecksum(end - start, f'{self._prefix[end] ^ self._prefix[start]:016x}')
+
+    def split(self, bucket: Bucket, fanout: int = FANOUT) -> t.List[Bucket]:
+        """
+        Split `bucket` into up to `fanout` buckets.
+
+        The bounds are picked so the buckets hold about as many objects each, as IDs are far from
+        evenly spread. A bucket with fewer objects than `fanout` is split into equal ranges instead.
+        """
+        start, end = self.span(bucket)
+
+        if end - start >= fanout:
+            bounds = (self.ids[start + (end - start) * i // fanout] for i in range(1, fanout))
+        else:
+            bounds = (bucket.lo + (bucket.hi - bucket.lo) * i // fanout for i in range(1, fanout))
+
+        edges = sorted({bucket.lo, *bounds, bucket.hi})
+        return [Bucket(lo, hi) for lo, hi in zip(edges, edges[1:])]
@@ -1,7 +1,11 @@
 from collections import namedtuple
 import logging
+import typing as t
 
-from snek.exts.syncer.syncers.base import Diff, ObjectSyncerABC
+import discord
+
+from snek.exts.syncer.snapshot import Interner, Snapshot
+from snek.exts.syncer.syncers.base import Diff, Failures, ObjectSyncerABC
 
 log = logging.getLogger(__name__)
 
@@ -11,43 +15,49 @@ Guild = namedtuple('Guild', ('id', 'name', 'created_at', 'icon_url'))
 class GuildSyncer(ObjectSyncerABC):
     """Synchronise the database with guilds in the cache."""
     name = 'guild'
+    endpoint = 'guilds'
 
-    async def get_diff(self) -> Diff:
-        """Return the difference between the cache of guilds and the database."""
-        log.trace('Getting the diff for guilds..')
-        guilds = await self.bot.api_client.get('guilds')
+    async def get_cache_objects(self, guild: t.Optional[discord.Guild] = None) -> Snapshot:
+        """Return a snapshot of the guilds in the cache, or only of `guild` if it's given."""
+        guilds = self.bot.guilds if guild is None else (guild,)
+        intern = Interner()
 
-        db_guilds = {Guild(**guild) for guild in guilds}
-        cache_guilds = {
-            Guild(
+        return await self.snapshot_items(
+            (guild.id, Guild(
                 id=guild.id,
                 name=guild.name,
                 created_at=str(guild.created_at),
-                icon_url=str(guild.icon_url)
-            )
-            for guild in self.bot.guilds
-        }
-
-        db_guild_ids = {guild.id for guild in db_guilds}
-        cache_guild_ids = {guild.id for guild in cache_guilds}
-
-        new_guild_ids = cache_guild_ids - db_guild_ids
+                icon_url=intern(str(guild.icon_url))
+            ))
+            for guild in guilds
+        )
 
-        guilds_to_create = {guild for guild in cache_guilds if guild.id in new_guild_ids}
-        guilds_to_update = cache_guilds - db_guilds - guilds_to_create
+    @staticmethod
+    def from_api(data: t.Dict) -> Guild:
+        """Convert a guild returned by the API to a `Guild`."""
+        return Guild(**data)
 
-        return Diff(guilds_to_create, guilds_to_update, None)
-
-    async def sync_diff(self, diff: Diff) -> None:
+    async def sync_diff(self, diff: Diff, guild: t.Optional[discord.Guild] = None) -> Failures:
         """Synchronise the database with the guilds in the cache."""
         log.trace('Syncing created guilds..')
-        for guild in diff.created:
-            await self.bot.api_client.post('guilds', json=guild._asdict())
+        created = await self.bot.api_client.post_many(
+            'guilds', [guild._asdict() for guild in diff.created], on_chunk=self.checkpoint
+        )
 
         log.trace('Syncing updated guilds..')
-        for guild in diff.updated:
-            await self.bot.api_client.put(f'guilds/{guild.id}', json=guild._asdict())
-
-        log.trace('Syncing all guild configs..')
-        configs = await self.bot.api_client.get('guild_configs')
-        self.bot.configs = {config['guild']: config for config in configs}
+        updated = await self.bot.api_client.put_many(
+            'guilds', [guild._asdict() for guild in diff.updated], on_chunk=self.checkpoint
+        )
+
+        if guild is None or self.bot.configs is None:
+            log.trace('Syncing all guild configs..')
+            configs = await self.bot.api_client.get('guild_configs')
+            self.bot.configs = {config['guild']: config for config in configs}
+            self.bot.prefix_cache.invalidate()
+
+        else:
+            log.trace(f'Syncing the config of guild {guild.id}..')
+            self.bot.configs[guild.id] = await self.bot.api_client.get(f'guild_configs/{guild.id}')
+            self.bot.prefix_cache.invalidate(guild.id)
+
+        return created.failed + updated.failed
@@ -1,7 +1,11 @@
 from collections import namedtuple
 import logging
+import typing as t
 
-from snek.exts.syncer.syncers.base import Diff, ObjectSyncerABC
+import discord
+
+from snek.exts.syncer.snapshot import Interner, Snapshot
+from snek.exts.syncer.syncers.base import Diff, Failures, ObjectSyncerABC
 
 log = logging.getLogger(__name__)
 
@@ -11,49 +15,63 @@ Role = namedtuple('Role', ('id', 'name', 'color', 'created_at', 'permissions', '
 class RoleSyncer(ObjectSyncerABC):
     """Synchronise the database with roles in the cache."""
     name = 'role'
+    endpoint = 'roles'
+    depends_on = ('guild',)
+    delete_stale = True
+
+    async def get_cache_objects(self, guild: t.Optional[discord.Guild] = None) -> Snapshot:
+        """Return a snapshot of the roles in the cache, or only of those of `guild` if it's given."""
+        guilds = self.bot.guilds if guild is None else (guild,)
 
-    async def get_diff(self) -> Diff:
-        """Return the difference between the cache of roles and the database."""
-        log.trace('Getting the diff for roles..')
-        roles = await self.bot.api_client.get('roles')
+        # Names, colours and permissions are mostly shared by roles in different guilds
+        intern = Interner()
 
-        db_roles = {Role(**role) for role in roles}
-        cache_roles = {
-            Role(
+        return await self.snapshot_items(
+            (role.id, Role(
                 id=role.id,
-                name=role.name,
-                color=role.color.value,
+                name=intern(role.name),
+                color=intern(role.color.value),
                 created_at=str(role.created_at),
-                permissions=role.permissions.value,
+                permissions=intern(role.permissions.value),
                 position=role.position,
                 guild=guild.id
-            )
-            for guild in self.bot.guilds
+            ))
+            for guild in guilds
             for role in guild.roles
-        }
+        )
 
-        db_role_ids = {role.id for role in db_roles}
-        cache_role_ids = {role.id for role in cache_roles}
+    @staticmethod
+    def from_api(data: t.Dict) -> Role:
+        """Convert a role returned by the API to a `Role`."""
+        return Role(**data)
 
-        new_role_ids = cache_role_ids - db_role_ids
-        deleted_role_ids = db_role_ids - cache_role_ids
+    async def iter_guild_objects(
+        self, guild: discord.Guild, ids: t.Collection[int]
+    ) -> t.AsyncIterator[t.List[t.Dict]]:
+        """
+        Iterate over the roles of `guild` in the database, including those no longer in the cache.
 
-        roles_to_create = {role for role in cache_roles if role.id in new_role_ids}
-        roles_to_update = cache_roles - db_roles - roles_to_create
-        roles_to_delete = {role for role in db_roles if role.id in deleted_role_ids}
+        The roles of other guilds are skipped even if the API ignores the filter, as the roles
+        returned that aren't in the cache are deleted.
+        """
+        async for page in self.bot.api_client.iter_pages(self.endpoint, params={'guild': guild.id}):
+            yield [data for data in page if data['guild'] == guild.id]
 
-        return Diff(roles_to_create, roles_to_update, roles_to_delete)
-
-    async def sync_diff(self, diff: Diff) -> None:
+    async def sync_diff(self, diff: Diff, guild: t.Optional[discord.Guild] = None) -> Failures:
         """Synchronise the database with the roles in the cache."""
         log.trace('Syncing created roles..')
-        for role in diff.created:
-            await self.bot.api_client.post('roles', json=role._asdict())
+        created = await self.bot.api_client.post_many(
+            'roles', [role._asdict() for role in diff.created], on_chunk=self.checkpoint
+        )
 
         log.trace('Syncing updated roles..')
-        for role in diff.updated:
-            await self.bot.api_client.put(f'roles/{role.id}', json=role._asdict())
+        updated = await self.bot.api_client.put_many(
+            'roles', [role._asdict() for role in diff.updated], on_chunk=self.checkpoint
+        )
 
         log.trace('Syncing deleted roles..')
-        for role in diff.deleted:
-            await self.bot.api_client.delete(f'roles/{role.id}')
+        deleted = await self.bot.api_client.delete_many(
+            'roles', [role.id for role in diff.deleted], on_chunk=self.checkpoint
+        )
+
+        return created.failed + updated.failed + deleted.failed
@@ -1,70 +1,135 @@
 from collections import namedtuple
 import logging
+import typing as t
 
-from snek.exts.syncer.syncers.base import Diff, ObjectSyncerABC
+import discord
+
+from snek.exts.syncer.index import MembershipIndex, MembershipMirror
+from snek.exts.syncer.snapshot import chunked, Interner, Snapshot
+from snek.exts.syncer.syncers.base import Diff, Failures, ObjectSyncerABC
 
 log = logging.getLogger(__name__)
 
 User = namedtuple('User', ('id', 'name', 'discriminator', 'created_at', 'avatar_url', 'roles', 'guilds'))
 
 
+def user_from_index(user_id: int, index: MembershipIndex, intern: t.Optional[Interner] = None) -> User:
+    """
+    Return the `User` with the ID `user_id`, with the guilds and roles recorded in `index`.
+
+    Repeated values, such as the role and guild IDs of users with the same memberships, are shared
+    between the users built with the same `intern`.
+    """
+    member = index.members[user_id]
+    intern = Interner() if intern is None else intern
+
+    return User(
+        id=member.id,
+        name=intern(member.name),
+        discriminator=intern(member.discriminator),
+        created_at=str(member.created_at),
+        avatar_url=str(member.avatar_url),
+        roles=intern(index.roles(user_id)),
+        guilds=intern(index.guilds(user_id))
+    )
+
+
+def user_from_member(member: discord.Member, mirror: MembershipMirror) -> User:
+    """Return the `User` of `member`, with the guilds and roles of all their memberships recorded in `mirror`."""
+    return User(
+        id=member.id,
+        name=member.name,
+        discriminator=member.discriminator,
+        created_at=str(member.created_at),
+        avatar_url=str(member.avatar_url),
+        roles=mirror.roles(member.id),
+        guilds=mirror.guilds(member.id)
+    )
+
+
 class UserSyncer(ObjectSyncerABC):
     """Synchronise the database with users in the cache."""
     name = 'user'
+    endpoint = 'users'
+    depends_on = ('guild',)
+
+    # Every cached user's guilds and roles as of the last full snapshot, which the `Syncer` listeners
+    # keep up to date as a mirror of the memberships in the database
+    membership: t.Optional[MembershipMirror] = None
+
+    # The changes the listeners made to the mirror while a full snapshot is built, as pairs of the
+    # name of the `MembershipMirror` method and its arguments; replayed onto the snapshot's mirror
+    membership_changes: t.Optional[t.List[t.Tuple[str, tuple]]] = None
+
+    async def get_cache_objects(self, guild: t.Optional[discord.Guild] = None) -> Snapshot:
+        """
+        Return a snapshot of the users in the cache, or only of the members of `guild` if it's given.
+
+        Either way, a user's guilds and roles are those of all their memberships.
+
+        The members are indexed, and the users built, a chunk at a time between yields to the event
+        loop, so the gateway and the listeners keep running meanwhile. A full snapshot then replaces
+        the membership mirror, with the changes the listeners made in the meantime replayed onto it,
+        as the guilds they changed may have been indexed before them.
+        """
+        user_ids = None if guild is None else {member.id for member in guild.members}
+        replace_mirror = guild is None and not self.dry_running
 
-    async def get_diff(self) -> Diff:
-        """Return the difference between the cache of users and the database."""
-        log.trace('Getting diff for users..')
-        users = await self.bot.api_client.get('users')
-
-        db_users = {
-            User(
-                guilds=tuple(user.pop('guilds')),
-                roles=tuple(user.pop('roles')),
-                **user
-            )
-            for user in users
-        }
-        db_user_ids = {user.id for user in db_users}
-
-        cache_users_dict = dict()
-        for guild in self.bot.guilds:
-            for user in guild.members:
-                if user.id in cache_users_dict.keys():
-                    user_dict = cache_users_dict[user.id]._asdict()
-                    roles = user_dict.pop('roles') + tuple(role.id for role in user.roles)
-                    cache_users_dict[user.id] = User(
-                        roles=tuple(sorted(roles)),
-                        **user_dict
-                    )
-
-                else:
-                    cache_users_dict[user.id] = User(
-                        id=user.id,
-                        name=user.name,
-                        discriminator=user.discriminator,
-                        created_at=str(user.created_at),
-                        avatar_url=str(user.avatar_url),
-                        roles=tuple(sorted(role.id for role in user.roles)),
-                        guilds=tuple(g.id for g in self.bot.guilds if g.get_member(user.id) is not None)
-                    )
-
-        cache_users = set(cache_users_dict.values())
-        cache_user_ids = set(cache_users_dict.keys())
-
-        new_user_ids = cache_user_ids - db_user_ids
-
-        users_to_create = {user for user in cache_users if user.id in new_user_ids}
-        users_to_update = cache_users - db_users - users_to_create
-
-        return Diff(users_to_create, users_to_update, None)
-
-    async def sync_diff(self, diff: Diff) -> None:
+        if replace_mirror:
+            self.membership_changes = []
+
+        try:
+            index = MembershipIndex()
+
+            async for members in chunked(MembershipIndex.iter_members(self.bot.guilds, user_ids)):
+                for member in members:
+                    if member is not None:
+                        index.add(member)
+
+            # The mirror shares the interned tuples of the snapshot, and doesn't hold on to the members
+            intern = Interner()
+            mirror = MembershipMirror() if replace_mirror else None
+            users = []
+
+            async for chunk in chunked(index.members):
+                for user_id in chunk:
+                    user = user_from_index(user_id, index, intern)
+                    users.append((user_id, user))
+
+                    if mirror is not None:
+                        mirror.set(user_id, user.guilds, user.roles)
+
+            if replace_mirror:
+                for change, args in self.membership_changes:
+                    getattr(mirror, change)(*args)
+
+                self.membership = mirror
+
+        finally:
+            if replace_mirror:
+                self.membership_changes = None
+
+        return await self.executor.run(Snapshot.from_items, users)
+
+    @staticmethod
+    def from_api(data: t.Dict) -> User:
+        """Convert a user returned by the API to a `User`."""
+        return User(
+            guilds=tuple(data.pop('guilds')),
+            roles=tuple(data.pop('roles')),
+            **data
+        )
+
+    async def sync_diff(self, diff: Diff, guild: t.Optional[discord.Guild] = None) -> Failures:
         """Synchronise the database with the users in the cache."""
         log.trace('Syncing created users..')
-        for user in diff.created:
-            await self.bot.api_client.post('users', json=user._asdict())
+        created = await self.bot.api_client.post_many(
+            'users', [user._asdict() for user in diff.created], on_chunk=self.checkpoint
+        )
 
         log.trace('Syncing updated users..')
-        for user in diff.updated:
-            await self.bot.api_client.put(f'users/{user.id}', json=user._asdict())
+        updated = await self.bot.api_client.put_many(
+            'users', [user._asdict() for user in diff.updated], on_chunk=self.checkpoint
+        )
+
+        return created.failed + updated.failed
@@ -1,3 +1,8 @@
+from snek.utils.events import EventMetrics
+from snek.utils.metrics import Histogram, LoopLagMonitor
 from snek.utils.paginator import LinePaginator, PaginatedEmbed
+from snek.utils.prefixes import DEFAULT_PREFIX, PrefixCache
 
-__all__ = ('LinePaginator', 'PaginatedEmbed')
+__all__ = (
+    'DEFAULT_PREFIX', 'EventMetrics', 'Histogram', 'LinePaginator', 'LoopLagMonitor', 'PaginatedEmbed', 'PrefixCache'
+)
@@ -0,0 +1,124 @@
+from collections import Counter
+import functools
+import time
+import typing as t
+
+from snek.utils.metrics import format_labels, Histogram, metric_family
+
+
+class HandlerStats:
+    """Invocation statistics for one event handler."""
+
+    __slots__ = ('count', 'errors', 'in_flight', 'latency')
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.latency = Histogram()
+
+
+class EventMetrics:
+    """
+    Records the gateway events dispatched to the bot, and how their handlers fare, per event and handler.
+
+    Handlers are wrapped by `instrument`, which `Snek` does for every listener added to it. A handler
+    marked with an `__instrumented__` attribute records itself, e.g. once it actually runs rather
+    than when it's queued.
+    """
+
+    def __init__(self) -> None:
+        self.dispatched = Counter()
+        self.handlers: t.Dict[t.Tuple[str, str], HandlerStats] = dict()
+
+        self._wrappers: t.Dict[t.Tuple[str, t.Callable], t.Callable] = dict()
+
+    def instrument(self, event: str, func: t.Callable[..., t.Awaitable]) -> t.Callable[..., t.Awaitable]:
+        """Return `func` wrapped to record its calls as handling `event`."""
+        if getattr(func, '__instrumented__', False):
+            return func
+
+        if (wrapper := self._wrappers.get((event, func))) is not None:
+            return wrapper
+
+        key = (event, func.__qualname__)
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs) -> None:
+            if (stats := self.handlers.get(key)) is None:
+                stats = self.handlers[key] = HandlerStats()
+
+            stats.count += 1
+            stats.in_flight += 1
+            started = time.perf_counter()
+
+            try:
+                await func(*args, **kwargs)
+            except Exception:
+                stats.errors += 1
+                raise
+            finally:
+                stats.in_flight -= 1
+                stats.latency.observe(time.perf_counter() - started)
+
+        self._wrappers[(event, func)] = wrapper
+        return wrapper
+
+    def uninstrument(self, event: str, func: t.Callable) -> t.Callable:
+        """Forget the wrapper `instrument` returned for `func` and return it, or `func` if there's none."""
+        return self._wrappers.pop((event, func), func)
+
+    def slowest(self, count: int) -> t.List[t.Tuple[t.Tuple[str, str], HandlerStats]]:
+        """Return the `count` handlers with the highest 95th percentile latency, slowest first."""
+        return sorted(
+            self.handlers.items(), key=lambda item: (item[1].latency.percentile(95), item[1].latency.max), reverse=True
+        )[:count]
+
+    def reset(self) -> None:
+        """Forget every recorded event and call."""
+        self.dispatched.clear()
+        self.handlers.clear()
+
+    def prometheus(self) -> t.List[str]:
+        """Return the recorded metrics in the Prometheus text exposition format."""
+        handlers = sorted(self.handlers.items())
+        labels = {key: {'event': key[0], 'handler': key[1]} for key, _ in handlers}
+
+        return [
+            *metric_family(
+                'snek_events_dispatched_total', 'counter', 'Gateway events dispatched to the bot.',
+                (
+                    f'snek_events_dispatched_total{format_labels({"event": event})} {count}'
+                    for event, count in sorted(self.dispatched.items())
+                )
+            ),
+            *metric_family(
+                'snek_event_handler_calls_total', 'counter', 'Event handler calls.',
+                (
+                    f'snek_event_handler_calls_total{format_labels(labels[key])} {stats.count}'
+                    for key, stats in handlers
+                )
+            ),
+            *metric_family(
+                'snek_event_handler_errors_total', 'counter', 'Event handler calls that raised.',
+                (
+                    f'snek_event_handler_errors_total{format_labels(labels[key])} {stats.errors}'
+                    for key, stats in handlers
+                )
+            ),
+            *metric_family(
+                'snek_event_handler_in_flight', 'gauge', 'Event handler calls still running.',
+                (
+                    f'snek_event_handler_in_flight{format_labels(labels[key])} {stats.in_flight}'
+                    for key, stats in handlers
+                )
+            ),
+            *metric_family(
+                'snek_event_handler_duration_seconds', 'histogram', 'Event handler latency.',
+                (
+                    sample
+                    for key, stats in handlers
+                    for sample in stats.latency.prometheus_samples('snek_event_handler_duration_seconds', labels[key])
+                )
+            )
+        ]
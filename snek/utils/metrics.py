@@ -0,0 +1,129 @@
+import asyncio
+import bisect
+import typing as t
+
+# Upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value: t.Any) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels: t.Dict[str, t.Any]) -> str:
+    """Format `labels` for the Prometheus text exposition format."""
+    if not labels:
+        return ''
+
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+
+def metric_family(name: str, metric_type: str, description: str, samples: t.Iterable[str]) -> t.List[str]:
+    """Return the lines of a Prometheus metric family, with its `HELP` and `TYPE` headers."""
+    return [f'# HELP {name} {description}', f'# TYPE {name} {metric_type}', *samples]
+
+
+class Histogram:
+    """
+    A histogram with fixed bucket boundaries, in the style of Prometheus.
+
+    Percentiles are estimated by interpolating linearly within the bucket they fall into.
+    """
+
+    __slots__ = ('bounds', 'counts', 'count', 'sum', 'max')
+
+    def __init__(self, bounds: t.Sequence[float] = LATENCY_BUCKETS) -> None:
+        self.bounds = tuple(bounds)
+
+        # The last bucket counts everything above the largest bound
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        """Record a value."""
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    @property
+    def mean(self) -> float:
+        """The mean of the recorded values."""
+        return self.sum / self.count if self.count else 0.0
+
+    def percentile(self, percentile: float) -> float:
+        """Estimate the value below which `percentile` percent of the recorded values fall."""
+        if not self.count:
+            return 0.0
+
+        rank = self.count * percentile / 100
+        cumulative = 0
+
+        for index, count in enumerate(self.counts):
+            if count and cumulative + count >= rank:
+                lower = self.bounds[index - 1] if index else 0.0
+                upper = self.bounds[index] if index < len(self.bounds) else self.max
+
+                return min(self.max, lower + (upper - lower) * (rank - cumulative) / count)
+
+            cumulative += count
+
+        return self.max
+
+    def prometheus_samples(self, name: str, labels: t.Dict[str, t.Any]) -> t.List[str]:
+        """Return the `_bucket`, `_sum` and `_count` samples of the histogram with `labels`."""
+        samples = list()
+        cumulative = 0
+
+        for bound, count in zip((*self.bounds, '+Inf'), self.counts):
+            cumulative += count
+            samples.append(f'{name}_bucket{format_labels({**labels, "le": bound})} {cumulative}')
+
+        samples.append(f'{name}_sum{format_labels(labels)} {self.sum}')
+        samples.append(f'{name}_count{format_labels(labels)} {self.count}')
+
+        return samples
+
+
+class LoopLagMonitor:
+    """
+    Measures how late the event loop runs its callbacks, and so how long it's blocked.
+
+    While it runs, the monitor repeatedly sleeps for `interval` seconds, and records how much longer
+    than that the sleep took in the `lag` histogram. It's an async context manager running for the
+    duration of its block.
+    """
+
+    def __init__(self, interval: float = 0.05) -> None:
+        self.interval = interval
+        self.lag = Histogram()
+
+        self._task: t.Optional[asyncio.Task] = None
+
+    async def _sample(self) -> None:
+        loop = asyncio.get_running_loop()
+
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self.lag.observe(max(0.0, loop.time() - started - self.interval))
+
+    def start(self) -> None:
+        """Start measuring the lag."""
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._sample())
+
+    def stop(self) -> None:
+        """Stop measuring the lag."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def __aenter__(self) -> 'LoopLagMonitor':
+        self.start()
+        return self
+
+    async def __aexit__(self, *_) -> None:
+        self.stop()
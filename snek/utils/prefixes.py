@@ -0,0 +1,63 @@
+import typing as t
+
+import discord
+from discord.ext.commands import Bot
+
+# The command prefix of guilds that didn't set their own, and of DMs
+DEFAULT_PREFIX = '!'
+
+
+class PrefixCache:
+    """
+    The prefixes that invoke the bot's commands in each guild, built once rather than per message.
+
+    Guilds using the default prefix all share a single tuple. The prefixes of a guild must be
+    invalidated when its `command_prefix` config changes.
+    """
+
+    def __init__(self, bot: Bot, default: str = DEFAULT_PREFIX) -> None:
+        self.bot = bot
+        self.default = default
+
+        self._guilds: t.Dict[int, t.Tuple[str, ...]] = dict()
+        self._default: t.Optional[t.Tuple[str, ...]] = None
+
+    def _build(self, prefix: str) -> t.Tuple[str, ...]:
+        # The same prefixes `when_mentioned_or` returns
+        user_id = self.bot.user.id
+        return f'<@{user_id}> ', f'<@!{user_id}> ', prefix
+
+    @property
+    def default_prefixes(self) -> t.Tuple[str, ...]:
+        """The prefixes used in DMs and in guilds without a config."""
+        if self._default is None:
+            self._default = self._build(self.default)
+
+        return self._default
+
+    def get(self, message: discord.Message) -> t.Tuple[str, ...]:
+        """Return the prefixes that may invoke a command in the guild `message` was sent in."""
+        if message.guild is None:
+            return self.default_prefixes
+
+        if (prefixes := self._guilds.get(message.guild.id)) is not None:
+            return prefixes
+
+        if self.bot.configs is None or (config := self.bot.configs.get(message.guild.id)) is None:
+            # Not cached, since the config may be synchronised later
+            return self.default_prefixes
+
+        if (prefix := config['command_prefix']) == self.default:
+            prefixes = self.default_prefixes
+        else:
+            prefixes = self._build(prefix)
+
+        self._guilds[message.guild.id] = prefixes
+        return prefixes
+
+    def invalidate(self, guild_id: t.Optional[int] = None) -> None:
+        """Forget the prefixes of the guild with `guild_id`, or of every guild if it's None."""
+        if guild_id is None:
+            self._guilds.clear()
+        else:
+            self._guilds.pop(guild_id, None)
@@ -0,0 +1,136 @@
+import asyncio
+from bisect import bisect_left
+import copy
+import pathlib
+import random
+import tempfile
+import types
+import typing as t
+import unittest
+
+from benchmarks.dataset import make_guilds, snowflake
+from snek.exts.syncer.executor import SyncExecutor
+from snek.exts.syncer.state import SyncState
+from snek.exts.syncer.syncers import UserSyncer
+from snek.exts.syncer.syncers.checksum import row_hash
+
+
+class FakeAPIClient:
+    """An API client serving one collection from memory, counting the objects it returns."""
+
+    page_size = 100
+
+    def __init__(self, rows: t.Dict[int, t.Dict]) -> None:
+        self.rows = rows
+        self.fetched = 0
+
+    def _ids(self, lo: int, hi: int) -> t.List[int]:
+        ids = sorted(self.rows)
+        return ids[bisect_left(ids, lo):bisect_left(ids, hi)]
+
+    async def post(self, endpoint: str, json: t.Dict) -> t.List[t.Dict]:
+        checksums = []
+
+        for lo, hi in json['buckets']:
+            ids = self._ids(lo, hi)
+            checksum = 0
+            for id_ in ids:
+                checksum ^= row_hash(self.rows[id_])
+
+            checksums.append({'count': len(ids), 'checksum': f'{checksum:016x}'})
+
+        return checksums
+
+    async def iter_pages(self, endpoint: str, params: t.Optional[t.Dict] = None) -> t.AsyncIterator[t.List[t.Dict]]:
+        params = params or {}
+
+        if 'id__in' in params:
+            ids = [id_ for id_ in map(int, params['id__in'].split(',')) if id_ in self.rows]
+        else:
+            ids = self._ids(params.get('id__gte', 0), params.get('id__lt', 2 ** 63))
+
+        for start in range(0, len(ids), self.page_size):
+            page = [copy.deepcopy(self.rows[id_]) for id_ in ids[start:start + self.page_size]]
+            self.fetched += len(page)
+            yield page
+
+    async def map(self, func: t.Callable, items: t.Iterable) -> t.List:
+        return await asyncio.gather(*map(func, items))
+
+
+class ReconcileStaleRowsTests(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        rng = random.Random(1)
+        guilds = make_guilds(10, 3000)
+
+        self.api_client = FakeAPIClient({})
+        bot = types.SimpleNamespace(api_client=self.api_client, guilds=guilds)
+
+        self.syncer = UserSyncer(bot, SyncExecutor('loop'))
+        self.directory = tempfile.TemporaryDirectory()
+        self.syncer.state = SyncState(pathlib.Path(self.directory.name) / 'users.json')
+
+        # The database holds every cached user, and users who left, which the syncer doesn't delete
+        self.write((await self.syncer.get_cache_objects()).values())
+
+        for _ in range(500):
+            id_ = snowflake(rng)
+            self.api_client.rows[id_] = {
+                'id': id_, 'name': 'gone', 'discriminator': '0000', 'created_at': '2015-01-01 00:00:00',
+                'avatar_url': '', 'roles': [], 'guilds': []
+            }
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, users):
+        for user in users:
+            self.api_client.rows[user.id] = {**user._asdict(), 'guilds': list(user.guilds), 'roles': list(user.roles)}
+
+    async def sync(self):
+        diff = await self.syncer.get_diff()
+        self.write(diff.created | diff.updated)
+        self.syncer.state.commit(None, ())
+        return diff
+
+    async def test_converges_without_fetching_every_page(self):
+        diff = await self.sync()
+        self.assertEqual((diff.created, diff.updated), (set(), set()))
+
+        changed = random.Random(1).sample(sorted(id_ for id_, row in self.api_client.rows.items() if row['guilds']), 5)
+        for id_ in changed:
+            self.api_client.rows[id_]['name'] = 'changed'
+
+        self.api_client.fetched = 0
+        diff = await self.sync()
+
+        self.assertEqual({user.id for user in diff.updated}, set(changed))
+        self.assertLess(self.api_client.fetched, len(self.api_client.rows) // 10)
+
+        self.api_client.fetched = 0
+        diff = await self.sync()
+
+        self.assertEqual((diff.created, diff.updated), (set(), set()))
+        self.assertEqual(self.api_client.fetched, 0)
+
+    async def test_stale_rows_changed_in_the_database(self):
+        await self.sync()
+
+        departed = [id_ for id_, row in self.api_client.rows.items() if not row['guilds']][:3]
+        for id_ in departed:
+            self.api_client.rows[id_]['name'] = 'renamed'
+
+        self.api_client.fetched = 0
+        diff = await self.sync()
+
+        self.assertEqual((diff.created, diff.updated), (set(), set()))
+        self.assertLess(self.api_client.fetched, len(self.api_client.rows) // 10)
+
+        # The new row hashes are recorded, so the buckets match again
+        self.api_client.fetched = 0
+        await self.sync()
+        self.assertEqual(self.api_client.fetched, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
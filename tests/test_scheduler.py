@@ -0,0 +1,62 @@
+import asyncio
+import unittest
+
+from snek.exts.syncer.scheduler import SyncScheduler
+from snek.exts.syncer.syncers.base import Diff, DiffTimings
+
+
+class FakeSyncer:
+    """A syncer whose diffs and writes take a while, recording when each starts and ends."""
+
+    def __init__(self, name: str, events: list, depends_on: tuple = ()) -> None:
+        self.name = name
+        self.depends_on = depends_on
+        self.events = events
+
+    async def get_diff(self, incremental: bool = False, guild=None) -> Diff:
+        self.events.append(('diff', self.name))
+        await asyncio.sleep(0.01)
+        return Diff(set(), set(), None)
+
+    async def sync(self, ctx=None, incremental: bool = False, diff=None, guild=None) -> None:
+        await diff
+        await asyncio.sleep(0.01)
+        self.events.append(('written', self.name))
+
+    async def dry_run(self, incremental: bool = False, guild=None):
+        diff = await self.get_diff(incremental, guild)
+        self.events.append(('dry run', self.name))
+        return diff, DiffTimings(0, 0, 0, 0)
+
+
+class SyncSchedulerTests(unittest.IsolatedAsyncioTestCase):
+    async def test_syncs_run_one_at_a_time(self):
+        events = []
+        guilds = FakeSyncer('guild', events)
+        users = FakeSyncer('user', events, depends_on=('guild',))
+        scheduler = SyncScheduler((guilds, users))
+
+        await asyncio.gather(
+            scheduler.sync(),
+            scheduler.sync(syncers=(users,)),
+            scheduler.dry_run()
+        )
+
+        self.assertEqual(events, [
+            ('diff', 'guild'), ('diff', 'user'), ('written', 'guild'), ('written', 'user'),
+            ('diff', 'user'), ('written', 'user'),
+            ('diff', 'guild'), ('dry run', 'guild'), ('diff', 'user'), ('dry run', 'user')
+        ])
+
+    async def test_sync_of_some_syncers(self):
+        events = []
+        scheduler = SyncScheduler((FakeSyncer('guild', events), FakeSyncer('user', events, depends_on=('guild',))))
+
+        timings = await scheduler.sync(syncers=(scheduler.syncers[1],))
+
+        self.assertEqual(events, [('diff', 'user'), ('written', 'user')])
+        self.assertEqual(list(timings.write), ['user'])
+
+
+if __name__ == '__main__':
+    unittest.main()
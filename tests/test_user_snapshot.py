@@ -0,0 +1,65 @@
+import asyncio
+import pathlib
+import tempfile
+import types
+import unittest
+
+from benchmarks.dataset import make_guilds
+from snek.exts.syncer.executor import SyncExecutor
+from snek.exts.syncer.index import MembershipMirror
+from snek.exts.syncer.state import SyncState
+from snek.exts.syncer.syncers import UserSyncer
+
+
+class UserSnapshotTests(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.guilds = make_guilds(10, 3000)
+
+        self.syncer = UserSyncer(types.SimpleNamespace(guilds=self.guilds), SyncExecutor('loop'))
+        self.directory = tempfile.TemporaryDirectory()
+        self.syncer.state = SyncState(pathlib.Path(self.directory.name) / 'users.json')
+        self.syncer.membership = MembershipMirror.from_guilds(self.guilds)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def leave(self, guild, member):
+        """Remove `member` from `guild` in the cache, and from the mirror as the `Syncer` listener does."""
+        del guild._members[member.id]
+
+        self.syncer.membership.remove(member)
+        if self.syncer.membership_changes is not None:
+            self.syncer.membership_changes.append(('remove', (member,)))
+
+    async def test_yields_to_the_loop(self):
+        snapshot = asyncio.ensure_future(self.syncer.get_cache_objects())
+        await asyncio.sleep(0)
+
+        self.assertFalse(snapshot.done())
+        self.assertEqual(len(await snapshot), len({member.id for guild in self.guilds for member in guild.members}))
+
+    async def test_changes_made_meanwhile_reach_the_mirror(self):
+        guild = self.guilds[0]
+        member = next(member for member in guild.members if len(self.syncer.membership.guilds(member.id)) > 1)
+
+        snapshot = asyncio.ensure_future(self.syncer.get_cache_objects())
+
+        # The first guild is indexed by the time the snapshot first yields
+        await asyncio.sleep(0)
+        self.leave(guild, member)
+        await snapshot
+
+        self.assertNotIn(guild.id, self.syncer.membership.guilds(member.id))
+        self.assertIsNone(self.syncer.membership_changes)
+
+    async def test_dry_run_keeps_the_mirror(self):
+        mirror = self.syncer.membership
+        self.syncer.dry_running = True
+
+        await self.syncer.get_cache_objects()
+
+        self.assertIs(self.syncer.membership, mirror)
+
+
+if __name__ == '__main__':
+    unittest.main()
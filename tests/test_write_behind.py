@@ -0,0 +1,62 @@
+import asyncio
+import unittest
+
+from snek.api.write_behind import WriteBehindQueue
+
+
+class FakeClient:
+    """An API client whose PATCH requests take `latency` seconds, recording the endpoints they were sent to."""
+
+    def __init__(self, latency: float) -> None:
+        self.loop = asyncio.get_event_loop()
+        self.latency = latency
+        self.patched = []
+
+    async def patch(self, endpoint: str, **kwargs) -> None:
+        await asyncio.sleep(self.latency)
+        self.patched.append(endpoint)
+
+    async def map(self, func, items, return_exceptions: bool = False) -> list:
+        return await asyncio.gather(*map(func, items), return_exceptions=return_exceptions)
+
+
+class WriteBehindQueueTests(unittest.IsolatedAsyncioTestCase):
+    async def test_coalesces_patches(self):
+        client = FakeClient(latency=0)
+        queue = WriteBehindQueue(client, window=0.01)
+
+        queue.patch('users/1', {'name': 'a'})
+        queue.patch('users/1', {'discriminator': '0001'})
+        await asyncio.sleep(0.05)
+
+        self.assertEqual(client.patched, ['users/1'])
+        self.assertEqual(len(queue), 0)
+
+    async def test_patch_during_flush_is_sent(self):
+        client = FakeClient(latency=0.1)
+        queue = WriteBehindQueue(client, window=0.01)
+
+        queue.patch('users/1', {'name': 'a'})
+        await asyncio.sleep(0.05)
+
+        # The flush of users/1 is awaiting the API
+        self.assertEqual(len(queue), 0)
+        queue.patch('users/2', {'name': 'b'})
+
+        await asyncio.sleep(0.3)
+
+        self.assertEqual(client.patched, ['users/1', 'users/2'])
+        self.assertEqual(len(queue), 0)
+
+    async def test_close_sends_pending_writes(self):
+        client = FakeClient(latency=0)
+        queue = WriteBehindQueue(client, window=60)
+
+        queue.patch('users/1', {'name': 'a'})
+        await queue.close()
+
+        self.assertEqual(client.patched, ['users/1'])
+
+
+if __name__ == '__main__':
+    unittest.main()